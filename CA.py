@@ -1,17 +1,90 @@
+import json
+from operator import length_hint
+from typing import Callable
+
+import numpy as np
+
 from config import (
-    EMPTY, MOORE_NBD, MUSHROOMS, OLDER
+    EMPTY, YOUNG, MUSHROOMS, OLDER, DEAD1, INERT, MOORE_NBD
+)
+from rules import (
+    STATE_COUNT, THRESHOLD_INHIBITION, PROBABILISTIC_INHIBITION,
+    CompiledRules, RuleTable
+)
+
+from profiling import StepProfiler
+from utils import (
+    convex_hull_xy, apply_kernel, coarsen, coordinate_array, interpolate, refine, save_npz
 )
 
-from utils import Point, convex_hull
+
+def detect_inner_ring_grid(state_grid: dict[tuple[int, int], int]) -> tuple | None:
+    """
+    `convex_hull_xy` of the MUSHROOMS and OLDER cells of a state grid, None
+    if there are none. Only reads `state_grid`, so it can run on a snapshot
+    in another thread.
+    """
+    mushroom_and_older_coordinates = [
+        coordinate for coordinate, state in state_grid.items()
+        if state == MUSHROOMS or state == OLDER
+    ]
+
+    if not mushroom_and_older_coordinates:
+        return None
+
+    ys, xs = np.array(mushroom_and_older_coordinates).T
+    return convex_hull_xy(xs, ys)
+
+
+# Version of the files written by `CA.save_checkpoint`
+CHECKPOINT_VERSION = 1
+
+
+def _coordinate_dict(coordinates: np.ndarray, values: np.ndarray) -> dict:
+    return dict(zip(map(tuple, coordinates.tolist()), values.tolist()))
 
 
 class CA:
-    def __init__(self, n: int):
+    # Rescan every occupied cell and its neighbours each step instead of only
+    # the active cells. Gives the same result, only useful for verification.
+    full_scan: bool = False
+
+    # Declarative description of the model, compiled for the current
+    # parameter values by `compile_rules`
+    rules: RuleTable | None = None
+    compiled_rules: CompiledRules | None = None
+
+    # The toxicity field is stored and diffused on blocks of this many cells
+    # in both directions and interpolated back where cells read it
+    toxin_coarsening: int = 1
+
+    # Records the time of every phase of every step when set, see
+    # `StepProfiler`
+    profiler: StepProfiler | None = None
+
+    def __init__(self, n: int, seed: int | np.random.SeedSequence | None = None):
         assert n > 0, "Grid size must be positive"
         self.n: int = n
-        self.state_grid: dict[tuple[int, int], int] = {}
-        self.toxicity_grid: dict[tuple[int, int], float] = {}
+
+        # Every simulation owns its random stream, so its results do not
+        # depend on what other simulations in the same process are doing
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.default_rng(seed)
+        self._random_block: list[float] = []
+        self._random_iter = iter(self._random_block)
+
+        # Cells that can change in the next step, None if it has to be
+        # rebuilt from the state grid
+        self.active_cells: set[tuple[int, int]] | None = None
+
+        self.state_grid = {}
+        self.toxicity_grid = {}
         self.time = 0
+        self.checked_cells = 0
+        # Cells the last step checked, every other cell kept its state
+        self.checked_coordinates: set[tuple[int, int]] = set()
 
     def get_grid_representation(
         self,
@@ -46,7 +119,7 @@ class CA:
             for x in range(min_x, max_x):
                 if show_toxins:
                     message += str(round(
-                        self.toxicity_grid.get((y, x), 0.0), 1
+                        self.toxicity(x, y), 1
                     )) + " "
                 else:
                     message += str(
@@ -55,32 +128,279 @@ class CA:
             message += "\n"
         return message
 
+    def _find_active_cells(self) -> set[tuple[int, int]]:
+        """
+        Every cell whose transition is not a guaranteed no-op: all occupied
+        cells except INERT ones, and the empty cells bordering a YOUNG cell.
+        """
+        active = set()
+        for (y, x), state in self.state_grid.items():
+            if state == INERT:
+                continue
+            active.add((y, x))
+            if state == YOUNG:
+                for dy, dx in MOORE_NBD:
+                    active.add((y + dy, x + dx))
+        return active
+
     def step(self):
-        new_state_grid = {}
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(self)
         current_state = self.state_grid
 
         # Determine relevant coordinates
-        coords_to_check = set(current_state.keys())
-        for (y, x) in list(coords_to_check):
-            # Add neighbors of active cells
-            for dy, dx in MOORE_NBD:
-                coords_to_check.add((y + dy, x + dx))
+        if self.full_scan:
+            coords_to_check = set(current_state.keys())
+            for (y, x) in list(coords_to_check):
+                # Add neighbors of active cells
+                for dy, dx in MOORE_NBD:
+                    coords_to_check.add((y + dy, x + dx))
+        elif self.active_cells is None:
+            coords_to_check = self._find_active_cells()
+        else:
+            coords_to_check = self.active_cells
+
+        rules = self.compiled_rules
+        fixed_successor = rules.fixed_successor
+
+        # Draw enough random numbers for the whole step in one block
+        self._draw_random(len(coords_to_check) * rules.max_draws_per_cell)
+        if profiler is not None:
+            profiler.mark("gather")
+
+        # Cells that are not checked keep their state. A copy is made so
+        # references to the previous grid stay valid.
+        new_state_grid = current_state.copy()
+        active_cells = set()
+
+        # Fixed order, so the random numbers are consumed identically no
+        # matter which inactive cells were skipped
+        for (y, x) in sorted(coords_to_check):
+            # Deterministic transitions come straight from the rule table,
+            # only the others go through state_transition
+            new_state = fixed_successor[current_state.get((y, x), EMPTY)]
+            if new_state < 0:
+                new_state = self.state_transition(x, y)
 
-        for (y, x) in coords_to_check:
-            new_state = self.state_transition(x, y)
-            if new_state != EMPTY:
-                new_state_grid[(y, x)] = new_state
+            if new_state == EMPTY:
+                new_state_grid.pop((y, x), None)
+                continue
 
+            new_state_grid[(y, x)] = new_state
+            if new_state == INERT:
+                continue
+            active_cells.add((y, x))
+            if new_state == YOUNG:
+                for dy, dx in MOORE_NBD:
+                    active_cells.add((y + dy, x + dx))
+
+        del self.random
         self.state_grid = new_state_grid
+        self.active_cells = active_cells
+        self.checked_cells = len(coords_to_check)
+        self.checked_coordinates = coords_to_check
+        if profiler is not None:
+            profiler.mark("state_transition")
 
-        toxicity_grid = self.toxin_transition()
-        self.toxicity_grid = toxicity_grid
+        self.toxin_field = self.toxin_transition()
         self.time += 1
+        if profiler is not None:
+            profiler.mark("toxin_transition")
+            profiler.end(self)
+
+    def settled(self) -> bool:
+        """
+        Whether no cell can change its state anymore, because every cell is
+        empty or INERT. This includes a colony that died out. Toxins may
+        still diffuse and decay, but without living cells they no longer
+        affect the states.
+        """
+        if self.active_cells is None:
+            self.active_cells = self._find_active_cells()
+        return not self.active_cells
+
+    def run(self, steps: int, until: Callable[[], bool] | None = None) -> int:
+        """
+        Step the simulation, stopping early once `until()` holds after a step
+
+            sim.run(50, until=sim.settled)
+
+        :param steps: largest amount of steps to take
+        :type steps: int
+        :param until: stopping hook called after every step, e.g.
+            `sim.settled`
+        :type until: Callable | None
+        :return: Returns the amount of steps taken
+        :rtype: int
+        """
+        for step in range(steps):
+            self.step()
+            if until is not None and until():
+                return step + 1
+        return steps
+
+    def save_checkpoint(self, path: str):
+        """
+        Save everything needed to continue the simulation exactly where it
+        is: the grids as coordinate and value arrays, the time, the
+        parameters and the random stream, including the numbers drawn but
+        not used yet. The file is an uncompressed `.npz`, written next to
+        `path` and moved in place, so a crash never leaves half a
+        checkpoint. The dense and tiled engines store their arrays instead,
+        see `DenseCA`.
+
+            sim.save_checkpoint("run.ckpt.npz")
+            sim = ProbToxinSim.load_checkpoint("run.ckpt.npz")
+
+        :param path: file to write
+        :type path: str
+        """
+        header = {
+            "version": CHECKPOINT_VERSION,
+            "model": type(self).__name__,
+            "parameters": self._checkpoint_parameters(),
+            "time": self.time,
+            "checked_cells": self.checked_cells,
+            "entropy": self.seed_sequence.entropy,
+            "spawn_key": list(self.seed_sequence.spawn_key),
+            "rng": self.rng.bit_generator.state,
+        }
+        arrays = self._checkpoint_arrays(header)
+        arrays["header"] = np.array(json.dumps(header))
+        save_npz(path, arrays)
+
+    def _checkpoint_parameters(self) -> dict:
+        names = ("n",) + (self.rules.parameters if self.rules is not None else ())
+        parameters = {name: np.asarray(getattr(self, name)).tolist() for name in names}
+        if self.rules is not None and self.rules.has_toxins:
+            parameters["toxin_coarsening"] = self.toxin_coarsening
+        return parameters
+
+    def _checkpoint_arrays(self, header: dict) -> dict[str, np.ndarray]:
+        """
+        Arrays of the grids for `save_checkpoint`, anything else to restore
+        them goes in `header`
+        """
+        used = len(self._random_block) - length_hint(self._random_iter)
+        header["has_active_cells"] = self.active_cells is not None
+
+        states = self.state_grid
+        # The toxin field as it is stored, coarsened or not
+        toxins = self.toxin_field
+        active = self.active_cells or ()
+        return {
+            "state_coordinates": coordinate_array(states.keys()),
+            "state_values": np.fromiter(states.values(), dtype=np.uint8, count=len(states)),
+            "toxin_coordinates": coordinate_array(toxins.keys()),
+            "toxin_values": np.fromiter(toxins.values(), dtype=np.float64, count=len(toxins)),
+            "active_cells": coordinate_array(active),
+            "random_block": np.array(self._random_block[used:], dtype=np.float64),
+        }
+
+    @classmethod
+    def load_checkpoint(cls, path: str) -> "CA":
+        """
+        Simulation restored from `save_checkpoint`, stepping it gives the
+        same results as stepping the simulation that was saved
+
+        :param path: checkpoint file
+        :type path: str
+        :return: Returns the restored simulation
+        :rtype: CA
+        """
+        with np.load(path) as arrays:
+            header = json.loads(arrays["header"].item())
+            if header["version"] != CHECKPOINT_VERSION:
+                raise ValueError(f"Unknown checkpoint version {header['version']}")
+            if header["model"] != cls.__name__:
+                raise ValueError(f"Checkpoint of a {header['model']}, not a {cls.__name__}")
+
+            seed = np.random.SeedSequence(header["entropy"], spawn_key=header["spawn_key"])
+            sim = cls._from_checkpoint(header, seed)
+            sim.rng.bit_generator.state = header["rng"]
+            sim._restore_checkpoint(header, arrays)
+
+        sim.time = header["time"]
+        sim.checked_cells = header["checked_cells"]
+        return sim
+
+    @classmethod
+    def _from_checkpoint(cls, header: dict, seed: np.random.SeedSequence) -> "CA":
+        return cls(header["parameters"], seed)
+
+    def _restore_checkpoint(self, header: dict, arrays):
+        """
+        Restore the grids saved by `_checkpoint_arrays`
+        """
+        self._random_block = arrays["random_block"].tolist()
+        self._random_iter = iter(self._random_block)
+
+        self.state_grid = _coordinate_dict(arrays["state_coordinates"], arrays["state_values"])
+        self.toxin_field = _coordinate_dict(arrays["toxin_coordinates"], arrays["toxin_values"])
+        if header["has_active_cells"]:
+            self.active_cells = set(map(tuple, arrays["active_cells"].tolist()))
+
+    @property
+    def state_grid(self) -> dict[tuple[int, int], int]:
+        """
+        State of every occupied cell. Assigning a new grid rebuilds the
+        active cells at the next step.
+        """
+        return self._state_grid
+
+    @state_grid.setter
+    def state_grid(self, grid: dict[tuple[int, int], int]):
+        self._state_grid = grid
+        self.active_cells = None
+
+    @property
+    def toxicity_grid(self) -> dict[tuple[int, int], float]:
+        """
+        Toxicity of every cell. Built on access from `toxin_field` when the
+        field is coarsened.
+        """
+        if self.toxin_coarsening == 1:
+            return self.toxin_field
+        return refine(self.toxin_field, self.toxin_coarsening)
+
+    @toxicity_grid.setter
+    def toxicity_grid(self, grid: dict[tuple[int, int], float]):
+        if self.toxin_coarsening == 1:
+            self.toxin_field = grid
+        else:
+            self.toxin_field = coarsen(grid, self.toxin_coarsening)
+
+    def toxicity(self, x: int, y: int) -> float:
+        """
+        Toxicity of a single cell
+        """
+        if self.toxin_coarsening == 1:
+            return self.toxin_field.get((y, x), 0.0)
+        return interpolate(self.toxin_field, self.toxin_coarsening, y, x)
+
+    def set_toxin_coarsening(self, factor: int):
+        """
+        Store the toxicity field on blocks of `factor` x `factor` cells,
+        converting the current field
+        """
+        assert factor >= 1, "Coarsening factor must be positive"
+        # Refining and coarsening again blurs the field, so it is only
+        # converted when the factor changes
+        if factor == self.toxin_coarsening:
+            return
+        grid = self.toxicity_grid
+        self.toxin_coarsening = factor
+        self.toxicity_grid = grid
+        # The diffusion kernels are compiled for the factor
+        if self.compiled_rules is not None:
+            self.compile_rules()
 
     def reset(self):
         self.state_grid = {}
         self.toxicity_grid = {}
         self.time = 0
+        self.active_cells = None
 
     def set_state(self, x: int, y: int, state: int):
         """
@@ -96,6 +416,8 @@ class CA:
         """
         assert 0 <= x < self.n, f"x coordinate {x} out of bounds (0-{self.n-1})"
         assert 0 <= y < self.n, f"y coordinate {y} out of bounds (0-{self.n-1})"
+        if not 0 <= state < STATE_COUNT:
+            raise ValueError(f"Unknown state {state}")
 
         if state == EMPTY:
             if (y, x) in self.state_grid:
@@ -103,9 +425,16 @@ class CA:
         else:
             self.state_grid[(y, x)] = state
 
+        if self.active_cells is not None:
+            self.active_cells.add((y, x))
+            if state == YOUNG:
+                for dy, dx in MOORE_NBD:
+                    self.active_cells.add((y + dy, x + dx))
+
     def set_toxicity(self, x: int, y: int, toxicity: float):
         """
-        Set the toxicity of a single cell value
+        Set the toxicity of a single cell value. With a coarsened field this
+        sets the whole block the cell is in.
 
         :param self: Description
         :param x: 0 indexed coordinate
@@ -115,26 +444,163 @@ class CA:
         :param toxicity: Description
         :type toxicity: float
         """
+        factor = self.toxin_coarsening
+        key = (y // factor, x // factor)
         if toxicity <= 0:
-            if (y, x) in self.toxicity_grid:
-                del self.toxicity_grid[(y, x)]
+            if key in self.toxin_field:
+                del self.toxin_field[key]
         else:
-            self.toxicity_grid[(y, x)] = toxicity
+            self.toxin_field[key] = toxicity
+
+    def _draw_random(self, amount: int):
+        """
+        Make at least `amount` random numbers available through `random`,
+        which then hands them out with a C-level iterator instead of one
+        generator call per decision. Numbers left over from the previous block
+        come first, so the stream does not depend on the block sizes.
+        """
+        used = len(self._random_block) - length_hint(self._random_iter)
+        block = self._random_block[used:]
+        if len(block) < amount:
+            block += self.rng.random(amount - len(block)).tolist()
+
+        self._random_block = block
+        self._random_iter = iter(block)
+        self.random = self._random_iter.__next__
+
+    def random(self) -> float:
+        """
+        Next number of the simulation's random stream. Only used outside of
+        `step`, which replaces it by an iterator over a pre-drawn block.
+        """
+        self._draw_random(1)
+        value = self.random()
+        del self.random
+        return value
 
-    def state_transition(self, x, y) -> int:
-        raise NotImplementedError
+    def compile_rules(self):
+        """
+        Compile `rules` for the current parameter values. Has to be called
+        again whenever a parameter changes.
+        """
+        self.compiled_rules = self.rules.compile(self)
+
+    def state_transition(self, x: int, y: int) -> int:
+        rules = self.compiled_rules
+        state = self.state_grid.get((y, x), EMPTY)
+
+        if state == EMPTY:
+            return self.spread_transition(x, y)
+
+        if rules.toxin_death[state]:
+            if self.random() < self.toxicity(x, y):
+                return DEAD1
+
+        if rules.has_branch[state]:
+            if self.random() < rules.branch_probability[state]:
+                return rules.branch_target[state]
+
+        return rules.successor[state]
+
+    def spread_transition(self, x: int, y: int) -> int:
+        """
+        Transition of an empty cell, which every YOUNG neighbour gets a chance
+        to grow into unless toxins stop it
+        """
+        rules = self.compiled_rules
+        state_grid = self.state_grid
+        toxicity = self.toxicity(x, y)
+
+        inhibition = rules.spread_inhibition
+        if inhibition == THRESHOLD_INHIBITION and toxicity > rules.toxin_threshold:
+            return EMPTY
+
+        for (dx, dy), spread in zip(MOORE_NBD, rules.spread_probability):
+            # No boundary check needed for infinite grid
+            if not state_grid.get((y + dy, x + dx), EMPTY) == YOUNG:
+                continue
+            if inhibition == PROBABILISTIC_INHIBITION:
+                if self.random() < toxicity:
+                    continue
+            if self.random() < spread:
+                return YOUNG
+        return EMPTY
 
     def toxin_transition(self) -> dict:
-        raise NotImplementedError
+        rules = self.compiled_rules
+        if not rules.table.has_toxins:
+            return {}
 
-    def inner_ring_detector(self) -> tuple | None:
+        releases_toxin = rules.releases_toxin
         state_grid = self.state_grid
-        mushroom_and_older_coordinates = []
-        for (y, x) in state_grid.keys():
-            if state_grid[(y, x)] == MUSHROOMS or state_grid[(y, x)] == OLDER:
-                mushroom_and_older_coordinates.append(Point(x, y))
+        toxin_field = self.toxin_field
+        factor = self.toxin_coarsening
+
+        if factor > 1:
+            source_grid = self._coarse_toxin_source(releases_toxin)
+        else:
+            source_grid = {}
+
+            # Consider all existing toxicity
+            for (y, x), val in toxin_field.items():
+                state = state_grid.get((y, x), EMPTY)
+                if releases_toxin[state]:
+                    source_grid[(y, x)] = 1
+                else:
+                    new_val = max(val - self.toxin_decay, 0)
+                    if new_val > 0:
+                        source_grid[(y, x)] = new_val
 
-        if not mushroom_and_older_coordinates:
-            return None
+            # Consider all toxin releasing states
+            for (y, x), state in state_grid.items():
+                if releases_toxin[state]:
+                    source_grid[(y, x)] = 1
 
-        return convex_hull(mushroom_and_older_coordinates)
+        new_toxicity_grid = apply_kernel(
+            source_grid,
+            rules.kernel(self.toxin_convolution_size, self.toxin_convolution_variance)
+        )
+
+        return new_toxicity_grid
+
+    def _coarse_toxin_source(self, releases_toxin: list) -> dict:
+        """
+        Toxin source of a coarsened field: the block mean of what the full
+        resolution source would be, assuming toxicity is uniform in a block
+        """
+        factor = self.toxin_coarsening
+        area = factor * factor
+
+        releasing = {}
+        for (y, x), state in self.state_grid.items():
+            if releases_toxin[state]:
+                block = (y // factor, x // factor)
+                releasing[block] = releasing.get(block, 0) + 1
+
+        source_grid = {}
+        for block, val in self.toxin_field.items():
+            new_val = max(val - self.toxin_decay, 0)
+            if new_val > 0:
+                source_grid[block] = new_val
+
+        # Releasing cells are set to 1, the others decay
+        for block, count in releasing.items():
+            share = count / area
+            source_grid[block] = share + (1 - share) * source_grid.get(block, 0)
+
+        return source_grid
+
+    def inner_ring_detector(self) -> tuple | None:
+        if self.profiler is None:
+            return self._detect_inner_ring()
+        with self.profiler.phase("ring_detection"):
+            return self._detect_inner_ring()
+
+    def _detect_inner_ring(self) -> tuple | None:
+        return detect_inner_ring_grid(self.state_grid)
+
+    def cell_counts(self) -> tuple[int, int]:
+        """
+        Amount of non-empty state cells and of stored toxin cells
+        """
+        return len(self.state_grid), len(self.toxin_field)
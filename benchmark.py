@@ -0,0 +1,275 @@
+"""
+Benchmarks of the engine and the analysis functions, with a history of
+every run to compare against
+
+    python benchmark.py run --label "before"
+    python benchmark.py run --label "after"
+    python benchmark.py compare before after
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+
+import transitions
+import utils
+from CA import CA
+from cli import grown, models
+from config import SPORE, sim_parameters
+from viewport import dict_to_grid
+
+
+HISTORY = "data/benchmarks.jsonl"
+
+# Steps grown from a single spore before a step is timed, the ring radius
+# grows by about one cell per step
+RING_SIZES = (10, 25, 50)
+KERNEL_SIZES = (1, 3, 5, 7, 9, 11)
+DECAYS = (0.0, 0.05, 0.1)
+
+# Relative slowdown from which `compare` reports a regression
+THRESHOLD = 0.1
+
+
+def time_step(sim: CA) -> Callable[[], Callable]:
+    """
+    Setup of a benchmark of a single step: every repetition starts from
+    the same grids, so the ring does not grow while it is timed
+    """
+    states = dict(sim.state_grid)
+    toxins = dict(sim.toxin_field)
+    active = None if sim.active_cells is None else set(sim.active_cells)
+    start = sim.time
+
+    def setup():
+        sim.state_grid = dict(states)
+        sim.toxin_field = dict(toxins)
+        # The same active cells as when it was grown, not rebuilt from the grid
+        sim.active_cells = None if active is None else set(active)
+        sim.time = start
+        return sim.step
+    return setup
+
+
+def benchmarks(quick: bool = False) -> Iterator[tuple[str, Callable[[], Callable[[], Callable]]]]:
+    """
+    (name, factory) of every benchmark. `factory()` builds the fixture and
+    returns its setup, so only the benchmarks that are run grow a
+    simulation. `setup()` is not timed and returns the function that is.
+    """
+    ring_sizes = RING_SIZES[:2] if quick else RING_SIZES
+    middle = ring_sizes[-1]
+
+    for name, model in models().items():
+        for steps in ring_sizes:
+            yield (f"step/{name}/ring={steps}",
+                   lambda model=model, steps=steps: time_step(grown(model, steps)))
+
+    toxin_model = transitions.ProbToxinSim
+    for size in KERNEL_SIZES:
+        yield (f"step/ProbToxinSim/kernel={size}",
+               lambda size=size: time_step(grown(toxin_model, middle, toxin_convolution_size=size)))
+    for decay in DECAYS:
+        yield (f"step/ProbToxinSim/decay={decay}",
+               lambda decay=decay: time_step(grown(toxin_model, middle, toxin_decay=decay)))
+
+    # The analysis benchmarks share one simulation, grown by the first that runs
+    shared = []
+
+    def fixture() -> CA:
+        if not shared:
+            shared.append(grown(toxin_model, middle))
+        return shared[0]
+
+    def diffusion(size: int) -> Callable:
+        toxins = dict(fixture().toxicity_grid)
+        variance = sim_parameters["toxin_convolution_variance"]
+        return lambda: lambda: utils.apply_diffusion(toxins, size, variance)
+
+    for size in (3, 5, 11):
+        yield f"apply_diffusion/kernel={size}", lambda size=size: diffusion(size)
+
+    def ring() -> Callable:
+        sim = fixture()
+        return lambda: sim.inner_ring_detector
+    yield "inner_ring_detector", ring
+
+    def hull() -> Callable:
+        points = [utils.Point(x, y) for y, x in fixture().state_grid]
+        return lambda: lambda: utils.convex_hull(points)
+    yield "convex_hull", hull
+
+    def bootstrap() -> Callable:
+        # Synthetic diameters and ages, so the benchmark does not need the data
+        rng = np.random.default_rng(0)
+        diameters = rng.uniform(1, 60, 100)
+        regression = np.column_stack([diameters, 8 * diameters + rng.normal(0, 40, 100)])
+        return lambda: lambda: utils.bootstrap_slope_ci(regression)
+    yield "bootstrap_slope_ci", bootstrap
+
+    def grid() -> Callable:
+        state_grid = dict(fixture().state_grid)
+        return lambda: lambda: dict_to_grid(state_grid, sim_parameters["n"])
+    yield "dict_to_grid", grid
+
+
+def measure(setup: Callable[[], Callable], repeats: int = 7,
+            min_time: float = 0.05) -> dict:
+    """
+    Time a benchmark `repeats` times. A repetition calls the function as
+    often as it takes to fill `min_time`, after a fresh `setup()` for every
+    call.
+
+    :param setup: returns the function to time
+    :type setup: Callable
+    :param repeats: amount of repetitions
+    :type repeats: int
+    :param min_time: seconds every repetition lasts at least
+    :type min_time: float
+    :return: median and fastest seconds per call, and the amount of calls
+    :rtype: dict
+    """
+    times = []
+    calls = 0
+    for _ in range(repeats):
+        elapsed, count = 0.0, 0
+        while elapsed < min_time or not count:
+            function = setup()
+            start = time.perf_counter()
+            function()
+            elapsed += time.perf_counter() - start
+            count += 1
+        times.append(elapsed / count)
+        calls += count
+    return {"median": statistics.median(times), "min": min(times), "calls": calls}
+
+
+def run(label: str | None = None, quick: bool = False, match: str = "",
+        repeats: int = 7, progress: bool = True) -> dict:
+    """
+    Run the benchmarks whose name contains `match`
+
+    :return: record of the run for the history, with the seconds per call
+        of every benchmark under "results"
+    :rtype: dict
+    """
+    results = {}
+    for name, factory in benchmarks(quick):
+        if match not in name:
+            continue
+        results[name] = measure(factory(), repeats)
+        if progress:
+            print(f"{name:40s} {results[name]['median'] * 1e3:10.3f} ms", file=sys.stderr)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "label": label,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "machine": platform.node(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+
+
+def load_history(path: str = HISTORY) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def append_history(record: dict, path: str = HISTORY):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def find_run(history: list[dict], reference: str) -> dict:
+    """
+    A run by label, or by index into the history, e.g. -1 for the newest
+    """
+    for record in reversed(history):
+        if record.get("label") == reference:
+            return record
+    try:
+        return history[int(reference)]
+    except (ValueError, IndexError):
+        raise ValueError(f"No benchmark run {reference!r} in the history") from None
+
+
+def compare(base: dict, head: dict, threshold: float = THRESHOLD) -> list[tuple]:
+    """
+    Compare the median times of the benchmarks both runs have
+
+    :return: (name, base seconds, head seconds, head / base, verdict) of
+        every benchmark, the verdict is "regression", "faster" or ""
+    :rtype: list[tuple]
+    """
+    rows = []
+    for name, result in head["results"].items():
+        if name not in base["results"]:
+            continue
+        before, after = base["results"][name]["median"], result["median"]
+        ratio = after / before if before > 0 else math.inf
+        verdict = ""
+        if ratio > 1 + threshold:
+            verdict = "regression"
+        elif ratio < 1 / (1 + threshold):
+            verdict = "faster"
+        rows.append((name, before, after, ratio, verdict))
+    return rows
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--history", default=HISTORY, help="history file, one JSON run per line")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and add them to the history")
+    run_parser.add_argument("--label", help="name of the run, for comparing")
+    run_parser.add_argument("--quick", action="store_true", help="skip the largest rings")
+    run_parser.add_argument("--match", default="", help="only run benchmarks containing this")
+    run_parser.add_argument("--repeats", type=int, default=7)
+
+    compare_parser = commands.add_parser("compare", help="compare two runs in the history")
+    compare_parser.add_argument("base", nargs="?", default="-2", help="label or index, default -2")
+    compare_parser.add_argument("head", nargs="?", default="-1", help="label or index, default -1")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                                help="relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        record = run(args.label, args.quick, args.match, args.repeats)
+        append_history(record, args.history)
+        return
+
+    history = load_history(args.history)
+    base, head = find_run(history, args.base), find_run(history, args.head)
+    rows = compare(base, head, args.threshold)
+    print(f"{'benchmark':40s} {'base ms':>10s} {'head ms':>10s} {'ratio':>7s}")
+    for name, before, after, ratio, verdict in rows:
+        print(f"{name:40s} {before * 1e3:10.3f} {after * 1e3:10.3f} {ratio:7.2f} {verdict}")
+
+    # A failing exit status, so scripts can stop on a regression
+    if any(verdict == "regression" for *_, verdict in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Headless runner for the models in `transitions.py`, for batch jobs on
+machines without a display. Never imports tkinter or matplotlib.
+
+    python cli.py ProbToxinSim --steps 100 --seed 42 \\
+        --set toxin_decay=0.02 --every 10 --output run.npz
+"""
+import argparse
+import ast
+import inspect
+import json
+import sys
+
+import numpy as np
+
+import transitions
+from CA import CA
+from config import SPORE, sim_parameters
+from trajectory import TrajectoryWriter
+from utils import coordinate_array
+
+
+def models() -> dict[str, type]:
+    """
+    Every runnable model class in `transitions.py` by name
+    """
+    return {
+        name: cls for name, cls in vars(transitions).items()
+        if inspect.isclass(cls) and issubclass(cls, CA) and cls.rules is not None
+    }
+
+
+def grown(model: type, steps: int, seed: int | None = 0, **changes) -> CA:
+    """
+    Simulation of `model` grown from a single spore in the middle of the
+    grid for `steps` steps, with `changes` to the default parameters
+    """
+    parameters = dict(sim_parameters, **changes)
+    sim = model(parameters, seed)
+    sim.set_state(parameters["n"] // 2, parameters["n"] // 2, SPORE)
+    sim.run(steps)
+    return sim
+
+
+def parse_assignment(text: str) -> tuple[str, object]:
+    """
+    Split a `name=value` argument, the value is read as a Python literal
+    and kept as a string otherwise
+    """
+    name, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Expected name=value, got {text!r}")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def snapshot(sim: CA) -> dict[str, np.ndarray]:
+    """
+    Sparse copy of the grids: coordinates and values of every non-empty cell
+    """
+    states = sim.state_grid
+    toxins = sim.toxicity_grid
+    return {
+        "coordinates": coordinate_array(states),
+        "states": np.fromiter(states.values(), dtype=np.uint8, count=len(states)),
+        "toxin_coordinates": coordinate_array(toxins),
+        "toxins": np.fromiter(toxins.values(), dtype=np.float64, count=len(toxins)),
+    }
+
+
+def simulate(model: type, parameters: dict, steps: int, seed: int | None = None,
+             every: int = 1, snapshot_every: int = 0,
+             until_settled: bool = False, trajectory: str | None = None) -> dict:
+    """
+    Run one simulation from a single spore in the middle of the grid and
+    measure it every `every` steps
+
+    :param model: transitions class to simulate
+    :type model: type
+    :param parameters: simulation parameters
+    :type parameters: dict
+    :param steps: largest amount of steps to simulate
+    :type steps: int
+    :param seed: seed of the simulation
+    :type seed: int | None
+    :param every: steps between measurements
+    :type every: int
+    :param snapshot_every: steps between snapshots of the grids, 0 for only
+        the last step
+    :type snapshot_every: int
+    :param until_settled: stop once no cell can change anymore
+    :type until_settled: bool
+    :param trajectory: directory to stream every step to, see
+        `TrajectoryWriter`
+    :type trajectory: str | None
+    :return: measurements as arrays and the snapshots by step
+    :rtype: dict
+    """
+    assert every > 0, "Measurement interval must be positive"
+    sim = model(parameters, seed)
+    sim.set_state(parameters["n"] // 2, parameters["n"] // 2, SPORE)
+
+    writer = None
+    if trajectory is not None:
+        writer = TrajectoryWriter(trajectory, metadata={
+            "model": model.__name__, "parameters": parameters, "seed": seed})
+        writer.record(sim)
+
+    def after_step() -> bool:
+        if writer is not None:
+            writer.record(sim)
+        return until_settled and sim.settled()
+
+    times, cells, ring_ratios = [], [], []
+    snapshots = {}
+    while sim.time < steps:
+        requested = min(every, steps - sim.time)
+        taken = sim.run(requested, until=after_step)
+
+        ring = sim.inner_ring_detector()
+        times.append(sim.time)
+        cells.append(len(sim.state_grid))
+        ring_ratios.append(np.nan if ring is None else ring[0])
+        if snapshot_every and sim.time % snapshot_every == 0:
+            snapshots[sim.time] = snapshot(sim)
+
+        if taken < requested:
+            break
+    snapshots[sim.time] = snapshot(sim)
+    if writer is not None:
+        writer.close()
+
+    return {
+        "metrics": {
+            "time": np.array(times, dtype=np.int64),
+            "cells": np.array(cells, dtype=np.int64),
+            "ring_ratio": np.array(ring_ratios, dtype=float),
+        },
+        "snapshots": snapshots,
+    }
+
+
+def write_json(file, header: dict, result: dict):
+    # NaN is not valid JSON, missing rings are written as null
+    def listed(values: np.ndarray) -> list:
+        if values.dtype.kind == "f":
+            return [None if np.isnan(value) else value for value in values.tolist()]
+        return values.tolist()
+
+    document = dict(header)
+    document["metrics"] = {name: listed(values) for name, values in result["metrics"].items()}
+    document["snapshots"] = [
+        dict(time=time, **{name: listed(values) for name, values in arrays.items()})
+        for time, arrays in result["snapshots"].items()
+    ]
+    json.dump(document, file)
+
+
+def write_npz(path: str, header: dict, result: dict):
+    arrays = {"header": np.array(json.dumps(header))}
+    arrays.update(result["metrics"])
+    for time, snapshot_arrays in result["snapshots"].items():
+        for name, values in snapshot_arrays.items():
+            arrays[f"snapshot_{time}_{name}"] = values
+    np.savez_compressed(path, **arrays)
+
+
+def main(argv: list[str] | None = None):
+    available = models()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("model", choices=sorted(available), help="transitions class to run")
+    parser.add_argument("--steps", type=int, default=50, help="steps to simulate")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the simulation")
+    parser.add_argument("--parameters", help="JSON file with parameters to use over the defaults")
+    parser.add_argument("--set", type=parse_assignment, action="append", default=[],
+                        metavar="NAME=VALUE", help="set a single parameter, may be repeated")
+    parser.add_argument("--every", type=int, default=1, help="steps between measurements")
+    parser.add_argument("--snapshot-every", type=int, default=0,
+                        help="steps between snapshots of the grids, 0 for only the last step")
+    parser.add_argument("--until-settled", action="store_true",
+                        help="stop once no cell can change anymore")
+    parser.add_argument("--trajectory", help="directory to stream every step to")
+    parser.add_argument("--output", "-o", default="-",
+                        help="output file, .npz for NumPy arrays, JSON otherwise, - for stdout")
+    args = parser.parse_args(argv)
+
+    parameters = dict(sim_parameters)
+    if args.parameters:
+        with open(args.parameters) as file:
+            parameters.update(json.load(file))
+    parameters.update(args.set)
+
+    result = simulate(available[args.model], parameters, args.steps, args.seed,
+                      args.every, args.snapshot_every, args.until_settled,
+                      args.trajectory)
+    header = {"model": args.model, "parameters": parameters, "seed": args.seed,
+              "steps": args.steps}
+
+    if args.output.endswith(".npz"):
+        write_npz(args.output, header, result)
+    elif args.output == "-":
+        write_json(sys.stdout, header, result)
+    else:
+        with open(args.output, "w") as file:
+            write_json(file, header, result)
+
+
+if __name__ == "__main__":
+    main()
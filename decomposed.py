@@ -0,0 +1,306 @@
+import os
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import EMPTY
+from dense import DenseCA, detect_inner_ring
+from utils import grid_to_dict
+
+
+def _occupied_window(mask: np.ndarray, margin: int) -> tuple[int, int, int, int] | None:
+    """
+    Bounding box (start_y, stop_y, start_x, stop_x) of the True cells of
+    `mask` grown by `margin`, clipped to the mask. None if there are none.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+
+    h, w = mask.shape
+    return (max(rows[0] - margin, 0), min(rows[-1] + margin + 1, h),
+            max(cols[0] - margin, 0), min(cols[-1] + margin + 1, w))
+
+
+class _StripWorker:
+    """
+    Steps the rows [start, stop) of a shared domain. The rows of the other
+    strips are read straight from shared memory as halo.
+    """
+    def __init__(self, model: type[DenseCA], parameters: dict,
+                 seed: np.random.SeedSequence, rows: tuple[int, int],
+                 names: list[str]):
+        # The model only supplies the rules and work arrays, its own grid is
+        # kept minimal
+        self.sim = model(dict(parameters, n=1), seed)
+        self.n = parameters["n"]
+        self.rows = rows
+
+        # Attached blocks are owned by the parent, which unlinks them
+        self._blocks = [shared_memory.SharedMemory(name, track=False) for name in names]
+        self.states, self.toxins = _domain_arrays(self._blocks, self.n)
+        self._fit_workspace()
+
+    def _fit_workspace(self):
+        """
+        Size the work arrays of the model to a strip with its largest halo
+        """
+        halo = max(1, self.sim.toxin_margin())
+        start, stop = self.rows
+        shape = (min(stop - start + 2 * halo, self.n), self.n)
+        if self.sim._state.shape != shape:
+            self.sim._state = np.zeros(shape, dtype=np.int8)
+            self.sim._allocate_buffers()
+
+    def change_parameters(self, parameters: dict):
+        self.sim.change_parameters(dict(parameters, n=1))
+        self._fit_workspace()
+
+    def _own_rows(self, start_y: int, stop_y: int) -> tuple[slice, slice]:
+        """
+        Rows of the strip inside the window [start_y, stop_y), in domain and
+        in window coordinates
+        """
+        start = max(start_y, self.rows[0])
+        stop = max(min(stop_y, self.rows[1]), start)
+        return slice(start, stop), slice(start - start_y, stop - start_y)
+
+    def state_phase(self, front: int):
+        sim = self.sim
+        start, stop = self.rows
+        state, toxin = self.states[front], self.toxins[front]
+        new_state = self.states[1 - front]
+
+        new_state[start:stop] = EMPTY
+        lo, hi = max(start - 1, 0), min(stop + 1, self.n)
+        bounds = _occupied_window(state[lo:hi] != EMPTY, 1)
+        if bounds is None:
+            return
+
+        y0, y1, x0, x1 = bounds
+        y0, y1 = y0 + lo, y1 + lo
+        window = (Ellipsis, slice(0, y1 - y0), slice(0, x1 - x0))
+        out = sim._next_state[window]
+        sim.state_step(state[y0:y1, x0:x1], toxin[y0:y1, x0:x1], out, window)
+
+        rows, out_rows = self._own_rows(y0, y1)
+        new_state[rows, x0:x1] = out[out_rows]
+
+    def toxin_phase(self, front: int):
+        sim = self.sim
+        start, stop = self.rows
+        toxin = self.toxins[front]
+        new_state, new_toxin = self.states[1 - front], self.toxins[1 - front]
+
+        new_toxin[start:stop] = 0.0
+        if not sim.rules.has_toxins:
+            return
+
+        margin = sim.toxin_margin()
+        lo, hi = max(start - margin, 0), min(stop + margin, self.n)
+        releasing = sim.compiled_rules.releases_toxin_array[new_state[lo:hi]]
+        bounds = _occupied_window((toxin[lo:hi] > 0) | releasing, margin)
+        if bounds is None:
+            return
+
+        y0, y1, x0, x1 = bounds
+        y0, y1 = y0 + lo, y1 + lo
+        window = (Ellipsis, slice(0, y1 - y0), slice(0, x1 - x0))
+        out = sim._next_toxin[window]
+        sim.toxin_step(new_state[y0:y1, x0:x1], toxin[y0:y1, x0:x1], out, window)
+
+        rows, out_rows = self._own_rows(y0, y1)
+        new_toxin[rows, x0:x1] = out[out_rows]
+
+    def close(self):
+        self.states = self.toxins = None
+        for block in self._blocks:
+            block.close()
+
+
+def _domain_arrays(blocks: list, n: int) -> tuple[list, list]:
+    """
+    Double-buffered state and toxicity arrays backed by shared memory blocks
+    """
+    states = [np.ndarray((n, n), dtype=np.int8, buffer=block.buf) for block in blocks[:2]]
+    toxins = [np.ndarray((n, n), dtype=np.float64, buffer=block.buf) for block in blocks[2:]]
+    return states, toxins
+
+
+def _run_worker(model, parameters, seed, rows, names, barrier, connection):
+    worker = _StripWorker(model, parameters, seed, rows, names)
+    try:
+        while True:
+            command, argument = connection.recv()
+            if command == "stop":
+                break
+
+            try:
+                if command == "run":
+                    front, steps = argument
+                    # Every phase reads the halo rows other workers wrote in
+                    # the phase before, so all of them wait for each other
+                    for _ in range(steps):
+                        worker.state_phase(front)
+                        barrier.wait()
+                        worker.toxin_phase(front)
+                        barrier.wait()
+                        front = 1 - front
+                elif command == "parameters":
+                    worker.change_parameters(argument)
+                connection.send(None)
+            except Exception as error:
+                barrier.abort()
+                connection.send(error)
+    finally:
+        worker.close()
+
+
+class DecomposedSim:
+    """
+    A single simulation of a dense model split over worker processes. The
+    n x n domain is cut into horizontal strips, one per worker, and the
+    double-buffered state and toxicity arrays live in shared memory. Every
+    step the workers update their own strip, reading the rows of their
+    neighbours as halo: one row for the states, then toxin_convolution_size
+    // 2 rows for the diffusion, with a barrier after each phase.
+
+    Unlike the other engines the domain does not grow, cells outside of it
+    stay empty. Parameters have to be scalars.
+
+        with DecomposedSim(DenseProbToxinSim, parameters, workers=16) as sim:
+            sim.set_state(n // 2, n // 2, SPORE)
+            sim.run(1000)
+    """
+    def __init__(
+        self,
+        model: type[DenseCA],
+        parameters: dict,
+        workers: int | None = None,
+        seed: int | np.random.SeedSequence | None = None
+    ):
+        self.n: int = parameters["n"]
+        workers = min(workers or os.cpu_count() or 1, self.n)
+        assert workers > 0, "Need at least one worker"
+        self.workers: int = workers
+        self.time = 0
+        # Error of the worker that failed, the strips are out of step after
+        # it so the simulation can not continue
+        self.failure: Exception | None = None
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+
+        sizes = 2 * [self.n * self.n] + 2 * [self.n * self.n * 8]
+        self._blocks = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        self._states, self._toxins = _domain_arrays(self._blocks, self.n)
+        for array in self._states + self._toxins:
+            array.fill(0)
+        self._front = 0
+
+        bounds = np.linspace(0, self.n, workers + 1).astype(int).tolist()
+        names = [block.name for block in self._blocks]
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(workers)
+
+        self._connections = []
+        self._processes = []
+        for i, worker_seed in enumerate(seed.spawn(workers)):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(model, parameters, worker_seed, (bounds[i], bounds[i + 1]),
+                      names, barrier, worker_connection),
+                daemon=True
+            )
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _command(self, command: str, argument=None):
+        if self.failure is not None:
+            raise RuntimeError("The simulation can not continue after a worker failed") \
+                from self.failure
+
+        for connection in self._connections:
+            connection.send((command, argument))
+        errors = [connection.recv() for connection in self._connections]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            # The other workers only saw the barrier break
+            self.failure = next(
+                (error for error in errors if not isinstance(error, threading.BrokenBarrierError)),
+                errors[0]
+            )
+            raise RuntimeError("A worker failed") from self.failure
+
+    @property
+    def states(self) -> np.ndarray:
+        return self._states[self._front]
+
+    @property
+    def toxins(self) -> np.ndarray:
+        return self._toxins[self._front]
+
+    @property
+    def state_grid(self) -> dict[tuple[int, int], int]:
+        return grid_to_dict(self.states, (0, 0))
+
+    @property
+    def toxicity_grid(self) -> dict[tuple[int, int], float]:
+        return grid_to_dict(self.toxins, (0, 0))
+
+    def set_state(self, x: int, y: int, state: int):
+        DenseCA._check_inside(self.n, x, y, state)
+        self.states[y, x] = state
+
+    def set_toxicity(self, x: int, y: int, toxicity: float):
+        self.toxins[y, x] = max(toxicity, 0.0)
+
+    def change_parameters(self, parameters: dict):
+        assert parameters["n"] == self.n, "The domain size can not change"
+        self._command("parameters", parameters)
+
+    def step(self):
+        self.run(1)
+
+    def run(self, steps: int):
+        self._command("run", (self._front, steps))
+        self._front = (self._front + steps) % 2
+        self.time += steps
+
+    def reset(self):
+        for array in self._states + self._toxins:
+            array.fill(0)
+        self.time = 0
+
+    def inner_ring_detector(self) -> tuple | None:
+        return detect_inner_ring(self.states, (0, 0))
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        for connection in self._connections:
+            connection.send(("stop", None))
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+        # Views have to go before the memory they point into
+        self._states = self._toxins = []
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
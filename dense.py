@@ -0,0 +1,473 @@
+import numpy as np
+
+from CA import CA
+from config import EMPTY, YOUNG, MUSHROOMS, OLDER, DEAD1, INERT
+from rules import STATE_COUNT, THRESHOLD_INHIBITION, PROBABILISTIC_INHIBITION
+from transitions import BasicSim, BasicToxinSim, ProbToxinSim, ProbToxinDeathSim
+from utils import convex_hull_xy, diffuse, grid_to_dict
+
+
+def young_neighbours(state: np.ndarray, out: tuple | None = None
+                     ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Count the YOUNG cells in the orthogonal and diagonal Moore neighbourhood
+    of every cell. Works on the last two axes, so stacked grids are allowed.
+
+    :param state: dense state grid
+    :type state: np.ndarray
+    :param out: (orth, diag) int8 arrays of the same shape to count into
+    :type out: tuple | None
+    :return: orthogonal counts, diagonal counts
+    :rtype: tuple[ndarray, ndarray]
+    """
+    if out is None:
+        out = np.empty_like(state, dtype=np.int8), np.empty_like(state, dtype=np.int8)
+    orth, diag = out
+    orth.fill(0)
+    diag.fill(0)
+
+    young = state == YOUNG
+    orth[..., 1:, :] += young[..., :-1, :]
+    orth[..., :-1, :] += young[..., 1:, :]
+    orth[..., :, 1:] += young[..., :, :-1]
+    orth[..., :, :-1] += young[..., :, 1:]
+    diag[..., 1:, 1:] += young[..., :-1, :-1]
+    diag[..., 1:, :-1] += young[..., :-1, 1:]
+    diag[..., :-1, 1:] += young[..., 1:, :-1]
+    diag[..., :-1, :-1] += young[..., 1:, 1:]
+    return orth, diag
+
+
+def detect_inner_ring(state: np.ndarray, origin: tuple[int, int]) -> tuple | None:
+    """
+    `CA.inner_ring_detector` for a single dense state grid
+
+    :param state: dense state grid
+    :type state: np.ndarray
+    :param origin: (y, x) coordinate of index (0, 0)
+    :type origin: tuple[int, int]
+    :return: ring ratio and hull, None if there are no mushrooms or older cells
+    :rtype: tuple | None
+    """
+    y0, x0 = origin
+    ys, xs = np.nonzero((state == MUSHROOMS) | (state == OLDER))
+    if not len(ys):
+        return None
+
+    return convex_hull_xy(xs + x0, ys + y0)
+
+
+class DenseCA(CA):
+    """
+    CA engine that stores the grid as dense arrays over a bounding box that
+    grows with the colony. Every step is computed as whole-array masked
+    operations instead of one `state_transition` call per cell.
+
+    `state_grid` and `toxicity_grid` are still available as dictionaries,
+    but are built from the arrays on access. With replicas they raise, the
+    grids of one replica are in `ensemble.Ensemble`.
+
+    With `replicas` the arrays get a leading replica axis and every replica is
+    stepped at once. Parameters may then be arrays of shape (replicas, 1, 1)
+    to give every replica its own value, see `ensemble.Ensemble`.
+
+    The arrays are double buffered: a step is written into the back buffers,
+    which are then swapped with the front ones. Together with preallocated
+    work arrays this keeps steady-state stepping free of large allocations,
+    new memory is only taken when the bounding box has to grow.
+
+    Checkpoints store the arrays with their origin instead of coordinate
+    arrays, and the generator state, in the format of `CA.save_checkpoint`.
+    """
+    def __init__(self, *args, replicas: int | None = None, **kwargs):
+        self.replicas = replicas
+        self._origin = (0, 0)
+        self._state = np.zeros((0, 0), dtype=np.int8)
+        self._toxin = np.zeros((0, 0))
+        self._allocate_buffers()
+        super().__init__(*args, **kwargs)
+        self._allocate()
+
+    def _allocate(self):
+        shape = (self.n, self.n)
+        if self.replicas is not None:
+            shape = (self.replicas,) + shape
+
+        self._origin = (0, 0)
+        self._state = np.zeros(shape, dtype=np.int8)
+        self._toxin = np.zeros(shape)
+        self._allocate_buffers()
+
+    def _allocate_buffers(self):
+        """
+        (Re)allocate the back buffers and work arrays to the current shape
+        """
+        shape = self._state.shape
+        self._next_state = np.zeros(shape, dtype=np.int8)
+        self._next_toxin = np.zeros(shape)
+        # Part of the back buffers that may hold old values
+        self._next_extent = None
+
+        self._orth = np.zeros(shape, dtype=np.int8)
+        self._diag = np.zeros(shape, dtype=np.int8)
+        self._mask = np.zeros(shape, dtype=bool)
+        self._flags = np.zeros(shape, dtype=bool)
+        self._scratch = np.zeros(shape)
+
+    @property
+    def states(self) -> np.ndarray:
+        """
+        Dense state array, index (0, 0) is at coordinate `origin`
+        """
+        return self._state
+
+    @property
+    def toxins(self) -> np.ndarray:
+        """
+        Dense toxicity array, index (0, 0) is at coordinate `origin`
+        """
+        return self._toxin
+
+    @property
+    def origin(self) -> tuple[int, int]:
+        return self._origin
+
+    def _single(self, accessor: str):
+        """
+        Raise for an accessor that only exists for a single replica
+        """
+        if self.replicas is not None:
+            raise ValueError(
+                f"{accessor} is ambiguous with {self.replicas} replicas, use "
+                "Ensemble.state_grid(replica), Ensemble.toxicity_grid(replica) "
+                "or the `states` and `toxins` arrays"
+            )
+
+    @property
+    def state_grid(self) -> dict[tuple[int, int], int]:
+        self._single("state_grid")
+        return grid_to_dict(self._state, self._origin)
+
+    @state_grid.setter
+    def state_grid(self, grid: dict[tuple[int, int], int]):
+        self._state[...] = EMPTY
+        for (y, x), state in grid.items():
+            self.set_state(x, y, state)
+
+    @property
+    def toxicity_grid(self) -> dict[tuple[int, int], float]:
+        self._single("toxicity_grid")
+        return grid_to_dict(self._toxin, self._origin)
+
+    @toxicity_grid.setter
+    def toxicity_grid(self, grid: dict[tuple[int, int], float]):
+        self._toxin[...] = 0.0
+        for (y, x), toxicity in grid.items():
+            self.set_toxicity(x, y, toxicity)
+
+    def toxicity(self, x: int, y: int) -> float:
+        self._single("toxicity")
+        y0, x0 = self._origin
+        h, w = self._toxin.shape
+        if not (0 <= y - y0 < h and 0 <= x - x0 < w):
+            return 0.0
+        return float(self._toxin[y - y0, x - x0])
+
+    def set_toxin_coarsening(self, factor: int):
+        if factor != 1:
+            raise ValueError("The dense engine keeps toxins at cell resolution")
+
+    def _checkpoint_arrays(self, header: dict) -> dict[str, np.ndarray]:
+        # The engine draws straight from its generator, so its state is all
+        # there is to the random stream
+        header["origin"] = list(self.origin)
+        header["replicas"] = self.replicas
+        return {"states": self.states, "toxins": self.toxins}
+
+    @classmethod
+    def _from_checkpoint(cls, header: dict, seed: np.random.SeedSequence) -> "DenseCA":
+        # Parameters per replica were saved as nested lists
+        parameters = {
+            name: np.asarray(value) if isinstance(value, list) else value
+            for name, value in header["parameters"].items()
+        }
+        return cls(parameters, seed, replicas=header["replicas"])
+
+    def _restore_checkpoint(self, header: dict, arrays):
+        self._restore_arrays(arrays["states"], arrays["toxins"], tuple(header["origin"]))
+
+    def _restore_arrays(self, states: np.ndarray, toxins: np.ndarray, origin: tuple[int, int]):
+        """
+        Take over saved state and toxicity arrays with index (0, 0) at `origin`
+        """
+        self._state = states.astype(np.int8)
+        self._toxin = toxins.astype(float)
+        self._origin = origin
+        self._allocate_buffers()
+
+    def _bounds(self) -> tuple[int, int, int, int] | None:
+        """
+        Bounding box (min_y, max_y, min_x, max_x) of all non-empty state and
+        toxicity cells in array coordinates, or None for an empty grid.
+        """
+        h, w = self._state.shape[-2:]
+        occupied = np.greater(self._toxin, 0, out=self._mask)
+        np.logical_or(occupied, np.not_equal(self._state, EMPTY, out=self._flags),
+                      out=occupied)
+        occupied = occupied.reshape(-1, h, w).any(axis=0)
+
+        rows = np.flatnonzero(occupied.any(axis=1))
+        if not len(rows):
+            return None
+        cols = np.flatnonzero(occupied.any(axis=0))
+        return rows[0], rows[-1], cols[0], cols[-1]
+
+    def _fit(self, min_y: int, max_y: int, min_x: int, max_x: int):
+        """
+        Grow the arrays so they cover the given (inclusive) array coordinates.
+        Growth is over-allocated so repeated expansion stays amortized.
+        """
+        h, w = self._state.shape[-2:]
+        if min_y >= 0 and min_x >= 0 and max_y < h and max_x < w:
+            return
+
+        slack_y = max(8, h // 2)
+        slack_x = max(8, w // 2)
+        top = slack_y - min_y if min_y < 0 else 0
+        bottom = max_y - h + 1 + slack_y if max_y >= h else 0
+        left = slack_x - min_x if min_x < 0 else 0
+        right = max_x - w + 1 + slack_x if max_x >= w else 0
+
+        pad = [(0, 0)] * (self._state.ndim - 2) + [(top, bottom), (left, right)]
+        self._state = np.pad(self._state, pad)
+        self._toxin = np.pad(self._toxin, pad)
+        self._allocate_buffers()
+        y0, x0 = self._origin
+        self._origin = (y0 - top, x0 - left)
+
+    def _window(self, margin: int) -> tuple | None:
+        """
+        Grow the arrays so every non-empty cell is at least `margin` cells
+        away from their edge, and return the slices covering the non-empty
+        cells plus that margin. Returns None for an empty grid.
+        """
+        bounds = self._bounds()
+        if bounds is None:
+            return None
+
+        min_y, max_y, min_x, max_x = bounds
+        y0, x0 = self._origin
+        self._fit(min_y - margin, max_y + margin,
+                  min_x - margin, max_x + margin)
+
+        # Growing shifts the array coordinates
+        dy, dx = y0 - self._origin[0], x0 - self._origin[1]
+        return (
+            Ellipsis,
+            slice(min_y + dy - margin, max_y + dy + margin + 1),
+            slice(min_x + dx - margin, max_x + dx + margin + 1)
+        )
+
+    def _index(self, x: int, y: int) -> tuple[int, int]:
+        y0, x0 = self._origin
+        self._fit(y - y0, y - y0, x - x0, x - x0)
+        y0, x0 = self._origin
+        return y - y0, x - x0
+
+    @staticmethod
+    def _check_inside(n: int, x: int, y: int, state: int):
+        """
+        Check that (x, y) lies on the n x n grid and that `state` exists,
+        shared by the engines with a fixed domain
+        """
+        assert 0 <= x < n, f"x coordinate {x} out of bounds (0-{n-1})"
+        assert 0 <= y < n, f"y coordinate {y} out of bounds (0-{n-1})"
+        if not 0 <= state < STATE_COUNT:
+            raise ValueError(f"Unknown state {state}")
+
+    def set_state(self, x: int, y: int, state: int):
+        self._check_inside(self.n, x, y, state)
+
+        self._state[..., *self._index(x, y)] = state
+
+    def set_toxicity(self, x: int, y: int, toxicity: float):
+        self._toxin[..., *self._index(x, y)] = max(toxicity, 0.0)
+
+    def reset(self):
+        self._allocate()
+        self.time = 0
+
+    def parameter(self, name: str, index: tuple) -> np.ndarray:
+        """
+        Value of a (possibly per replica) parameter at the given cells
+        """
+        return np.broadcast_to(getattr(self, name), self._state.shape)[index]
+
+    def toxin_margin(self) -> int:
+        """
+        Distance toxins can travel in one step
+        """
+        if not self.rules.has_toxins:
+            return 0
+        return int(np.max(self.toxin_convolution_size)) // 2
+
+    def spread_probability(self, toxin: np.ndarray, index: tuple) -> np.ndarray:
+        """
+        Probability that a single orthogonal YOUNG neighbour spreads into the
+        empty cells at `index`, given their toxicity
+        """
+        prob_spread = self.parameter("prob_spread", index)
+        inhibition = self.rules.spread_inhibition
+
+        if inhibition == THRESHOLD_INHIBITION:
+            blocked = toxin > self.parameter("toxin_threshold", index)
+            return np.where(blocked, 0.0, prob_spread)
+        if inhibition == PROBABILISTIC_INHIBITION:
+            # A neighbour first has to survive the toxin check, then spread
+            return prob_spread * np.clip(1 - toxin, 0, 1)
+        return prob_spread
+
+    def state_step(self, state: np.ndarray, toxin: np.ndarray, out: np.ndarray,
+                   window: tuple):
+        """
+        Write the new states of `window` into `out`. The outer ring of cells
+        of the window only gets a correct result if it has no YOUNG
+        neighbours outside of it.
+        """
+        rules = self.compiled_rules
+        np.take(rules.successor_array, state, out=out, mode="clip")
+
+        # Random numbers are only drawn for cells with a stochastic transition
+        for branching, (name, target) in rules.table.branches.items():
+            cells = np.nonzero(np.equal(state, branching, out=self._mask[window]))
+            taken = self.rng.random(len(cells[0])) < self.parameter(name, cells)
+            out[cells] = np.where(taken, target, out[cells])
+
+        # Every YOUNG neighbour gets an independent chance to spread, so an
+        # empty cell stays empty only if all of them fail.
+        orth, diag = young_neighbours(state, (self._orth[window], self._diag[window]))
+        near = np.logical_or(orth, diag, out=self._mask[window])
+        empty = np.equal(state, EMPTY, out=self._flags[window])
+        candidates = np.nonzero(np.logical_and(near, empty, out=near))
+        spread = self.spread_probability(toxin[candidates], candidates)
+        stay = (1 - spread) ** orth[candidates] *\
+            (1 - spread / np.sqrt(2)) ** diag[candidates]
+        grow = self.rng.random(len(candidates[0])) >= stay
+        out[tuple(index[grow] for index in candidates)] = YOUNG
+
+        # Toxin deaths override every other transition
+        if rules.table.toxin_death:
+            susceptible = np.nonzero(np.take(rules.toxin_death_array, state,
+                                             out=self._mask[window], mode="clip"))
+            died = self.rng.random(len(susceptible[0])) < toxin[susceptible]
+            out[tuple(index[died] for index in susceptible)] = DEAD1
+
+    def toxin_step(self, state: np.ndarray, toxin: np.ndarray, out: np.ndarray,
+                   window: tuple):
+        """
+        Release, decay and diffuse the toxins of `window` into `out`, given
+        the new states
+        """
+        if not self.rules.has_toxins:
+            out[...] = toxin
+            return
+
+        rules = self.compiled_rules
+        np.subtract(toxin, self.toxin_decay, out=out)
+        np.maximum(out, 0, out=out)
+        releasing = np.take(rules.releases_toxin_array, state,
+                            out=self._mask[window], mode="clip")
+        out[releasing] = 1.0
+
+        size = self.toxin_convolution_size
+        variance = self.toxin_convolution_variance
+        if np.ndim(size) == 0 and np.ndim(variance) == 0:
+            diffuse(out, rules.kernel(size, variance), out=out,
+                    scratch=self._scratch[window])
+            return
+
+        # Replicas with their own kernel are diffused per distinct kernel
+        kernels = np.stack([
+            np.broadcast_to(size, out.shape[:-2] + (1, 1)).ravel(),
+            np.broadcast_to(variance, out.shape[:-2] + (1, 1)).ravel()
+        ], axis=1)
+        for size, variance in np.unique(kernels, axis=0):
+            same = np.all(kernels == (size, variance), axis=1)
+            out[same] = diffuse(out[same], rules.kernel(size, variance))
+
+    def cell_counts(self) -> tuple[int, int]:
+        # Summed over the replicas
+        return int(np.count_nonzero(self._state)), int(np.count_nonzero(self._toxin))
+
+    def step(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(self)
+
+        # Only the part of the arrays around non-empty cells can change
+        window = self._window(1 + self.toxin_margin())
+        if window is None:
+            self.checked_cells = 0
+            self.time += 1
+            if profiler is not None:
+                profiler.end(self)
+            return
+
+        state = self._state[window]
+        toxin = self._toxin[window]
+
+        # The step is written into the back buffers, which are empty outside
+        # the part written two steps ago
+        if self._next_extent is not None:
+            self._next_state[self._next_extent] = EMPTY
+            self._next_toxin[self._next_extent] = 0.0
+        new_state = self._next_state[window]
+        new_toxin = self._next_toxin[window]
+        self.checked_cells = state.size
+        if profiler is not None:
+            profiler.mark("gather")
+
+        self.state_step(state, toxin, new_state, window)
+        if profiler is not None:
+            profiler.mark("state_transition")
+        self.toxin_step(new_state, toxin, new_toxin, window)
+
+        # Everything non-empty was inside the window, so that is all the old
+        # front buffers hold
+        self._state, self._next_state = self._next_state, self._state
+        self._toxin, self._next_toxin = self._next_toxin, self._toxin
+        self._next_extent = window
+        self.time += 1
+        if profiler is not None:
+            profiler.mark("toxin_transition")
+            profiler.end(self)
+
+    def settled(self) -> bool:
+        # Every replica has to be settled
+        state = self._state
+        return not np.any((state != EMPTY) & (state != INERT))
+
+    def _detect_inner_ring(self) -> tuple | list | None:
+        """
+        Ring ratio and hull, with replicas a list with the ring (or None) of
+        every replica
+        """
+        if self.replicas is not None:
+            return [detect_inner_ring(state, self._origin) for state in self._state]
+        return detect_inner_ring(self._state, self._origin)
+
+
+class DenseBasicSim(DenseCA, BasicSim):
+    """Dense engine for `BasicSim`"""
+
+
+class DenseBasicToxinSim(DenseCA, BasicToxinSim):
+    """Dense engine for `BasicToxinSim`"""
+
+
+class DenseProbToxinSim(DenseCA, ProbToxinSim):
+    """Dense engine for `ProbToxinSim`"""
+
+
+class DenseProbToxinDeathSim(DenseCA, ProbToxinDeathSim):
+    """Dense engine for `ProbToxinDeathSim`"""
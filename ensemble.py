@@ -0,0 +1,95 @@
+import numpy as np
+
+from dense import DenseCA, detect_inner_ring
+from utils import area_polygon, grid_to_dict
+
+
+class Ensemble:
+    """
+    Replicas of a dense model stepped in lockstep. All replicas share one
+    stacked (replicas x H x W) state and toxicity array, so every step of the
+    whole ensemble is a single set of array operations.
+
+    Parameters in `varying` get one value per replica, e.g. to cover a whole
+    row of decay rates in one ensemble:
+
+        rates = np.repeat(np.linspace(0, 0.1, 25), 60)
+        ensemble = Ensemble(DenseProbToxinSim, sim_parameters,
+                            varying={"toxin_decay": rates})
+    """
+    def __init__(
+        self,
+        model: type[DenseCA],
+        parameters: dict,
+        replicas: int | None = None,
+        varying: dict | None = None,
+        seed: int | np.random.SeedSequence | None = None
+    ):
+        self.varying = {} if varying is None else varying
+        if replicas is None:
+            assert self.varying, "Give the amount of replicas or varying parameters"
+            replicas = max(len(values) for values in self.varying.values())
+        assert replicas > 0, "Amount of replicas must be positive"
+
+        self.replicas: int = replicas
+        self.sim = model(parameters, seed, replicas=replicas)
+        self._apply_varying()
+
+    def _apply_varying(self):
+        for name, values in self.varying.items():
+            values = np.broadcast_to(np.asarray(values), (self.replicas,))
+            setattr(self.sim, name, values.reshape(-1, 1, 1))
+        self.sim.compile_rules()
+
+    @property
+    def time(self) -> int:
+        return self.sim.time
+
+    def change_parameters(self, parameters: dict):
+        self.sim.change_parameters(parameters)
+        self._apply_varying()
+
+    def set_state(self, x: int, y: int, state: int):
+        """
+        Set the state of a single cell in every replica
+        """
+        self.sim.set_state(x, y, state)
+
+    def step(self):
+        self.sim.step()
+
+    def run(self, steps: int):
+        for _ in range(steps):
+            self.sim.step()
+
+    def reset(self):
+        self.sim.reset()
+
+    def state_grid(self, replica: int) -> dict[tuple[int, int], int]:
+        return grid_to_dict(self.sim.states[replica], self.sim.origin)
+
+    def toxicity_grid(self, replica: int) -> dict[tuple[int, int], float]:
+        return grid_to_dict(self.sim.toxins[replica], self.sim.origin)
+
+    def inner_ring_detector(self, replica: int) -> tuple | None:
+        return detect_inner_ring(self.sim.states[replica], self.sim.origin)
+
+    def ring_metrics(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ring ratio and hull diameter of every replica, NaN for replicas
+        without mushrooms or older cells
+
+        :return: ring ratios, hull diameters
+        :rtype: tuple[ndarray, ndarray]
+        """
+        ratios = np.full(self.replicas, np.nan)
+        diameters = np.full(self.replicas, np.nan)
+        for replica in range(self.replicas):
+            ring = self.inner_ring_detector(replica)
+            if ring is None:
+                continue
+
+            ratio, hull = ring
+            ratios[replica] = ratio
+            diameters[replica] = 2 * np.sqrt(area_polygon(hull) / np.pi)
+        return ratios, diameters
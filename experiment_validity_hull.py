@@ -1,42 +1,66 @@
+import argparse
+
 import numpy as np
-from matplotlib import pyplot as plt
-from concurrent.futures import ProcessPoolExecutor
 from config import SPORE, sim_parameters
+from sweep import IntervalStop, run_sweep
 from transitions import BasicToxinSim
-from utils import gkern
 
-def run_single_simulation(rate, params):
-    params["toxin_decay"] = rate
-    simulation = BasicToxinSim(params)
-    simulation.set_state(params["n"] // 2, params["n"] // 2, SPORE)
 
-    for _ in range(params["iterations"]):
-        simulation.step()
+# Steps every simulation runs for
+NUM_ITERATIONS = 50
+# Width of the confidence interval of the mean ratio at which a rate stops
+# sampling, None runs every replica
+STOP_WIDTH = None
 
-    return simulation.inner_ring_detector()
 
-def main():
-    decay_rates = np.linspace(0, 0.1, 25)
-    num_simulations = 60
+def run_single_simulation(params, point, seed, num_iterations=NUM_ITERATIONS):
+    simulation = BasicToxinSim(dict(params, **point), seed)
+    simulation.set_state(params["n"] // 2, params["n"] // 2, SPORE)
 
-    val_per_rate = []
-    val_per_rate_lower = []
-    val_per_rate_upper = []
+    # A colony that died out or only has inert cells left keeps its ring
+    simulation.run(num_iterations, until=simulation.settled)
 
-    with ProcessPoolExecutor() as executor:
-        for rate in decay_rates:
-            print(f"Processing decay rate: {rate}")
+    detect = simulation.inner_ring_detector()
+    if detect is None:
+        return 0
+    return detect[0]
 
-            futures = [executor.submit(run_single_simulation, rate, sim_parameters)
-                       for _ in range(num_simulations)]
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Inner ring size per toxin decay rate")
+    parser.add_argument("--stop", type=float, default=STOP_WIDTH, metavar="WIDTH",
+                        help="stop sampling a rate once its mean ratio is known to within WIDTH")
+    args = parser.parse_args(argv)
+
+    # Imported here rather than at the top: the pool workers import this
+    # module for run_single_simulation and have no use for matplotlib
+    from matplotlib import pyplot as plt
+
+    decay_rates = np.linspace(0, 0.1, 25)
+    num_simulations = 60
 
-            vals = np.array([f.result() for f in futures])
+    # The workers get the parameters once, every task only carries its decay
+    # rate and seed. Every replica has its own seed, so the results do not
+    # depend on how the tasks are scheduled over the workers. With --stop
+    # rates stop sampling once their mean ratio is known well enough.
+    vals = run_sweep(
+        run_single_simulation,
+        sim_parameters,
+        {"toxin_decay": decay_rates},
+        num_simulations,
+        seed=42,
+        stop=None if args.stop is None else IntervalStop(args.stop)
+    )
 
-            mean_val = np.mean(vals)
-            std_val = np.std(vals)
-            val_per_rate.append(mean_val)
-            val_per_rate_lower.append(mean_val - std_val)
-            val_per_rate_upper.append(mean_val + std_val)
+    # A rate that --stop ended early is NaN for the replicas it skipped, the
+    # statistics are over the replicas that ran and the CSV counts them
+    val_per_rate = np.nanmean(vals, axis=1)
+    std_per_rate = np.nanstd(vals, axis=1)
+    replicas_per_rate = np.sum(~np.isnan(vals), axis=1)
+    np.savetxt("./results_distance_test.csv",
+               np.column_stack([decay_rates, val_per_rate, std_per_rate, replicas_per_rate]),
+               delimiter=",", fmt="%g", header="toxin_decay,mean,std,replicas", comments="")
+    val_per_rate_lower = val_per_rate - std_per_rate
+    val_per_rate_upper = val_per_rate + std_per_rate
 
     plt.fill_between(decay_rates, val_per_rate_lower, val_per_rate_upper, alpha=0.2, label="std dev")
     plt.plot(decay_rates, val_per_rate, label="mean", marker='o')
@@ -48,4 +72,4 @@ def main():
     plt.show()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,25 +1,29 @@
+import argparse
+
 import numpy as np
-from matplotlib import pyplot as plt
-import matplotlib.ticker as ticker
-from concurrent.futures import ProcessPoolExecutor
 from config import SPORE, sim_parameters
+from store import ResultStore
+from sweep import IntervalStop, run_sweep
 from transitions import ProbToxinSim
-from utils import gkern
-import itertools
+
+
+# Steps every simulation runs for
+NUM_ITERATIONS = 50
+# Width of the confidence interval of the prevalence at which a point stops
+# sampling, None runs every replica
+STOP_WIDTH = None
 
 
 def run_single_simulation(
-        kernel_variance: float,
-        decay: float,
-        params,
-        num_iterations: int) -> float:
-    params["toxin_convolution_variance"] = kernel_variance
-    params["toxin_decay"] = decay
-    simulation = ProbToxinSim(params)
+        params: dict,
+        point: dict,
+        seed: np.random.SeedSequence,
+        num_iterations: int = NUM_ITERATIONS) -> float:
+    simulation = ProbToxinSim(dict(params, **point), seed)
     simulation.set_state(params["n"] // 2, params["n"] // 2, SPORE)
 
-    for _ in range(num_iterations):
-        simulation.step()
+    # A colony that died out or only has inert cells left keeps its ring
+    simulation.run(num_iterations, until=simulation.settled)
 
     detect = simulation.inner_ring_detector()
     if detect is None:
@@ -27,48 +31,11 @@ def run_single_simulation(
     return detect[0]
 
 
-def main():
-    variances = np.arange(0.01, 1.2, 0.05)
-    decays = np.arange(0, .1, 0.005)
-    num_simulations = 50
-    num_iterations = 50
-
-    calculate = False
-
-    # Only calculate if calculate == True
-    if calculate:
-        heatmap_data = np.zeros((len(variances), len(decays)))
-
-        with ProcessPoolExecutor() as executor:
-            for (n, var), (m, decay) in itertools.product(
-                    enumerate(variances),
-                    enumerate(decays)):
-                print(f"calculating variance: {var}, decay: {decay}")
-
-                # Use executor for parallelizing the workload
-                futures = [executor.submit(
-                    run_single_simulation,
-                    var,
-                    decay,
-                    sim_parameters,
-                    num_iterations) for _ in range(num_simulations)]
-
-                vals = [f.result() for f in futures]
-
-                fairy_rings = [val >= 0.9 for val in vals]
-                fairy_ring_amt = fairy_rings.count(True)
-                fairy_ring_ratio = fairy_ring_amt/num_simulations
-                heatmap_data[n][m] = fairy_ring_ratio
-                print(fairy_ring_ratio)
-
-        with open("data/fairy_ring_prevalance.data", "w") as fr_p_file:
-            fr_p_file.write(str([[float(j) for j in i] for i in heatmap_data]))
-    else:
-        # Else read from file
-        with open("data/fairy_ring_prevalance.data", "r") as fr_p_file:
-            heatmap_data = eval(fr_p_file.read())
-    heatmap_data = [[100 * j for j in i] for i in heatmap_data]
-    im = plt.imshow(heatmap_data, cmap="vanimo")
+def plot_heatmap(heatmap_data, variances, decays):
+    from matplotlib import pyplot as plt
+    import matplotlib.ticker as ticker
+
+    im = plt.imshow(heatmap_data, cmap="vanimo", vmin=0, vmax=100)
     cbar = plt.colorbar(im, orientation="vertical",
                  label="% of simulations forming FFR without inner ring")
     cbar.ax.yaxis.set_major_formatter(ticker.PercentFormatter())
@@ -80,6 +47,63 @@ def main():
     plt.xlabel("Decay")
     plt.xticks(range(0, len(decays), 2), labels=[
                f"{x:.2f}" for x in decays[::2]], rotation=45)
+    return im
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="FFR prevalence per kernel variance and decay")
+    parser.add_argument("--stop", type=float, default=STOP_WIDTH, metavar="WIDTH",
+                        help="stop sampling a point once its prevalence is known to within WIDTH")
+    args = parser.parse_args(argv)
+
+    # The live heatmap needs pyplot before the sweep starts, the sweep
+    # workers that import this module never load it
+    from matplotlib import pyplot as plt
+
+    variances = np.arange(0.01, 1.2, 0.05)
+    decays = np.arange(0, .1, 0.005)
+    num_simulations = 50
+
+    # The heatmap fills in while the sweep runs, points that are already in
+    # the result store show up right away
+    heatmap_data = np.full((len(variances), len(decays)), np.nan)
+    plt.ion()
+    im = plot_heatmap(heatmap_data, variances, decays)
+
+    def show_point(index, vals):
+        heatmap_data[index] = 100 * np.mean(vals >= 0.9)
+        im.set_data(heatmap_data)
+        plt.pause(0.001)
+
+    # Every replica has its own seed, so the results do not depend on
+    # how the tasks are scheduled over the workers. With --stop points
+    # stop sampling once the prevalence is known well enough.
+    results = run_sweep(
+        run_single_simulation,
+        sim_parameters,
+        {"toxin_convolution_variance": variances, "toxin_decay": decays},
+        num_simulations,
+        seed=42,
+        on_point=show_point,
+        stop=None if args.stop is None else IntervalStop(args.stop, threshold=0.9),
+        store=ResultStore(),
+        key={"model": ProbToxinSim, "steps": NUM_ITERATIONS}
+    )
+    plt.ioff()
+    plt.close()
+
+    # NaN >= 0.9 is False, so the skipped replicas of a point that stopped
+    # early only have to be left out of the denominator
+    replicas = np.sum(~np.isnan(results), axis=-1)
+    heatmap_data = 100 * np.sum(results >= 0.9, axis=-1) / replicas
+    grid_variances, grid_decays = np.meshgrid(variances, decays, indexing="ij")
+    np.savetxt("./plots/experiment_varying_toxin_parameters.csv",
+               np.column_stack([grid_variances.ravel(), grid_decays.ravel(),
+                                heatmap_data.ravel(), replicas.ravel()]),
+               delimiter=",", fmt="%g",
+               header="toxin_convolution_variance,toxin_decay,prevalence,replicas",
+               comments="")
+    plot_heatmap(heatmap_data, variances, decays)
     plt.savefig("./plots/experiment_varying_toxin_parameters.png")
     plt.show()
 
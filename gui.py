@@ -1,12 +1,14 @@
 import tkinter
-import numpy as np
 
 from config import SPORE, sim_parameters, colors, state_names
 
 import threading
 import queue
+import time
 
+from dense import detect_inner_ring
 from transitions import BasicSim, BasicToxinSim, ProbToxinSim, ProbToxinDeathSim
+from viewport import Frame, FrameBuffer, Viewport
 
 # Implement the default Matplotlib key bindings.
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
@@ -25,38 +27,41 @@ CA_TYPES = {
 }
 
 
-sim = ProbToxinSim(sim_parameters)
-sim.set_state(sim_parameters["n"]//2, sim_parameters["n"]//2, SPORE)
+# Memory for the timeline of past steps, the oldest steps are dropped
+# beyond it
+FRAME_MEMORY = 256 * 2**20
+
+# Milliseconds between the steps of a replay
+REPLAY_INTERVAL = 50
 
+# Frames drawn per second at most, steps in between are not drawn
+RENDER_FPS = 30
 
-def dict_to_grid(state_dict):
-    """Convert sparse dictionary state into a dense grid for plotting,
-    expanding bounds."""
-    if not state_dict:
-        # Default small grid
-        return np.zeros((sim_parameters["n"], sim_parameters["n"]))
+# Seconds between updates of the rate counters
+COUNTER_INTERVAL = 0.5
 
-    xs = [x for _, x in state_dict.keys()]
-    ys = [y for y, _ in state_dict.keys()]
 
-    # Determine bounds
-    min_x, max_x = min(xs), max(xs)
-    min_y, max_y = min(ys), max(ys)
+sim = ProbToxinSim(sim_parameters)
+sim.set_state(sim_parameters["n"]//2, sim_parameters["n"]//2, SPORE)
 
-    # Add padding
-    pad = 5
-    min_x -= pad
-    max_x += pad
-    min_y -= pad
-    max_y += pad
+# Compact copies of the past steps, for going back without simulating again
+frames = FrameBuffer(FRAME_MEMORY)
+frames.append(Frame.from_grids(sim.time, sim.state_grid, sim.toxicity_grid))
 
-    height = max_y - min_y + 1
-    width = max_x - min_x + 1
+# Whether the newest step is shown, and the step the timeline was last
+# moved to for it
+following = True
+live_position = 0
 
-    dense = np.zeros((height, width))
-    for (y, x), val in state_dict.items():
-        dense[y - min_y, x - min_x] = val
-    return dense
+# Step shown in the figure and the newest step the render loop has seen
+shown_step = 0
+newest_step = 0
+
+# Cells checked by the steps since the render loop last looked, together
+# with the frames appended for them, so a redraw only writes those cells
+# even when frames were dropped
+changed_cells = set()
+changes_lock = threading.Lock()
 
 
 root = tkinter.Tk()
@@ -64,9 +69,16 @@ root.wm_title("FFR simulation")
 
 cmap = ListedColormap(colors)
 fig, ax = plt.subplots()
-grid_data = dict_to_grid(sim.state_grid)
-im = ax.imshow(grid_data, origin='lower', cmap=cmap,
-               vmin=0, vmax=len(colors)-1)
+
+# Dense arrays of the shown step, only touched by the UI thread
+viewport = Viewport(sim_parameters["n"])
+viewport.show(frames.find(sim.time))
+
+# The image is animated: frames only redraw it on top of a saved
+# background instead of redrawing the whole figure
+im = ax.imshow(viewport.states, origin='lower', cmap=cmap,
+               vmin=0, vmax=len(colors)-1, extent=viewport.extent,
+               animated=True)
 
 patches = [mpatches.Patch(color=col, label=lab)
            for col, lab in zip(colors, state_names)]
@@ -76,8 +88,65 @@ colorbar = plt.colorbar(im, label="Toxicity value")
 colorbar.ax.set_visible(False)
 
 canvas = FigureCanvasTkAgg(fig, master=root)
+background = None
+
+
+def on_draw(event):
+    """Save the background after every full draw, e.g. after a resize or zoom"""
+    global background
+    background = canvas.copy_from_bbox(fig.bbox)
+    ax.draw_artist(im)
+
+
+canvas.mpl_connect("draw_event", on_draw)
 canvas.draw()
 
+
+def show_frame(full=False):
+    """Redraw the figure, or only blit the image when nothing else changed"""
+    if full or background is None:
+        canvas.draw()
+        return
+    canvas.restore_region(background)
+    ax.draw_artist(im)
+    canvas.blit(fig.bbox)
+
+
+def fit_view():
+    """Make the axes cover the whole viewport"""
+    left, right, bottom, top = viewport.extent
+    im.set_extent(viewport.extent)
+    ax.set_xlim(left, right)
+    ax.set_ylim(bottom, top)
+
+
+def shown_layer():
+    return viewport.states if view == "CA" else viewport.toxins
+
+
+def display(frame, full=False):
+    """Draw a stored step, blitting only the image unless `full`"""
+    global shown_step
+    grown = viewport.show(frame)
+    if grown or full:
+        fit_view()
+    im.set_data(shown_layer())
+    show_frame(full=grown or full)
+    request_hull(frame)
+    shown_step = frame.time
+
+
+def follow(frame, changed):
+    """Draw the newest step, only writing the cells changed since the last one"""
+    global shown_step
+    grown = viewport.update(frame, changed, toxins=view == "Toxins")
+    if grown:
+        fit_view()
+    im.set_data(shown_layer())
+    show_frame(full=grown)
+    request_hull(frame)
+    shown_step = frame.time
+
 toolbar = NavigationToolbar2Tk(canvas, root, pack_toolbar=False)
 toolbar.update()
 
@@ -105,19 +174,81 @@ iter_amount_spinbox = tkinter.Spinbox(
     sim_control_frame, from_=1, to=100, textvariable=iter_amount_var)
 iter_amount_spinbox.grid(in_=sim_control_frame, row=0, column=0)
 
-update_queue = queue.Queue()
+# Simulation speed while playing, 0 for as fast as possible
+steps_per_second_var = tkinter.StringVar(sim_control_frame)
+steps_per_second_var.set("0")
+steps_per_second = 0.0
+
+
+def update_steps_per_second(*args):
+    global steps_per_second
+    try:
+        steps_per_second = max(0.0, float(steps_per_second_var.get()))
+    except ValueError:
+        pass
+
+
+steps_per_second_var.trace_add("write", update_steps_per_second)
+steps_per_second_label = tkinter.Label(sim_control_frame, text="Steps/s (0 = max)")
+steps_per_second_label.grid(in_=sim_control_frame, row=1, column=0)
+steps_per_second_spinbox = tkinter.Spinbox(
+    sim_control_frame, from_=0, to=1000, increment=5,
+    textvariable=steps_per_second_var)
+steps_per_second_spinbox.grid(in_=sim_control_frame, row=1, column=1)
+
+# Set while the simulation thread runs, cleared to pause it
+running = threading.Event()
+
+# Steps simulated and frames drawn, for the rate counters
+steps_done = 0
+frames_drawn = 0
+counted_at = time.perf_counter()
+counted_steps = 0
+counted_frames = 0
+
+# Newest frame for the hull thread, older ones it did not get to are
+# dropped
+hull_queue = queue.Queue(maxsize=1)
+hull_lock = threading.Lock()
+latest_ring = None
+shown_ring = None
+
+
+def hull_worker():
+    global latest_ring
+    while True:
+        frame = hull_queue.get()
+        latest_ring = detect_inner_ring(frame.states, frame.origin)
+
+
+def request_hull(frame):
+    # Replacing the pending item is atomic, so requests from several
+    # threads can never overfill the queue
+    with hull_lock:
+        try:
+            hull_queue.get_nowait()
+        except queue.Empty:
+            pass
+        hull_queue.put_nowait(frame)
+
+
+threading.Thread(target=hull_worker, daemon=True).start()
 
 
 def reset_simulation():
+    global following
     sim.reset()
     sim.set_state(sim_parameters["n"]//2, sim_parameters["n"]//2, SPORE)
-    data = dict_to_grid(sim.state_grid)
-    im.set_data(data)
-    h, w = data.shape
-    im.set_extent((-0.5, w-0.5, -0.5, h-0.5))
-    ax.set_xlim(-0.5, w-0.5)
-    ax.set_ylim(-0.5, h-0.5)
-    canvas.draw()
+
+    with changes_lock:
+        changed_cells.clear()
+        frames.clear()
+        frames.append(Frame.from_grids(sim.time, sim.state_grid, sim.toxicity_grid))
+    following = True
+    update_timeline()
+
+    viewport.reset()
+    display(frames.find(sim.time), full=True)
 
     global view
     if view == "Toxins":
@@ -128,72 +259,165 @@ def on_simulation_finished():
     run_for_button.config(state="normal")
     button_reset.config(state="normal")
     ca_type_menu.config(state="normal")
+    button_play.config(text="Play", state="normal")
 
 
-def run_iterations():
+def start_simulation(n=None):
     run_for_button.config(state="disabled")
     button_reset.config(state="disabled")
     ca_type_menu.config(state="disabled")
+    button_play.config(text="Pause")
+    running.set()
+    threading.Thread(target=sim_worker, args=(n,), daemon=True).start()
+
+
+def run_iterations():
     n = int(iter_amount_var.get())
     assert n > 0, "Number of iterations must be positive"
-    threading.Thread(target=sim_worker, args=(n,), daemon=True).start()
-    
+    start_simulation(n)
+
+
+def play_pause():
+    if running.is_set():
+        # Enabled again once the simulation thread has stopped
+        running.clear()
+        button_play.config(state="disabled")
+    else:
+        start_simulation()
+
+
+def sim_worker(n=None):
+    """
+    Step the simulation `n` times, or until paused without `n`, at
+    `steps_per_second` at most
+    """
+    global steps_done
+    done = 0
+    next_step = time.perf_counter()
+    try:
+        while running.is_set() and (n is None or done < n):
+            if steps_per_second > 0:
+                next_step += 1 / steps_per_second
+                delay = next_step - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Behind, carry on from now rather than catching up
+                    next_step = time.perf_counter()
+
+            # Only stepping and storing the frame happen here, the render
+            # loop picks up the newest frame at its own rate
+            sim.step()
+            done += 1
+            steps_done += 1
+            frame = Frame.from_grids(sim.time, sim.state_grid, sim.toxicity_grid)
+            with changes_lock:
+                changed_cells.update(sim.checked_coordinates)
+                frames.append(frame)
+    finally:
+        # The controls are enabled again even if a step failed
+        running.clear()
+        root.after(0, on_simulation_finished)
+
+
+def update_timeline():
+    """Fit the timeline to the stored steps, moving along while following"""
+    global live_position
+    span = frames.span()
+    if span is None:
+        return
+    timeline.config(from_=span[0], to=span[1])
+    if following:
+        live_position = span[1]
+        timeline.set(live_position)
 
-def sim_worker(n):
-    for _ in range(n):
-        sim.step()
-        update_queue.put((sim.state_grid, sim.toxicity_grid))
-    root.after(0, on_simulation_finished)
 
+def show_step(step):
+    """Show a stored step, or follow the simulation again from the newest"""
+    global following
+    span = frames.span()
+    if span is None:
+        return
+    following = step >= span[1]
 
-def check_queue():
-    global check_queue_id
-    if not root.winfo_exists():
+    frame = frames.find(span[1] if following else step)
+    if frame is not None:
+        display(frame)
+
+
+def scrub_to(value):
+    step = int(float(value))
+    # Ignore the timeline following the simulation
+    if following and step == live_position:
         return
+    show_step(step)
 
-    new_data_pair = None
-    try:
-        while True:
-            new_data_pair = update_queue.get_nowait()
-    except queue.Empty:
-        pass
 
-    if new_data_pair is not None and\
-       new_data_pair[0] is not None and\
-       new_data_pair[1] is not None:
-        state_data, toxin_data = new_data_pair
-
-        if view == "CA":
-            grid = dict_to_grid(state_data)
-            im.set_cmap(cmap)
-            im.set_clim(0, len(colors) - 1)
-            legend.set_visible(True)
-            colorbar.ax.set_visible(False)
-        else:
-            grid = dict_to_grid(toxin_data)
-            im.set_cmap('viridis')
-            im.set_clim(0, 1.0)
-            legend.set_visible(False)
-            colorbar.ax.set_visible(True)
-
-        im.set_data(grid)
-
-        # Make representation the size of state grid regardless
-        h, w = dict_to_grid(state_data).shape
-        im.set_extent((-0.5, w-0.5, -0.5, h-0.5))
-        ax.set_xlim(-0.5, w-0.5)
-        ax.set_ylim(-0.5, h-0.5)
-
-        ring = sim.inner_ring_detector()
-
-        # Only calculate ratio if it exists
-        if ring:
-            ratio, hull = ring
-            inner_ring_detector.config(text=f"outer hull ratio: {round(ratio, 2)}")
+def replay(step=None):
+    """Play the stored steps from the oldest up to the newest"""
+    span = frames.span()
+    if span is None:
+        return
+    if step is None:
+        step = span[0]
+    if step > span[1]:
+        return
+
+    show_step(step)
+    timeline.set(step)
+    if step < span[1]:
+        root.after(REPLAY_INTERVAL, replay, step + 1)
+
+
+def update_counters():
+    """Show the simulation and render rates since the last update"""
+    global counted_at, counted_steps, counted_frames
+    now = time.perf_counter()
+    elapsed = now - counted_at
+    if elapsed < COUNTER_INTERVAL:
+        return
+
+    step_rate = (steps_done - counted_steps) / elapsed
+    frame_rate = (frames_drawn - counted_frames) / elapsed
+    active = sim.active_cells
+    counters.config(
+        text=f"{step_rate:.0f} steps/s, {frame_rate:.0f} fps, "
+             f"{len(active) if active is not None else '-'} active cells")
+    counted_at, counted_steps, counted_frames = now, steps_done, frames_drawn
 
-        canvas.draw()
 
-    check_queue_id = root.after(20, check_queue)
+def check_queue():
+    global check_queue_id, shown_ring, frames_drawn, newest_step, changed_cells
+    if not root.winfo_exists():
+        return
+    started = time.perf_counter()
+
+    # Only the newest step is drawn, the ones simulated since the last
+    # frame are dropped but the cells they changed are still written
+    with changes_lock:
+        span = frames.span()
+        changed, changed_cells = changed_cells, set()
+    if span is not None and span[1] != newest_step:
+        newest_step = span[1]
+        update_timeline()
+
+        frame = frames.find(newest_step)
+        if following and frame is not None:
+            follow(frame, changed)
+            frames_drawn += 1
+
+    # Only show the ratio if a ring exists
+    ring = latest_ring
+    if ring and ring is not shown_ring:
+        ratio, hull = ring
+        inner_ring_detector.config(text=f"outer hull ratio: {round(ratio, 2)}")
+    shown_ring = ring
+    update_counters()
+
+    # The next frame is due one frame interval after this one started. When
+    # drawing takes longer, the steps in between are dropped.
+    delay = 1 / RENDER_FPS - (time.perf_counter() - started)
+    check_queue_id = root.after(max(1, int(1000 * delay)), check_queue)
 
 
 run_for_button = tkinter.Button(
@@ -219,6 +443,10 @@ ca_type_menu = tkinter.OptionMenu(
     sim_control_frame, selected_ca_type, *CA_TYPES.keys(), command=change_ca_type)
 ca_type_menu.grid(in_=sim_control_frame, row=0, column=3)
 
+button_play = tkinter.Button(
+    sim_control_frame, text="Play", command=play_pause)
+button_play.grid(in_=sim_control_frame, row=1, column=2)
+
 
 slider_frame = tkinter.Frame(root)
 slider_frame.columnconfigure(0, weight=1)
@@ -331,13 +559,29 @@ view = "CA"
 inner_ring_detector = tkinter.Label(root, text=f"Relative size outer rings: {1}")
 inner_ring_detector.pack(side=tkinter.BOTTOM)
 
+counters = tkinter.Label(root, text="0 steps/s, 0 fps, - active cells")
+counters.pack(side=tkinter.BOTTOM)
+
 def switch_view():
     global view
     view = "CA" if view == "Toxins" else "Toxins"
     button_switch_view.config(text="Show CA" if view ==
                               "Toxins" else "Show toxins")
-    if sim.state_grid and sim.toxicity_grid:
-        update_queue.put((sim.state_grid, sim.toxicity_grid))
+
+    if view == "CA":
+        im.set_cmap(cmap)
+        im.set_clim(0, len(colors) - 1)
+        legend.set_visible(True)
+        colorbar.ax.set_visible(False)
+    else:
+        im.set_cmap('viridis')
+        im.set_clim(0, 1.0)
+        legend.set_visible(False)
+        colorbar.ax.set_visible(True)
+
+    frame = frames.find(shown_step)
+    if frame is not None:
+        display(frame, full=True)
 
 
 button_switch_view = tkinter.Button(root, text="Show toxins", command=switch_view)
@@ -347,6 +591,16 @@ button_switch_view = tkinter.Button(
     root, text="Show toxins", command=switch_view)
 button_switch_view.pack(side=tkinter.BOTTOM)
 
+# Timeline of the stored steps
+timeline_frame = tkinter.Frame(root)
+timeline = tkinter.Scale(timeline_frame, from_=0, to=0,
+                         orient=tkinter.HORIZONTAL, command=scrub_to,
+                         label="Step")
+timeline.pack(side=tkinter.LEFT, fill=tkinter.X, expand=True)
+button_replay = tkinter.Button(timeline_frame, text="Replay", command=replay)
+button_replay.pack(side=tkinter.RIGHT)
+timeline_frame.pack(side=tkinter.BOTTOM, fill=tkinter.X)
+
 toolbar.pack(side=tkinter.BOTTOM, fill=tkinter.X)
 canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True)
 
@@ -0,0 +1,121 @@
+import importlib
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable
+
+import numpy as np
+
+import utils
+
+
+# Modules every worker imports before its first task, so no task pays for
+# importing scipy and the engines
+SIMULATION_MODULES = ("transitions", "dense", "tiled", "ensemble", "scipy.ndimage")
+
+# Parameters broadcast to this worker by `_initialize`
+_base_parameters: dict = {}
+
+
+def _initialize(parameters: dict, kernels: dict, modules: tuple[str, ...]):
+    global _base_parameters
+    for module in modules:
+        importlib.import_module(module)
+    _base_parameters = parameters
+    utils.KERNELS.update(kernels)
+
+
+def _run_task(function: Callable, delta: dict, args: tuple):
+    return function(dict(_base_parameters, **delta), *args)
+
+
+def _same(a, b) -> bool:
+    if a is b:
+        return True
+    try:
+        return np.shape(a) == np.shape(b) and bool(np.all(a == b))
+    except (TypeError, ValueError):
+        return False
+
+
+def kernel_keys(parameter_sets: Iterable[dict]) -> set[tuple[int, float, int]]:
+    """
+    (size, variance, factor) of every diffusion kernel the given parameters
+    use, see `utils.diffusion_kernel`
+    """
+    keys = set()
+    for parameters in parameter_sets:
+        if "toxin_convolution_size" not in parameters:
+            continue
+        sizes, variances = np.broadcast_arrays(
+            np.ravel(parameters["toxin_convolution_size"]),
+            np.ravel(parameters["toxin_convolution_variance"])
+        )
+        factor = int(parameters.get("toxin_coarsening", 1))
+        keys.update((int(size), float(variance), factor)
+                    for size, variance in zip(sizes.tolist(), variances.tolist()))
+    return keys
+
+
+class WarmPool:
+    """
+    Process pool whose workers are set up once: they import the simulation
+    modules, receive the base parameters and get the diffusion kernels the
+    tasks will need. A task then only carries the parameters that differ
+    from the base, so short runs are not dominated by pickling and imports.
+
+        with WarmPool(sim_parameters, kernels=kernel_keys(parameter_sets)) as pool:
+            futures = [pool.submit(run, seed, parameters={"toxin_decay": decay})
+                       for decay in decays for seed in seeds]
+
+    Functions are called as `function(parameters, *args)`, with the base
+    parameters updated by the ones given to `submit`.
+    """
+    def __init__(
+        self,
+        parameters: dict,
+        max_workers: int | None = None,
+        kernels: Iterable[tuple[int, float, int]] = (),
+        modules: tuple[str, ...] = SIMULATION_MODULES
+    ):
+        self.parameters = dict(parameters)
+        self.max_workers: int = max_workers or os.cpu_count() or 1
+        kernels = {key: utils.diffusion_kernel(*key) for key in kernels}
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_initialize,
+            initargs=(self.parameters, kernels, tuple(modules))
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def delta(self, parameters: dict) -> dict:
+        """
+        Entries of `parameters` that differ from the base parameters.
+        Entries missing from `parameters` keep their base value.
+        """
+        return {
+            name: value for name, value in parameters.items()
+            if name not in self.parameters or not _same(value, self.parameters[name])
+        }
+
+    def submit(self, function: Callable, *args, parameters: dict | None = None) -> Future:
+        """
+        Run `function(parameters, *args)` on a worker
+
+        :param function: picklable function to run
+        :type function: Callable
+        :param parameters: full parameters or only the changed ones, only
+            the difference with the base parameters is sent
+        :type parameters: dict | None
+        :return: future of the result
+        :rtype: Future
+        """
+        delta = self.delta(parameters) if parameters else {}
+        return self._executor.submit(_run_task, function, delta, args)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
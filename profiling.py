@@ -0,0 +1,164 @@
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Phases of a step in the order they run, ring detection runs after it
+PHASES = ("gather", "state_transition", "toxin_transition", "ring_detection")
+COUNTS = ("checked_cells", "state_cells", "toxin_cells", "peak_memory")
+
+
+class StepProfiler:
+    """
+    Opt-in instrumentation of `CA.step` and the steps of the dense and
+    tiled engines: the time spent in every phase of every step and the
+    amount of cells involved. A simulation without a profiler only pays for
+    a few `is None` checks per step.
+
+        sim.profiler = StepProfiler(memory=True)
+        sim.run(50)
+        sim.profiler.to_csv("profile.csv")
+        sim.profiler.to_chrome_trace("profile.json")
+
+    The phases are gathering the cells to check (including drawing the
+    random numbers), their state transitions, the toxin transition with its
+    diffusion, and ring detection whenever `inner_ring_detector` is called.
+    With `detect_rings` the rings are detected after every step, so that
+    phase is measured even if nothing else asks for it.
+
+    With `memory` every step also records the peak of the memory allocated
+    through Python during the step, as traced by `tracemalloc`. Tracing
+    slows the simulation down considerably, so it is off by default.
+    """
+    def __init__(self, memory: bool = False, detect_rings: bool = False):
+        self.memory = memory
+        self.detect_rings = detect_rings
+        self.origin = time.perf_counter()
+
+        self.rows: list[dict] = []
+        # (phase, start, duration, step) of everything timed, in seconds
+        # since `origin`
+        self.spans: list[tuple[str, float, float, int]] = []
+
+        self._started_tracing = False
+        self._phase_start = 0.0
+        self._row: dict = {}
+
+    def begin(self, sim):
+        """
+        Start timing a step of `sim`
+        """
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        self._row = dict.fromkeys(PHASES, 0.0)
+        self._row["step"] = sim.time + 1
+        self._phase_start = time.perf_counter()
+
+    def mark(self, phase: str):
+        """
+        End the current phase of the step, the next one starts now
+        """
+        now = time.perf_counter()
+        duration = now - self._phase_start
+        self._row[phase] += duration
+        self.spans.append((phase, self._phase_start - self.origin, duration, self._row["step"]))
+        self._phase_start = now
+
+    def end(self, sim):
+        """
+        Finish the step and record the cells involved
+        """
+        row = self._row
+        row["checked_cells"] = sim.checked_cells
+        row["state_cells"], row["toxin_cells"] = sim.cell_counts()
+        row["peak_memory"] = tracemalloc.get_traced_memory()[1] if self.memory else 0
+        self.rows.append(row)
+
+        if self.detect_rings:
+            sim.inner_ring_detector()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase outside of `step`, added to the most recent step
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            step = 0
+            if self.rows:
+                self.rows[-1][name] += duration
+                step = self.rows[-1]["step"]
+            self.spans.append((name, start - self.origin, duration, step))
+
+    def close(self):
+        """
+        Stop memory tracing if this profiler started it
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def series(self) -> dict[str, np.ndarray]:
+        """
+        Every recorded column as an array with one entry per step: "step",
+        the seconds of every phase and the cell and memory counts
+        """
+        columns = ("step",) + PHASES + COUNTS
+        return {
+            name: np.array([row[name] for row in self.rows],
+                           dtype=float if name in PHASES else np.int64)
+            for name in columns
+        }
+
+    def totals(self) -> dict[str, float]:
+        """
+        Seconds spent in every phase over all steps
+        """
+        return {phase: sum(row[phase] for row in self.rows) for phase in PHASES}
+
+    def to_csv(self, path: str):
+        """
+        Write one row per step with the seconds of every phase and the counts
+        """
+        columns = ("step",) + PHASES + COUNTS
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def to_chrome_trace(self, path: str):
+        """
+        Write the phases as a Chrome trace, to be opened in chrome://tracing
+        or Perfetto, with the cell counts as counter tracks
+        """
+        events = [
+            {"name": phase, "ph": "X", "pid": 0, "tid": 0,
+             "ts": start * 1e6, "dur": duration * 1e6, "args": {"step": step}}
+            for phase, start, duration, step in self.spans
+        ]
+
+        # Counters at the end of every step
+        ends = {}
+        for phase, start, duration, step in self.spans:
+            ends[step] = max(ends.get(step, 0.0), start + duration)
+        for row in self.rows:
+            counts = {name: row[name] for name in COUNTS if name != "peak_memory"}
+            events.append({"name": "cells", "ph": "C", "pid": 0,
+                           "ts": ends.get(row["step"], 0.0) * 1e6, "args": counts})
+            if self.memory:
+                events.append({"name": "peak_memory", "ph": "C", "pid": 0,
+                               "ts": ends.get(row["step"], 0.0) * 1e6,
+                               "args": {"bytes": row["peak_memory"]}})
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,178 @@
+import numpy as np
+
+from config import (
+    EMPTY, SPORE, YOUNG, MATURING, MUSHROOMS, OLDER, DECAYING, DEAD1, DEAD2,
+    INERT, MOORE_NBD
+)
+from utils import diffusion_kernel
+
+STATE_COUNT = INERT + 1
+
+# Deterministic successor of every state
+LIFECYCLE = {
+    EMPTY: EMPTY,
+    SPORE: SPORE,
+    YOUNG: MATURING,
+    MATURING: OLDER,
+    MUSHROOMS: DECAYING,
+    OLDER: DECAYING,
+    DECAYING: DEAD1,
+    DEAD1: DEAD2,
+    DEAD2: EMPTY,
+    INERT: INERT,
+}
+
+# Stochastic branches taken instead of the successor:
+# state -> (name of the probability parameter, target state)
+BRANCHES = {
+    SPORE: ("prob_spore_to_hyphae", YOUNG),
+    MATURING: ("prob_mushroom", MUSHROOMS),
+}
+
+# How toxicity in an empty cell stops YOUNG neighbours from spreading into it
+NO_INHIBITION = None
+THRESHOLD_INHIBITION = "threshold"          # not at all above toxin_threshold
+PROBABILISTIC_INHIBITION = "probabilistic"  # per neighbour, with P = toxicity
+
+TOXIN_PARAMETERS = (
+    "toxin_decay", "toxin_convolution_size", "toxin_convolution_variance"
+)
+
+
+class RuleTable:
+    """
+    Declarative description of a model: what every state turns into, which
+    of those transitions are stochastic and how toxins interfere.
+
+    :param successors: deterministic successor of every state
+    :type successors: dict[int, int]
+    :param branches: state -> (probability parameter, target), taken with that
+        probability instead of the successor
+    :type branches: dict[int, tuple[str, int]]
+    :param toxin_death: states that die (become DEAD1) with a probability
+        equal to their toxicity, before any other transition
+    :type toxin_death: tuple[int, ...]
+    :param spread_inhibition: how toxicity stops spreading into empty cells
+    :type spread_inhibition: str | None
+    :param toxin_releasing: states that are toxin sources, none for a model
+        without toxins
+    :type toxin_releasing: tuple[int, ...]
+    """
+    def __init__(
+        self,
+        successors: dict[int, int] = LIFECYCLE,
+        branches: dict[int, tuple[str, int]] = BRANCHES,
+        toxin_death: tuple[int, ...] = (),
+        spread_inhibition: str | None = NO_INHIBITION,
+        toxin_releasing: tuple[int, ...] = ()
+    ):
+        assert set(successors) == set(range(STATE_COUNT)), \
+            "Every state needs a successor"
+        assert EMPTY not in branches and EMPTY not in toxin_death, \
+            "Empty cells only change by spreading"
+
+        self.successors = dict(successors)
+        self.branches = dict(branches)
+        self.toxin_death = tuple(toxin_death)
+        self.spread_inhibition = spread_inhibition
+        self.toxin_releasing = tuple(toxin_releasing)
+
+    @property
+    def has_toxins(self) -> bool:
+        return bool(self.toxin_releasing)
+
+    @property
+    def parameters(self) -> tuple[str, ...]:
+        """
+        Names of the simulation parameters the rules read
+        """
+        names = [name for name, _ in self.branches.values()]
+        names.append("prob_spread")
+        if self.spread_inhibition == THRESHOLD_INHIBITION:
+            names.append("toxin_threshold")
+        if self.has_toxins:
+            names.extend(TOXIN_PARAMETERS)
+        return tuple(dict.fromkeys(names))
+
+    def compile(self, parameters) -> "CompiledRules":
+        """
+        Turn the table into lookup arrays for one set of parameter values
+
+        :param parameters: simulation (or anything else) with an attribute
+            for every name in `parameters`
+        :return: compiled rules
+        :rtype: CompiledRules
+        """
+        return CompiledRules(self, parameters)
+
+
+class CompiledRules:
+    """
+    Lookup arrays of a `RuleTable` for one set of parameter values, indexed by
+    state. Lists are used by the per-cell engine, arrays by the dense one.
+
+    Everything derived from the parameters, the diffusion kernels included,
+    is only rebuilt when the rules are compiled again, which
+    `change_parameters` does.
+    """
+    def __init__(self, table: RuleTable, parameters):
+        self.table = table
+
+        self.successor = [table.successors[s] for s in range(STATE_COUNT)]
+        self.has_branch = [s in table.branches for s in range(STATE_COUNT)]
+        self.branch_target = [
+            table.branches[s][1] if s in table.branches else s
+            for s in range(STATE_COUNT)
+        ]
+        self.branch_probability = [
+            getattr(parameters, table.branches[s][0]) if s in table.branches else 0.0
+            for s in range(STATE_COUNT)
+        ]
+        self.toxin_death = [s in table.toxin_death for s in range(STATE_COUNT)]
+        self.releases_toxin = [s in table.toxin_releasing for s in range(STATE_COUNT)]
+
+        # Successor of states that need no random numbers or neighbours,
+        # -1 for the ones that have to be evaluated
+        self.fixed_successor = [
+            -1 if s == EMPTY or self.has_branch[s] or self.toxin_death[s]
+            else self.successor[s]
+            for s in range(STATE_COUNT)
+        ]
+
+        # Spread probability of a YOUNG neighbour in every MOORE_NBD direction
+        self.spread_inhibition = table.spread_inhibition
+        self.spread_probability = [
+            parameters.prob_spread / np.linalg.norm((dx, dy)) for dx, dy in MOORE_NBD
+        ]
+        self.toxin_threshold = getattr(parameters, "toxin_threshold", None)
+
+        # Most random numbers a single cell can consume in one step
+        spread_draws = 2 if self.spread_inhibition == PROBABILISTIC_INHIBITION else 1
+        self.max_draws_per_cell = max(
+            spread_draws * len(MOORE_NBD),
+            max(self.has_branch[s] + self.toxin_death[s] for s in range(STATE_COUNT))
+        )
+
+        self.successor_array = np.array(self.successor, dtype=np.int8)
+        self.toxin_death_array = np.array(self.toxin_death)
+        self.releases_toxin_array = np.array(self.releases_toxin)
+
+        # Diffusion kernel of every (size, variance) pair in use. Parameters
+        # may hold one value per replica, so there can be several.
+        self.kernels = {}
+        factor = getattr(parameters, "toxin_coarsening", 1)
+        if table.has_toxins:
+            sizes, variances = np.broadcast_arrays(
+                np.ravel(parameters.toxin_convolution_size),
+                np.ravel(parameters.toxin_convolution_variance)
+            )
+            for size, variance in zip(sizes.tolist(), variances.tolist()):
+                key = (int(size), float(variance))
+                if key not in self.kernels:
+                    self.kernels[key] = diffusion_kernel(*key, factor)
+
+    def kernel(self, size, variance) -> np.ndarray:
+        """
+        Cached diffusion kernel for the given size and variance
+        """
+        return self.kernels[(int(size), float(variance))]
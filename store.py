@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from utils import save_npz
+
+
+def canonical(value):
+    """
+    JSON-compatible form of a result's identity. Classes and functions are
+    named by their import path and floats are rounded to 12 significant
+    digits, so 0.36 and 0.36000000000000004 from np.arange are the same
+    point.
+    """
+    if isinstance(value, type) or callable(value):
+        return f"{value.__module__}.{value.__qualname__}"
+    if isinstance(value, np.random.SeedSequence):
+        return {"entropy": canonical(value.entropy),
+                "spawn_key": canonical(value.spawn_key)}
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [canonical(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return float(f"{value:.12g}")
+    return value
+
+
+def content_hash(**identity) -> str:
+    """
+    SHA-256 hex digest of everything that determines a result
+    """
+    text = json.dumps(canonical(identity), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    Per-replica metrics on disk, content addressed: every entry is an .npz
+    file with one array per metric, named after the `content_hash` of the
+    model, parameters, steps and seed that produced it. Any sweep that needs
+    the same point finds it, whatever the rest of its grid looks like.
+
+        store = ResultStore()
+        key = content_hash(model=ProbToxinSim, parameters=params, steps=50, seed=seed)
+        metrics = store.load(key)
+    """
+    def __init__(self, directory: str = "data/results"):
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def load(self, key: str) -> dict[str, np.ndarray] | None:
+        """
+        Stored metrics of an entry, None if there is none
+        """
+        try:
+            with np.load(self.path(key)) as entry:
+                return {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, metrics: dict[str, np.ndarray]):
+        """
+        Store the metrics of an entry, replacing what was there
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        save_npz(path, metrics)
@@ -0,0 +1,324 @@
+import itertools
+import math
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from statistics import NormalDist
+from typing import Callable
+
+import numpy as np
+
+from pool import WarmPool, kernel_keys
+from store import ResultStore, content_hash
+
+
+def _run_chunk(parameters: dict, function: Callable, tasks: list) -> list:
+    """
+    Run a chunk of (point, replica, grid point, seed) tasks in a worker
+    """
+    return [
+        (point, replica, function(parameters, grid_point, seed))
+        for point, replica, grid_point, seed in tasks
+    ]
+
+
+def _as_metrics(value) -> dict:
+    return value if isinstance(value, dict) else {"value": value}
+
+
+def point_seed_key(seed: np.random.SeedSequence, point: dict) -> tuple:
+    """
+    Spawn key of a grid point's random streams. It follows from the values
+    at the point rather than its place in the grid, so a point keeps its
+    results when the grid around it changes.
+    """
+    digest = bytes.fromhex(content_hash(point=point))
+    words = np.frombuffer(digest[:16], dtype=np.uint32).tolist()
+    return tuple(seed.spawn_key) + tuple(words)
+
+
+class SweepProgress:
+    """
+    Live readout of the replicas done, their throughput and the time left
+    """
+    def __init__(self, total: int, stream=sys.stdout):
+        self.total = total
+        self.done = 0
+        self.stream = stream
+        self.start = time.perf_counter()
+
+    def update(self, amount: int, skipped: int = 0):
+        """
+        Count `amount` replicas as done and drop `skipped` ones that will not
+        be run after all
+        """
+        self.done += amount
+        self.total -= skipped
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else math.inf
+
+        eta_text = "?" if math.isinf(eta) else time.strftime("%H:%M:%S", time.gmtime(eta))
+        self.stream.write(
+            f"\r{self.done}/{self.total} replicas, {rate:.1f}/s, ETA {eta_text}"
+        )
+        if self.done == self.total:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+class IntervalStop:
+    """
+    Stopping rule for `run_sweep`: a point is done once the confidence
+    interval of its mean result is narrower than `width`.
+
+    With a `threshold` every result counts as a success when it is at least
+    the threshold and the Wilson score interval of the success rate is
+    used, which stays honest when all replicas agree. Otherwise the normal
+    interval of the mean is used.
+
+        stop = IntervalStop(0.2, threshold=0.9)
+    """
+    def __init__(self, width: float, confidence: float = 0.95,
+                 threshold: float | None = None, metric: str = "value",
+                 min_replicas: int = 5):
+        self.width = width
+        self.threshold = threshold
+        self.metric = metric
+        self.min_replicas = min_replicas
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    def interval(self, values) -> tuple[float, float]:
+        """
+        Confidence interval of the mean, or success rate, of `values`
+        """
+        if isinstance(values, dict):
+            values = values[self.metric]
+        values = np.asarray(values, dtype=float)
+        n, z = len(values), self.z
+
+        if self.threshold is not None:
+            p = np.mean(values >= self.threshold)
+            centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+            half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        else:
+            centre = np.mean(values)
+            half = z * np.std(values, ddof=1) / math.sqrt(n) if n > 1 else math.inf
+        return centre - half, centre + half
+
+    def __call__(self, values) -> bool:
+        if isinstance(values, dict):
+            values = values[self.metric]
+        if len(values) < self.min_replicas:
+            return False
+        low, high = self.interval(values)
+        return high - low < self.width
+
+
+def run_sweep(
+    function: Callable,
+    parameters: dict,
+    grid: dict[str, list],
+    replicas: int,
+    seed: int | np.random.SeedSequence | None = None,
+    chunk_size: int | None = None,
+    max_workers: int | None = None,
+    on_point: Callable | None = None,
+    progress: bool = True,
+    store: ResultStore | None = None,
+    key: dict | None = None,
+    pool: WarmPool | None = None,
+    stop: Callable | None = None,
+    batch_size: int = 10
+) -> np.ndarray | dict[str, np.ndarray]:
+    """
+    Run `replicas` simulations for every point of a parameter grid on a
+    process pool. The whole grid is submitted up front in chunks, so the
+    workers stay busy until the last chunk instead of waiting at every point.
+
+    `function(parameters, point, seed)` runs a single replica and returns a
+    number or a dict of named numbers. `point` maps every grid parameter to
+    its value at that point and `seed` is the replica's own SeedSequence,
+    derived from `seed` and the point's values, so results do not depend on
+    the chunking, the amount of workers or the rest of the grid.
+
+    With a `store`, replicas already stored for a point are loaded instead
+    of computed and only the missing ones go to the pool. The entries are
+    keyed on the function, the full parameters, the seed and everything in
+    `key`, which has to name whatever else determines the result:
+
+        results = run_sweep(run_single_simulation, sim_parameters,
+                            {"toxin_decay": decays}, 50, seed=42,
+                            store=ResultStore(),
+                            key={"model": ProbToxinSim, "steps": 50})
+
+    With `stop` the replicas of a point are run in batches of `batch_size`
+    and the point is done once `stop` accepts its results, e.g. when the
+    confidence interval is narrow enough. As every replica keeps its own
+    seed, where a point stops does not depend on the rest of the sweep.
+
+    :param function: picklable function running one replica
+    :type function: Callable
+    :param parameters: parameters shared by every replica, sent to every
+        worker once
+    :type parameters: dict
+    :param grid: values of every swept parameter, the result has one axis
+        per parameter in this order
+    :type grid: dict[str, list]
+    :param replicas: amount of replicas per grid point
+    :type replicas: int
+    :param seed: seed of the whole sweep
+    :type seed: int | np.random.SeedSequence | None
+    :param chunk_size: replicas per task, defaults to about 8 tasks per worker
+    :type chunk_size: int | None
+    :param max_workers: amount of worker processes, defaults to all cores
+    :type max_workers: int | None
+    :param on_point: called with the grid index and the replica results of
+        every point as soon as all of its replicas are done
+    :type on_point: Callable | None
+    :param progress: print a live throughput and ETA readout
+    :type progress: bool
+    :param store: store to load and save results of every point
+    :type store: ResultStore | None
+    :param key: other inputs that determine the results, e.g. model and steps
+    :type key: dict | None
+    :param pool: warm pool to run on, kept open for the next sweep. Without
+        one a pool is started for this sweep only.
+    :type pool: WarmPool | None
+    :param stop: called with the replica results of a point after every
+        batch, no more replicas are run for the point once it returns True,
+        e.g. `IntervalStop`
+    :type stop: Callable | None
+    :param batch_size: replicas per batch when stopping early
+    :type batch_size: int
+    :return: results of shape (*grid sizes, replicas), one array per metric
+        if `function` returns a dict. Replicas skipped by `stop` are NaN.
+    :rtype: np.ndarray | dict[str, np.ndarray]
+    """
+    names = list(grid)
+    shape = tuple(len(grid[name]) for name in names)
+    grid_indices = list(itertools.product(*(range(size) for size in shape)))
+    points = [
+        {name: grid[name][i] for name, i in zip(names, grid_index)}
+        for grid_index in grid_indices
+    ]
+
+    if seed is None or not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    batch = replicas if stop is None else max(1, batch_size)
+
+    # Replicas per point, filled from the store and the pool
+    results: list[dict[str, list]] = [{} for _ in points]
+    entry_keys = [None] * len(points)
+    have = [0] * len(points)
+    for index, point in enumerate(points):
+        if store is None:
+            continue
+        entry_keys[index] = content_hash(
+            function=function, parameters=dict(parameters, **point),
+            seed=seed, **(key or {})
+        )
+        stored = store.load(entry_keys[index])
+        if stored:
+            results[index] = {name: list(values) for name, values in stored.items()}
+            have[index] = min(len(values) for values in stored.values())
+
+    spawn_keys = [point_seed_key(seed, point) for point in points]
+    computed = [0] * len(points)
+    pending = [0] * len(points)
+    targets = [0] * len(points)
+    readout = SweepProgress(sum(max(replicas - count, 0) for count in have)) if progress else None
+
+    def point_values(index):
+        count = min(have[index], replicas)
+        metrics = {name: np.array(values[:count], dtype=float)
+                   for name, values in results[index].items()}
+        return metrics["value"] if set(metrics) == {"value"} else metrics
+
+    def finish(index):
+        if store is not None and computed[index]:
+            count = have[index]
+            store.save(entry_keys[index], {
+                name: np.array(values[:count], dtype=float)
+                for name, values in results[index].items()
+            })
+        if readout is not None and have[index] < replicas:
+            readout.update(0, skipped=replicas - have[index])
+        if on_point is not None:
+            on_point(grid_indices[index], point_values(index))
+
+    def schedule(index) -> list:
+        """
+        Tasks of the next batch of replicas of a point, none once the point
+        has all of its replicas or `stop` holds
+        """
+        count = have[index]
+        if count >= replicas or (stop is not None and count and stop(point_values(index))):
+            finish(index)
+            return []
+
+        targets[index] = min(replicas, count + batch)
+        pending[index] = targets[index] - count
+        return [
+            (index, replica, points[index],
+             np.random.SeedSequence(seed.entropy, spawn_key=spawn_keys[index] + (replica,)))
+            for replica in range(count, targets[index])
+        ]
+
+    # The first batch of every point is submitted up front, later batches
+    # as soon as the one before is done
+    tasks = [task for index in range(len(points)) for task in schedule(index)]
+    if tasks:
+        own_pool = pool is None
+        if own_pool:
+            kernels = kernel_keys(dict(parameters, **points[index])
+                                  for index, count in enumerate(have) if count < replicas)
+            pool = WarmPool(parameters, max_workers, kernels)
+        if chunk_size is None:
+            chunk_size = max(1, len(tasks) // (8 * pool.max_workers))
+
+        def submit(tasks):
+            return {
+                pool.submit(_run_chunk, function, tasks[start:start + chunk_size],
+                            parameters=parameters)
+                for start in range(0, len(tasks), chunk_size)
+            }
+
+        try:
+            running = submit(tasks)
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = future.result()
+                    tasks = []
+                    for index, replica, value in chunk:
+                        for name, metric in _as_metrics(value).items():
+                            values = results[index].setdefault(name, [])
+                            values.extend([np.nan] * (replica + 1 - len(values)))
+                            values[replica] = metric
+
+                        computed[index] += 1
+                        pending[index] -= 1
+                        if pending[index] == 0:
+                            have[index] = targets[index]
+                            tasks += schedule(index)
+
+                    if readout is not None:
+                        readout.update(len(chunk))
+                    running |= submit(tasks)
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    # Replicas that were never sampled stay NaN
+    metrics = {}
+    for index, point_results in enumerate(results):
+        count = min(have[index], replicas)
+        for name, values in point_results.items():
+            metric = metrics.setdefault(name, np.full(len(points) * replicas, np.nan))
+            metric[index * replicas:index * replicas + count] = values[:count]
+    metrics = {name: values.reshape(shape + (replicas,)) for name, values in metrics.items()}
+
+    if set(metrics) == {"value"}:
+        return metrics["value"]
+    return metrics
@@ -0,0 +1,10 @@
+import numpy as np
+
+
+def agree(a, b, sigmas: float = 4.0) -> bool:
+    """
+    Whether two samples have the same mean within `sigmas` standard errors
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    error = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+    return abs(a.mean() - b.mean()) <= sigmas * max(error, 1e-9)
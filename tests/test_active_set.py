@@ -0,0 +1,41 @@
+"""
+Stepping only the active cells against rescanning the whole colony
+"""
+import pytest
+
+import transitions
+from cli import grown
+from config import INERT, YOUNG, sim_parameters
+
+MODELS = ("BasicSim", "BasicToxinSim", "ProbToxinSim", "ProbToxinDeathSim")
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_full_scan_matches_active_set(name):
+    model = getattr(transitions, name)
+    scanning = type(name, (model,), {"full_scan": True})
+
+    for seed in range(3):
+        sim, rescanned = grown(model, 25, seed), grown(scanning, 25, seed)
+        assert sim.state_grid == rescanned.state_grid
+        assert sim.toxicity_grid == rescanned.toxicity_grid
+
+
+def test_active_cells_skip_inert():
+    sim = transitions.BasicSim(dict(sim_parameters), 0)
+    sim.state_grid = {(10, 10): INERT}
+    assert sim.settled()
+    sim.step()
+    assert sim.checked_cells == 0
+    assert sim.state_grid == {(10, 10): INERT}
+
+
+def test_assigned_state_grid_is_stepped():
+    # A new grid replaces the active cells of the previous one
+    sim = grown(transitions.BasicSim, 1)
+    sim.state_grid = {(10, 10): YOUNG}
+    assert sim.active_cells is None
+
+    sim.step()
+    assert sim.checked_cells == 9
+    assert sim.checked_coordinates == {(10 + dy, 10 + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)}
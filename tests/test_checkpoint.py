@@ -0,0 +1,88 @@
+"""
+A simulation continued from a checkpoint steps exactly like the original
+"""
+import numpy as np
+import pytest
+
+import dense
+import tiled
+import transitions
+from cli import grown
+from config import SPORE, sim_parameters
+from ensemble import Ensemble
+
+
+@pytest.mark.parametrize("name", ("BasicSim", "ProbToxinSim", "ProbToxinDeathSim"))
+@pytest.mark.parametrize("coarsening", (1, 3))
+def test_checkpoint_round_trip(tmp_path, name, coarsening):
+    model = getattr(transitions, name)
+    parameters = dict(sim_parameters)
+    sim = model(parameters, 7)
+    if coarsening > 1:
+        if not sim.rules.has_toxins:
+            pytest.skip("Model without toxins")
+        sim.set_toxin_coarsening(coarsening)
+    sim.set_state(parameters["n"] // 2, parameters["n"] // 2, SPORE)
+    sim.run(10)
+
+    path = tmp_path / "run.ckpt.npz"
+    sim.save_checkpoint(str(path))
+    restored = model.load_checkpoint(str(path))
+    assert restored.time == sim.time
+    assert restored.toxin_coarsening == sim.toxin_coarsening
+
+    sim.run(10)
+    restored.run(10)
+    assert restored.state_grid == sim.state_grid
+    assert restored.toxin_field == sim.toxin_field
+    assert restored.active_cells == sim.active_cells
+
+
+def test_checkpoint_of_other_model(tmp_path):
+    sim = transitions.ProbToxinSim(dict(sim_parameters), 0)
+    path = tmp_path / "run.ckpt.npz"
+    sim.save_checkpoint(str(path))
+    with pytest.raises(ValueError):
+        transitions.BasicSim.load_checkpoint(str(path))
+
+
+def continues_exactly(tmp_path, sim, model: type):
+    path = tmp_path / "run.ckpt.npz"
+    sim.save_checkpoint(str(path))
+    restored = model.load_checkpoint(str(path))
+    assert restored.time == sim.time
+
+    sim.run(10)
+    restored.run(10)
+    assert np.array_equal(restored.states, sim.states)
+    assert np.array_equal(restored.toxins, sim.toxins)
+    assert restored.origin == sim.origin
+    return restored
+
+
+@pytest.mark.parametrize("name", ("BasicSim", "ProbToxinSim", "ProbToxinDeathSim"))
+def test_dense_checkpoint_round_trip(tmp_path, name):
+    model = getattr(dense, "Dense" + name)
+    continues_exactly(tmp_path, grown(model, 10, 3), model)
+
+
+def test_dense_checkpoint_with_replicas(tmp_path):
+    ensemble = Ensemble(dense.DenseProbToxinSim, dict(sim_parameters),
+                        varying={"toxin_decay": [0.0, 0.05, 0.1]}, seed=4)
+    n = sim_parameters["n"]
+    ensemble.set_state(n // 2, n // 2, SPORE)
+    ensemble.run(10)
+
+    restored = continues_exactly(tmp_path, ensemble.sim, dense.DenseProbToxinSim)
+    assert restored.replicas == 3
+    assert np.array_equal(np.ravel(restored.toxin_decay), [0.0, 0.05, 0.1])
+
+
+def test_tiled_checkpoint_round_trip(tmp_path, monkeypatch):
+    # Small tiles, so the colony is spread over many of them
+    monkeypatch.setattr(tiled, "TILE_SIZE", 8)
+    sim = grown(tiled.TiledProbToxinSim, 15, 5)
+    assert sim.tile_count > 4
+
+    restored = continues_exactly(tmp_path, sim, tiled.TiledProbToxinSim)
+    assert restored.tile_count == sim.tile_count
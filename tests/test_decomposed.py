@@ -0,0 +1,56 @@
+"""
+The decomposed engine against the dense one, and what happens when one of
+its workers fails
+"""
+import pytest
+
+import dense
+from cli import grown
+from compare import agree
+from config import DECAYING, OLDER, SPORE, sim_parameters
+from decomposed import DecomposedSim
+
+# Toxin sources on and next to the strip edges of three workers
+SOURCES = {(24, 30): OLDER, (25, 31): DECAYING, (49, 10): OLDER, (50, 60): DECAYING}
+
+
+def test_decomposed_matches_dense_distribution():
+    # Every strip has its own random stream, so the results only agree in
+    # distribution
+    model = dense.DenseProbToxinSim
+    n = sim_parameters["n"]
+    cells = []
+    for seed in range(12):
+        with DecomposedSim(model, dict(sim_parameters), workers=2, seed=seed) as sim:
+            sim.set_state(n // 2, n // 2, SPORE)
+            sim.run(25)
+            cells.append(len(sim.state_grid))
+    expected = [len(grown(model, 25, 1000 + seed).state_grid) for seed in range(12)]
+    assert agree(cells, expected)
+
+
+def test_toxins_cross_strips():
+    # The sources decay without drawing random numbers, so the strips have
+    # to exchange their halos to match the dense engine
+    parameters = dict(sim_parameters, toxin_decay=0.002)
+    expected = dense.DenseBasicToxinSim(dict(parameters), 0)
+    with DecomposedSim(dense.DenseBasicToxinSim, parameters, workers=3, seed=0) as sim:
+        for (y, x), state in SOURCES.items():
+            sim.set_state(x, y, state)
+            expected.set_state(x, y, state)
+        for _ in range(6):
+            sim.step()
+            expected.step()
+            assert sim.state_grid == expected.state_grid
+            assert sim.toxicity_grid == pytest.approx(expected.toxicity_grid)
+
+
+def test_failed_worker_stops_the_simulation():
+    with DecomposedSim(dense.DenseProbToxinSim, dict(sim_parameters), workers=2, seed=0) as sim:
+        with pytest.raises(RuntimeError, match="A worker failed") as failed:
+            sim.change_parameters(dict(sim_parameters, prob_spread="high"))
+        # The error of the worker itself, not the broken barrier of the others
+        assert isinstance(failed.value.__cause__, TypeError)
+
+        with pytest.raises(RuntimeError, match="can not continue"):
+            sim.step()
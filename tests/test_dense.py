@@ -0,0 +1,59 @@
+"""
+The dense engine against the dict engine, and reading single cells of the
+array engines and of replicas
+"""
+import numpy as np
+import pytest
+
+import dense
+import tiled
+import transitions
+from cli import grown
+from compare import agree
+from config import YOUNG, sim_parameters
+from ensemble import Ensemble
+
+MODELS = ("BasicSim", "BasicToxinSim", "ProbToxinSim", "ProbToxinDeathSim")
+STEPS = 25
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_dense_matches_dict_distribution(name):
+    # The engines draw their random numbers differently, so only the
+    # distributions of the measurements can be compared
+    seeds = range(20)
+    dict_sims = [grown(getattr(transitions, name), STEPS, seed) for seed in seeds]
+    dense_sims = [grown(getattr(dense, "Dense" + name), STEPS, 1000 + seed) for seed in seeds]
+
+    for measure in (lambda sim: len(sim.state_grid),
+                    lambda sim: sum(sim.toxicity_grid.values())):
+        assert agree([measure(sim) for sim in dict_sims], [measure(sim) for sim in dense_sims])
+
+
+@pytest.mark.parametrize("model", (dense.DenseProbToxinSim, tiled.TiledProbToxinSim))
+def test_toxicity_of_array_engines(model):
+    sim = grown(model, 10)
+    toxins = sim.toxicity_grid
+    assert toxins
+    for (y, x), value in toxins.items():
+        assert sim.toxicity(x, y) == pytest.approx(value)
+    assert sim.toxicity(-5, -5) == 0.0
+
+    rows = sim.get_grid_representation(show_toxins=True).splitlines()
+    assert rows and len(rows) == len(sim.get_grid_representation().splitlines())
+
+
+def test_replica_grids_need_a_replica():
+    ensemble = Ensemble(dense.DenseProbToxinSim, dict(sim_parameters), replicas=3, seed=0)
+    ensemble.set_state(0, 0, YOUNG)
+    ensemble.run(10)
+
+    sim = ensemble.sim
+    for accessor in (lambda: sim.state_grid, lambda: sim.toxicity_grid,
+                     lambda: sim.toxicity(0, 0), sim.get_grid_representation):
+        with pytest.raises(ValueError, match="Ensemble.state_grid"):
+            accessor()
+
+    for replica in range(3):
+        states = ensemble.state_grid(replica)
+        assert states and len(states) == np.count_nonzero(sim.states[replica])
@@ -0,0 +1,97 @@
+"""
+The pruned and incremental hulls against a hull of every point
+"""
+import numpy as np
+import pytest
+
+import utils
+from CA import detect_inner_ring_grid
+from config import MUSHROOMS
+from dense import detect_inner_ring
+
+
+def reference_hull(xs: np.ndarray, ys: np.ndarray) -> tuple[float, list[tuple]]:
+    """
+    Monotone chain over every point and the distance of every point to every
+    hull vertex, without any pruning
+    """
+    order = np.lexsort((ys, xs))
+    vertices = order[utils.monotone_chain(xs[order], ys[order])]
+    hull_xs, hull_ys = xs[vertices], ys[vertices]
+    distances = (np.abs(xs[:, None] - hull_xs) + np.abs(ys[:, None] - hull_ys)).min(axis=1)
+    ratio = np.count_nonzero(distances <= utils.RING_DISTANCE) / len(xs)
+    return ratio, list(zip(hull_xs.tolist(), hull_ys.tolist()))
+
+
+def as_tuples(hull: list) -> list[tuple]:
+    return [(point.x, point.y) for point in hull]
+
+
+def random_points(rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    # Few distinct coordinates, so there are duplicates and collinear points
+    size = rng.integers(1, 400)
+    spread = rng.integers(1, 60)
+    coordinates = np.unique(rng.integers(-spread, spread + 1, (size, 2)), axis=0)
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_convex_hull_matches_reference(seed):
+    xs, ys = random_points(np.random.default_rng(seed))
+    ratio, hull = reference_hull(xs, ys)
+
+    pruned_ratio, pruned = utils.convex_hull_xy(xs, ys)
+    assert pruned_ratio == ratio
+    assert as_tuples(pruned) == hull
+
+    points = [utils.Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+    assert utils.convex_hull(points)[0] == ratio
+    assert as_tuples(utils.convex_hull(points)[1]) == hull
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_hull_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    xs, ys = random_points(rng)
+    order = rng.permutation(len(xs))
+    hull = utils.IncrementalHull()
+    for part in np.array_split(order, rng.integers(1, 6)):
+        hull.add(xs[part], ys[part])
+
+    ratio, vertices = hull.result()
+    assert (ratio, as_tuples(vertices)) == reference_hull(xs, ys)
+
+
+def test_dense_and_grid_ring_detection_agree():
+    rng = np.random.default_rng(0)
+    state = (rng.random((40, 30)) < 0.1).astype(np.int8) * MUSHROOMS
+    origin = (-7, 12)
+    grid = {(y + origin[0], x + origin[1]): MUSHROOMS for y, x in zip(*np.nonzero(state))}
+
+    ratio, hull = detect_inner_ring(state, origin)
+    grid_ratio, grid_hull = detect_inner_ring_grid(grid)
+    assert ratio == grid_ratio
+    assert as_tuples(hull) == as_tuples(grid_hull)
+
+
+def test_hull_candidates_keep_the_hull():
+    rng = np.random.default_rng(1)
+    xs, ys = random_points(rng)
+    candidates = utils.hull_candidates(xs, ys)
+    _, hull = reference_hull(xs, ys)
+    assert set(hull) <= set(zip(xs[candidates].tolist(), ys[candidates].tolist()))
+
+
+def test_hull_distances_in_chunks():
+    # Enough points and hull vertices that the distances are done in
+    # several chunks
+    angles = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+    hull_xs = np.round(1000 * np.cos(angles)).astype(np.int64)
+    hull_ys = np.round(1000 * np.sin(angles)).astype(np.int64)
+    rng = np.random.default_rng(2)
+    xs, ys = rng.integers(-700, 700, (2, 5000))
+
+    distances = utils.hull_distances(xs, ys, hull_xs, hull_ys)
+    expected = np.array([np.min(np.abs(x - hull_xs) + np.abs(y - hull_ys))
+                         for x, y in zip(xs, ys)])
+    assert np.array_equal(distances, expected)
@@ -0,0 +1,27 @@
+"""
+Every engine records its steps when a profiler is attached
+"""
+import pytest
+
+import dense
+import tiled
+import transitions
+from cli import grown
+from profiling import PHASES, StepProfiler
+
+
+@pytest.mark.parametrize("model", (transitions.ProbToxinSim, dense.DenseProbToxinSim,
+                                   tiled.TiledProbToxinSim))
+def test_profiler_records_every_step(model):
+    sim = grown(model, 5)
+    sim.profiler = StepProfiler(detect_rings=True)
+    sim.run(4)
+
+    series = sim.profiler.series()
+    assert series["step"].tolist() == [6, 7, 8, 9]
+    for phase in PHASES:
+        assert (series[phase] >= 0).all()
+    assert (series["state_transition"] > 0).all()
+    assert (series["checked_cells"] > 0).all()
+    assert series["state_cells"][-1] == len(sim.state_grid)
+    assert series["toxin_cells"][-1] == len(sim.toxicity_grid)
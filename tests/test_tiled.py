@@ -0,0 +1,84 @@
+"""
+The tiled engine against the dense one, with tiles small enough that the
+colony and its toxins cross many of them
+"""
+import pytest
+
+import dense
+import tiled
+from cli import grown
+from compare import agree
+from config import DECAYING, OLDER, sim_parameters
+
+MODELS = ("BasicSim", "BasicToxinSim", "ProbToxinSim", "ProbToxinDeathSim")
+
+# Toxin sources on and next to tile edges and corners for tiles of 8 cells,
+# including tiles at negative coordinates once the toxins spread
+SOURCES = {(7, 7): OLDER, (8, 8): DECAYING, (15, 16): OLDER, (31, 23): DECAYING,
+           (40, 47): OLDER, (24, 24): DECAYING, (0, 63): OLDER}
+
+
+@pytest.fixture
+def small_tiles(monkeypatch):
+    monkeypatch.setattr(tiled, "TILE_SIZE", 8)
+
+
+def seeded(model: type, parameters: dict):
+    sim = model(parameters, 0)
+    for (y, x), state in SOURCES.items():
+        sim.set_state(x, y, state)
+    return sim
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_tiled_matches_dense_in_one_tile(name):
+    # Within a single tile the random numbers are drawn in the same order
+    for seed in range(3):
+        sim = grown(getattr(dense, "Dense" + name), 25, seed)
+        tiles = grown(getattr(tiled, "Tiled" + name), 25, seed)
+        assert sim.state_grid == tiles.state_grid
+        assert sim.toxicity_grid == pytest.approx(tiles.toxicity_grid)
+
+
+@pytest.mark.parametrize("name", ("BasicToxinSim", "ProbToxinDeathSim"))
+def test_toxins_cross_tiles(small_tiles, name):
+    # The sources decay without drawing random numbers, so both engines
+    # follow the same path and the diffusion has to read the halo of every
+    # neighbouring tile to match
+    parameters = dict(sim_parameters, toxin_decay=0.002)
+    sim = seeded(getattr(dense, "Dense" + name), parameters)
+    tiles = seeded(getattr(tiled, "Tiled" + name), parameters)
+
+    for _ in range(8):
+        sim.step()
+        tiles.step()
+        assert tiles.state_grid == sim.state_grid
+        assert tiles.toxicity_grid.keys() == sim.toxicity_grid.keys()
+        assert tiles.toxicity_grid == pytest.approx(sim.toxicity_grid)
+    assert len(tiles._toxin_tiles) > len(SOURCES)
+
+
+def test_tiles_are_freed(small_tiles):
+    tiles = seeded(tiled.TiledBasicToxinSim, dict(sim_parameters, toxin_decay=0.3))
+    allocated = tiles.tile_count
+    tiles.step()
+    assert tiles.tile_count > allocated
+
+    # The sources die out and their toxins decay away
+    tiles.run(5)
+    assert not tiles.state_grid
+    assert tiles.tile_count == 0
+
+
+@pytest.mark.parametrize("name", ("BasicSim", "ProbToxinSim"))
+def test_small_tiles_match_dense_distribution(small_tiles, name):
+    # Across tiles the random numbers are drawn in another order, so only
+    # the distributions can be compared
+    seeds = range(12)
+    sims = [grown(getattr(dense, "Dense" + name), 25, seed) for seed in seeds]
+    tiled_sims = [grown(getattr(tiled, "Tiled" + name), 25, 1000 + seed) for seed in seeds]
+    assert all(sim.tile_count > 4 for sim in tiled_sims)
+
+    for measure in (lambda sim: len(sim.state_grid),
+                    lambda sim: sum(sim.toxicity_grid.values())):
+        assert agree([measure(sim) for sim in sims], [measure(sim) for sim in tiled_sims])
@@ -0,0 +1,332 @@
+import numpy as np
+
+from config import EMPTY, YOUNG, MUSHROOMS, OLDER, INERT
+from dense import DenseCA
+from transitions import BasicSim, BasicToxinSim, ProbToxinSim, ProbToxinDeathSim
+from utils import convex_hull_xy, grid_to_dict
+
+
+# Side length of a tile in cells
+TILE_SIZE = 64
+
+# Offsets of the neighbouring tiles, the tile itself included
+TILE_NBD = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def _overlap(offset: int, halo: int) -> tuple[slice, slice]:
+    """
+    Cells of the neighbouring tile at `offset` along one axis that fall in
+    the halo, and where they go in the padded tile
+    """
+    if offset < 0:
+        return slice(TILE_SIZE - halo, TILE_SIZE), slice(0, halo)
+    if offset > 0:
+        return slice(0, halo), slice(TILE_SIZE + halo, TILE_SIZE + 2 * halo)
+    return slice(0, TILE_SIZE), slice(halo, TILE_SIZE + halo)
+
+
+def gather(tiles: dict, key: tuple[int, int], halo: int, out: np.ndarray) -> np.ndarray:
+    """
+    Copy a tile and a halo of cells from its neighbours into `out`, which has
+    a side length of TILE_SIZE + 2 * halo. Missing tiles are empty.
+
+    :param tiles: tile coordinates with their tiles
+    :type tiles: dict
+    :param key: (y, x) tile coordinate
+    :type key: tuple[int, int]
+    :param halo: amount of cells around the tile
+    :type halo: int
+    :param out: array to copy into
+    :type out: np.ndarray
+    :return: `out`
+    :rtype: np.ndarray
+    """
+    out.fill(0)
+    ty, tx = key
+    for dy, dx in TILE_NBD:
+        tile = tiles.get((ty + dy, tx + dx))
+        if tile is None:
+            continue
+        rows, out_rows = _overlap(dy, halo)
+        cols, out_cols = _overlap(dx, halo)
+        out[out_rows, out_cols] = tile[rows, cols]
+    return out
+
+
+def reaching(mask: np.ndarray, reach: int) -> list[tuple[int, int]]:
+    """
+    Offsets of the neighbouring tiles that have a cell within `reach` cells
+    of a True cell of `mask`
+    """
+    edges = {-1: slice(0, reach), 0: slice(None), 1: slice(TILE_SIZE - reach, TILE_SIZE)}
+    return [
+        (dy, dx) for dy, dx in TILE_NBD
+        if (dy, dx) != (0, 0) and mask[edges[dy], edges[dx]].any()
+    ]
+
+
+class TiledCA(DenseCA):
+    """
+    CA engine that stores the unbounded grid as a dictionary of fixed-size
+    tiles. A tile is allocated when one of its cells becomes non-empty and
+    freed once all of them are empty again, so memory follows the colony and
+    its toxins instead of their bounding box.
+
+    Tiles are stepped one at a time with the rules of the dense engine:
+    first the states, with a halo of one cell from the neighbouring tiles,
+    then, once every new state is known, the toxins with a halo of the
+    diffusion kernel radius.
+    """
+    def __init__(self, *args, **kwargs):
+        assert kwargs.get("replicas") is None, "Tiled grids have no replicas"
+        self._state_tiles: dict[tuple[int, int], np.ndarray] = {}
+        self._toxin_tiles: dict[tuple[int, int], np.ndarray] = {}
+        super().__init__(*args, **kwargs)
+
+    def _allocate(self):
+        self._state_tiles = {}
+        self._toxin_tiles = {}
+        self._allocate_buffers()
+
+    def _allocate_buffers(self):
+        # Work arrays large enough for a tile with the largest halo
+        shape = (3 * TILE_SIZE, 3 * TILE_SIZE)
+        self._padded_state = np.zeros(shape, dtype=np.int8)
+        self._padded_toxin = np.zeros(shape)
+        self._new_state = np.zeros(shape, dtype=np.int8)
+        self._new_toxin = np.zeros(shape)
+
+        self._orth = np.zeros(shape, dtype=np.int8)
+        self._diag = np.zeros(shape, dtype=np.int8)
+        self._mask = np.zeros(shape, dtype=bool)
+        self._flags = np.zeros(shape, dtype=bool)
+        self._scratch = np.zeros(shape)
+
+    @property
+    def tile_count(self) -> int:
+        """
+        Amount of allocated state and toxin tiles
+        """
+        return len(self._state_tiles) + len(self._toxin_tiles)
+
+    def _assemble(self, tiles: dict, dtype) -> np.ndarray:
+        keys = self._state_tiles.keys() | self._toxin_tiles.keys()
+        if not keys:
+            return np.zeros((0, 0), dtype=dtype)
+
+        tys, txs = zip(*keys)
+        ty0, tx0 = min(tys), min(txs)
+        dense = np.zeros(((max(tys) - ty0 + 1) * TILE_SIZE,
+                          (max(txs) - tx0 + 1) * TILE_SIZE), dtype=dtype)
+        for (ty, tx), tile in tiles.items():
+            y, x = (ty - ty0) * TILE_SIZE, (tx - tx0) * TILE_SIZE
+            dense[y:y + TILE_SIZE, x:x + TILE_SIZE] = tile
+        return dense
+
+    @property
+    def states(self) -> np.ndarray:
+        """
+        Dense state array over all tiles, index (0, 0) is at coordinate
+        `origin`
+        """
+        return self._assemble(self._state_tiles, np.int8)
+
+    @property
+    def toxins(self) -> np.ndarray:
+        """
+        Dense toxicity array over all tiles, index (0, 0) is at coordinate
+        `origin`
+        """
+        return self._assemble(self._toxin_tiles, float)
+
+    @property
+    def origin(self) -> tuple[int, int]:
+        keys = self._state_tiles.keys() | self._toxin_tiles.keys()
+        if not keys:
+            return 0, 0
+        tys, txs = zip(*keys)
+        return min(tys) * TILE_SIZE, min(txs) * TILE_SIZE
+
+    def _restore_arrays(self, states: np.ndarray, toxins: np.ndarray, origin: tuple[int, int]):
+        # Cut the arrays into tiles, only keeping those with something in them
+        y0, x0 = origin
+        top, left = y0 % TILE_SIZE, x0 % TILE_SIZE
+        h, w = states.shape
+        rows, cols = -(-(top + h) // TILE_SIZE), -(-(left + w) // TILE_SIZE)
+        ty0, tx0 = (y0 - top) // TILE_SIZE, (x0 - left) // TILE_SIZE
+
+        self._state_tiles = {}
+        self._toxin_tiles = {}
+        for tiles, array, dtype in ((self._state_tiles, states, np.int8),
+                                    (self._toxin_tiles, toxins, float)):
+            padded = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=dtype)
+            padded[top:top + h, left:left + w] = array
+            for i in range(rows):
+                for j in range(cols):
+                    tile = padded[i * TILE_SIZE:(i + 1) * TILE_SIZE,
+                                  j * TILE_SIZE:(j + 1) * TILE_SIZE]
+                    if tile.any():
+                        tiles[(ty0 + i, tx0 + j)] = tile.copy()
+
+    @property
+    def state_grid(self) -> dict[tuple[int, int], int]:
+        grid = {}
+        for (ty, tx), tile in self._state_tiles.items():
+            grid.update(grid_to_dict(tile, (ty * TILE_SIZE, tx * TILE_SIZE)))
+        return grid
+
+    @state_grid.setter
+    def state_grid(self, grid: dict[tuple[int, int], int]):
+        self._state_tiles = {}
+        for (y, x), state in grid.items():
+            self.set_state(x, y, state)
+
+    @property
+    def toxicity_grid(self) -> dict[tuple[int, int], float]:
+        grid = {}
+        for (ty, tx), tile in self._toxin_tiles.items():
+            grid.update(grid_to_dict(tile, (ty * TILE_SIZE, tx * TILE_SIZE)))
+        return grid
+
+    @toxicity_grid.setter
+    def toxicity_grid(self, grid: dict[tuple[int, int], float]):
+        self._toxin_tiles = {}
+        for (y, x), toxicity in grid.items():
+            self.set_toxicity(x, y, toxicity)
+
+    def toxicity(self, x: int, y: int) -> float:
+        tile = self._toxin_tiles.get((y // TILE_SIZE, x // TILE_SIZE))
+        if tile is None:
+            return 0.0
+        return float(tile[y % TILE_SIZE, x % TILE_SIZE])
+
+    def set_state(self, x: int, y: int, state: int):
+        self._check_inside(self.n, x, y, state)
+
+        key = (y // TILE_SIZE, x // TILE_SIZE)
+        if key not in self._state_tiles:
+            if state == EMPTY:
+                return
+            self._state_tiles[key] = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.int8)
+        self._state_tiles[key][y % TILE_SIZE, x % TILE_SIZE] = state
+
+    def set_toxicity(self, x: int, y: int, toxicity: float):
+        toxicity = max(toxicity, 0.0)
+        key = (y // TILE_SIZE, x // TILE_SIZE)
+        if key not in self._toxin_tiles:
+            if toxicity == 0:
+                return
+            self._toxin_tiles[key] = np.zeros((TILE_SIZE, TILE_SIZE))
+        self._toxin_tiles[key][y % TILE_SIZE, x % TILE_SIZE] = toxicity
+
+    def parameter(self, name: str, index: tuple) -> np.ndarray:
+        return np.broadcast_to(getattr(self, name), index[0].shape)
+
+    def cell_counts(self) -> tuple[int, int]:
+        return (sum(int(np.count_nonzero(tile)) for tile in self._state_tiles.values()),
+                sum(int(np.count_nonzero(tile)) for tile in self._toxin_tiles.values()))
+
+    def step(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(self)
+        rules = self.compiled_rules
+        margin = self.toxin_margin()
+        assert margin <= TILE_SIZE, "Toxins may not reach past the neighbouring tiles"
+
+        # Every tile with living cells and the tiles their YOUNG cells can
+        # spread into
+        to_step = set(self._state_tiles)
+        for (ty, tx), tile in self._state_tiles.items():
+            for dy, dx in reaching(tile == YOUNG, 1):
+                to_step.add((ty + dy, tx + dx))
+
+        self.checked_cells = len(to_step) * TILE_SIZE * TILE_SIZE
+        if profiler is not None:
+            profiler.mark("gather")
+
+        size = TILE_SIZE + 2
+        window = (Ellipsis, slice(0, size), slice(0, size))
+        inner = (slice(1, size - 1), slice(1, size - 1))
+
+        new_states = {}
+        for key in sorted(to_step):
+            state = gather(self._state_tiles, key, 1, self._padded_state[window])
+            toxin = gather(self._toxin_tiles, key, 1, self._padded_toxin[window])
+            out = self._new_state[window]
+            self.state_step(state, toxin, out, window)
+
+            new = out[inner]
+            if (new != EMPTY).any():
+                new_states[key] = new.copy()
+
+        if profiler is not None:
+            profiler.mark("state_transition")
+
+        new_toxins = {}
+        if rules.table.has_toxins:
+            # Every tile with toxins or releasing cells and the tiles their
+            # toxins diffuse into
+            sources = {key: tile > 0 for key, tile in self._toxin_tiles.items()}
+            for key, tile in new_states.items():
+                releasing = rules.releases_toxin_array[tile]
+                sources[key] = sources[key] | releasing if key in sources else releasing
+
+            to_diffuse = set(sources)
+            if margin:
+                for (ty, tx), source in sources.items():
+                    for dy, dx in reaching(source, margin):
+                        to_diffuse.add((ty + dy, tx + dx))
+
+            size = TILE_SIZE + 2 * margin
+            window = (Ellipsis, slice(0, size), slice(0, size))
+            inner = (slice(margin, size - margin), slice(margin, size - margin))
+
+            for key in sorted(to_diffuse):
+                state = gather(new_states, key, margin, self._padded_state[window])
+                toxin = gather(self._toxin_tiles, key, margin, self._padded_toxin[window])
+                out = self._new_toxin[window]
+                self.toxin_step(state, toxin, out, window)
+
+                new = out[inner]
+                if (new > 0).any():
+                    new_toxins[key] = new.copy()
+
+        self._state_tiles = new_states
+        self._toxin_tiles = new_toxins
+        self.time += 1
+        if profiler is not None:
+            profiler.mark("toxin_transition")
+            profiler.end(self)
+
+    def settled(self) -> bool:
+        return not any(
+            np.any((tile != EMPTY) & (tile != INERT)) for tile in self._state_tiles.values()
+        )
+
+    def _detect_inner_ring(self) -> tuple | None:
+        xs, ys = [], []
+        for (ty, tx), tile in self._state_tiles.items():
+            tile_ys, tile_xs = np.nonzero((tile == MUSHROOMS) | (tile == OLDER))
+            ys.append(tile_ys + ty * TILE_SIZE)
+            xs.append(tile_xs + tx * TILE_SIZE)
+
+        if not xs or not sum(map(len, xs)):
+            return None
+        return convex_hull_xy(np.concatenate(xs), np.concatenate(ys))
+
+
+class TiledBasicSim(TiledCA, BasicSim):
+    """Tiled engine for `BasicSim`"""
+
+
+class TiledBasicToxinSim(TiledCA, BasicToxinSim):
+    """Tiled engine for `BasicToxinSim`"""
+
+
+class TiledProbToxinSim(TiledCA, ProbToxinSim):
+    """Tiled engine for `ProbToxinSim`"""
+
+
+class TiledProbToxinDeathSim(TiledCA, ProbToxinDeathSim):
+    """Tiled engine for `ProbToxinDeathSim`"""
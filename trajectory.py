@@ -0,0 +1,179 @@
+import json
+import os
+
+import numpy as np
+
+from utils import grid_to_dict
+from viewport import Frame
+
+
+# Columns of the step index
+INDEX_COLUMNS = ("time", "origin_y", "origin_x", "height", "width",
+                 "state_offset", "toxin_offset")
+FORMAT_VERSION = 1
+
+
+class TrajectoryWriter:
+    """
+    Streams every step of a run to a directory as it is simulated, so long
+    runs never have to be kept in memory. A step is stored as a `Frame`:
+    uint8 states and float16 (or float32) toxins over the bounding box of
+    its cells, appended to `states.bin` and `toxins.bin`, with a row in
+    `index.bin` saying where it is.
+
+        with TrajectoryWriter("data/trajectories/run") as writer:
+            writer.record(sim)
+            sim.run(1000, until=lambda: writer.record(sim))
+
+    `record` returns False, so it can be passed as the `until` hook of
+    `CA.run` to record after every step. The files are written in order
+    (data before its index row), so a run that was cut off can still be
+    read up to the last complete step.
+    """
+    def __init__(self, path: str, toxin_dtype=np.float16, metadata: dict | None = None):
+        self.path = path
+        self.toxin_dtype = np.dtype(toxin_dtype)
+        assert self.toxin_dtype in (np.float16, np.float32), "Toxins are float16 or float32"
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump({"version": FORMAT_VERSION, "toxin_dtype": self.toxin_dtype.name,
+                       "metadata": metadata or {}}, file)
+
+        self._states = open(os.path.join(path, "states.bin"), "wb")
+        self._toxins = open(os.path.join(path, "toxins.bin"), "wb")
+        self._index = open(os.path.join(path, "index.bin"), "wb")
+        self.steps = 0
+
+    def append(self, frame: Frame):
+        """
+        Write a frame, its toxins are converted to the toxin dtype
+        """
+        h, w = frame.states.shape
+        row = (frame.time, frame.origin[0], frame.origin[1], h, w,
+               self._states.tell(), self._toxins.tell() // self.toxin_dtype.itemsize)
+        self._states.write(np.ascontiguousarray(frame.states, dtype=np.uint8).tobytes())
+        self._toxins.write(np.ascontiguousarray(frame.toxins, dtype=self.toxin_dtype).tobytes())
+        self._index.write(np.array(row, dtype=np.int64).tobytes())
+        self.steps += 1
+
+    def record(self, sim) -> bool:
+        """
+        Write the current step of a simulation
+
+        :param sim: simulation to record
+        :type sim: CA
+        :return: Returns False, to be used as the `until` hook of `CA.run`
+        :rtype: bool
+        """
+        self.append(Frame.from_grids(sim.time, sim.state_grid, sim.toxicity_grid,
+                                     self.toxin_dtype))
+        return False
+
+    def flush(self):
+        for file in (self._states, self._toxins, self._index):
+            file.flush()
+
+    def close(self):
+        if self._index.closed:
+            return
+        self.flush()
+        for file in (self._states, self._toxins, self._index):
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Trajectory:
+    """
+    Reader of a run written by `TrajectoryWriter`. The step data is memory
+    mapped, so only the parts that are read are loaded from disk.
+
+        run = Trajectory("data/trajectories/run")
+        frame = run.frame(500)
+        times, states, toxins = run.cell(40, 37)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unknown trajectory format version {meta['version']}")
+        self.metadata = meta["metadata"]
+        self.toxin_dtype = np.dtype(meta["toxin_dtype"])
+
+        # Rows of a step that was cut off while writing are left out
+        index = np.fromfile(os.path.join(path, "index.bin"), dtype=np.int64)
+        index = index[:len(index) - len(index) % len(INDEX_COLUMNS)].reshape(-1, len(INDEX_COLUMNS))
+        self.states = self._map("states.bin", np.uint8)
+        self.toxins = self._map("toxins.bin", self.toxin_dtype)
+
+        sizes = index[:, 3] * index[:, 4]
+        complete = ((index[:, 5] + sizes <= len(self.states))
+                    & (index[:, 6] + sizes <= len(self.toxins)))
+        self.index = index[:np.argmin(complete) if not complete.all() else len(index)]
+        self.times = self.index[:, 0]
+
+    def _map(self, name: str, dtype) -> np.ndarray:
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _row(self, time: int) -> np.ndarray:
+        position = np.searchsorted(self.times, time)
+        if position == len(self.times) or self.times[position] != time:
+            raise KeyError(f"Step {time} is not in the trajectory")
+        return self.index[position]
+
+    def frame(self, time: int) -> Frame:
+        """
+        Frame of step `time`, its arrays are read-only views of the file
+
+        :param time: step of the simulation
+        :type time: int
+        :return: the frame
+        :rtype: Frame
+        """
+        time, y0, x0, h, w, state_offset, toxin_offset = self._row(time).tolist()
+        states = self.states[state_offset:state_offset + h * w].reshape(h, w)
+        toxins = self.toxins[toxin_offset:toxin_offset + h * w].reshape(h, w)
+        return Frame(time, (y0, x0), states, toxins)
+
+    def grids(self, time: int) -> tuple[dict, dict]:
+        """
+        State and toxicity grids of step `time`, as the simulation has them
+        """
+        frame = self.frame(time)
+        states = grid_to_dict(np.asarray(frame.states), frame.origin)
+        toxins = grid_to_dict(np.asarray(frame.toxins, dtype=float), frame.origin)
+        return states, toxins
+
+    def cell(self, y: int, x: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        State and toxicity of a single cell at every step, only reading that
+        cell of every step from disk
+
+        :param y: y coordinate
+        :type y: int
+        :param x: x coordinate
+        :type x: int
+        :return: Returns the steps, states and toxicities
+        :rtype: tuple[ndarray, ndarray, ndarray]
+        """
+        _, y0, x0, h, w, state_offset, toxin_offset = self.index.T
+        inside = (y0 <= y) & (y < y0 + h) & (x0 <= x) & (x < x0 + w)
+        offsets = (y - y0) * w + (x - x0)
+
+        states = np.zeros(len(self), dtype=np.uint8)
+        toxins = np.zeros(len(self), dtype=float)
+        states[inside] = self.states[state_offset[inside] + offsets[inside]]
+        toxins[inside] = self.toxins[toxin_offset[inside] + offsets[inside]]
+        return self.times.copy(), states, toxins
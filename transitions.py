@@ -1,373 +1,55 @@
 from CA import CA
 from config import (
-    EMPTY, SPORE, YOUNG, MATURING, MUSHROOMS, OLDER, DECAYING, DEAD1, DEAD2,
-    INERT, MOORE_NBD, TOXIN_RELEASING_STATES
+    SPORE, YOUNG, MATURING, MUSHROOMS, OLDER, TOXIN_RELEASING_STATES
+)
+from rules import (
+    RuleTable, THRESHOLD_INHIBITION, PROBABILISTIC_INHIBITION
 )
-from utils import apply_diffusion
-
-import numpy as np
-
-
-class BasicSim(CA):
-    def __init__(self, parameters):
-        super().__init__(parameters["n"])
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-
-    def change_parameters(self, parameters):
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-
-    def state_transition(self, x: int, y: int) -> int:
-        state_grid = self.state_grid
-        state = state_grid.get((y, x), EMPTY)
-
-        if state == SPORE:
-            if np.random.random() < self.prob_spore_to_hyphae:
-                return YOUNG
-            return SPORE
-
-        if state == YOUNG:
-            return MATURING
-
-        if state == MATURING:
-            if np.random.random() < self.prob_mushroom:
-                return MUSHROOMS
-            return OLDER
-
-        if state == OLDER:
-            return DECAYING
-
-        if state == MUSHROOMS:
-            return DECAYING
-
-        if state == DECAYING:
-            return DEAD1
-
-        if state == DEAD1:
-            return DEAD2
-
-        if state == DEAD2:
-            return EMPTY
-
-        if state == EMPTY:
-            for (dx, dy) in MOORE_NBD:
-                # No boundary check needed for infinite grid
-                if not state_grid.get((y + dy, x + dx), EMPTY) == YOUNG:
-                    continue
-                if np.random.random() < self.prob_spread/np.linalg.norm((dx, dy)):
-                    return YOUNG
-            return EMPTY
-
-        if state == INERT:
-            return INERT
-
-        raise ValueError
-
-    def toxin_transition(self) -> dict:
-        return {}
-
-
-class BasicToxinSim(CA):
-    def __init__(self, parameters):
-        super().__init__(parameters["n"])
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_threshold: float = parameters["toxin_threshold"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
-
-    def change_parameters(self, parameters):
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_threshold: float = parameters["toxin_threshold"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
-
-    def state_transition(self, x: int, y: int) -> int:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
-
-        state = state_grid.get((y, x), EMPTY)
-
-        if state == SPORE:
-            if np.random.random() < self.prob_spore_to_hyphae:
-                return YOUNG
-            return SPORE
-
-        if state == YOUNG:
-            return MATURING
-
-        if state == MATURING:
-            if np.random.random() < self.prob_mushroom:
-                return MUSHROOMS
-            return OLDER
-
-        if state == OLDER:
-            return DECAYING
-
-        if state == MUSHROOMS:
-            return DECAYING
-
-        if state == DECAYING:
-            return DEAD1
-
-        if state == DEAD1:
-            return DEAD2
-
-        if state == DEAD2:
-            return EMPTY
-
-        if state == EMPTY:
-            for (dx, dy) in MOORE_NBD:
-                if not state_grid.get((y + dy, x + dx), EMPTY) == YOUNG:
-                    continue
-                if toxicity_grid.get((y, x), 0.0) > self.toxin_threshold:
-                    continue
-                if np.random.random() <\
-                        self.prob_spread / np.linalg.norm((dx, dy)):
-                    return YOUNG
-            return EMPTY
-
-        if state == INERT:
-            return INERT
-
-        raise ValueError
-
-    def toxin_transition(self) -> dict:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
-
-        source_grid = {}
-
-        # Consider all existing toxicity
-        for (y, x), val in toxicity_grid.items():
-            state = state_grid.get((y, x), EMPTY)
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
-            else:
-                new_val = max(val - self.toxin_decay, 0)
-                if new_val > 0:
-                    source_grid[(y, x)] = new_val
-
-        # Consider all toxin releasing states
-        for (y, x), state in state_grid.items():
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
-
-        new_toxicity_grid = apply_diffusion(
-            source_grid,
-            self.toxin_convolution_size,
-            self.toxin_convolution_variance
-        )
-
-        return new_toxicity_grid
-
-
-class ProbToxinSim(CA):
-    def __init__(self, parameters):
-        super().__init__(parameters["n"])
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
-
-    def change_parameters(self, parameters):
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
-
-    def state_transition(self, x: int, y: int) -> int:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
-
-        state = state_grid.get((y, x), EMPTY)
-
-        if state == SPORE:
-            if np.random.random() < self.prob_spore_to_hyphae:
-                return YOUNG
-            return SPORE
-
-        if state == YOUNG:
-            return MATURING
-
-        if state == MATURING:
-            if np.random.random() < self.prob_mushroom:
-                return MUSHROOMS
-            return OLDER
-
-        if state == OLDER:
-            return DECAYING
-
-        if state == MUSHROOMS:
-            return DECAYING
-
-        if state == DECAYING:
-            return DEAD1
-
-        if state == DEAD1:
-            return DEAD2
-
-        if state == DEAD2:
-            return EMPTY
-
-        if state == EMPTY:
-            for (dx, dy) in MOORE_NBD:
-                if not state_grid.get((y + dy, x + dx), EMPTY) == YOUNG:
-                    continue
-                if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                    continue
-                if np.random.random() < self.prob_spread/np.linalg.norm((dx, dy)):
-                    return YOUNG
-            return EMPTY
-
-        if state == INERT:
-            return INERT
-
-        raise ValueError
-
-    def toxin_transition(self) -> dict:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
-
-        source_grid = {}
-
-        # Consider all existing toxicity
-        for (y, x), val in toxicity_grid.items():
-            state = state_grid.get((y, x), EMPTY)
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
-            else:
-                new_val = max(val - self.toxin_decay, 0)
-                if new_val > 0:
-                    source_grid[(y, x)] = new_val
-
-        # Consider all toxin releasing states
-        for (y, x), state in state_grid.items():
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
-
-        new_toxicity_grid = apply_diffusion(
-            source_grid,
-            self.toxin_convolution_size,
-            self.toxin_convolution_variance
-        )
 
-        return new_toxicity_grid
 
+class RuleSim(CA):
+    """
+    Simulation defined by its rule table. Subclasses only set `rules`, every
+    parameter the table reads is taken from the parameter dict.
 
-class ProbToxinDeathSim(CA):
-    def __init__(self, parameters):
-        super().__init__(parameters["n"])
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
+    Models with toxins take an optional "toxin_coarsening" parameter, see
+    `CA.set_toxin_coarsening`.
+    """
+    def __init__(self, parameters, seed=None):
+        super().__init__(parameters["n"], seed)
+        self.change_parameters(parameters)
 
     def change_parameters(self, parameters):
-        self.prob_spore_to_hyphae: float = parameters["prob_spore_to_hyphae"]
-        self.prob_mushroom: float = parameters["prob_mushroom"]
-        self.prob_spread: float = parameters["prob_spread"]
-        self.toxin_decay: float = parameters["toxin_decay"]
-        self.toxin_convolution_size: int = parameters["toxin_convolution_size"]
-        self.toxin_convolution_variance: float = parameters["toxin_convolution_variance"]
-
-    def state_transition(self, x: int, y: int) -> int:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
-
-        state = state_grid.get((y, x), EMPTY)
-
-        if state == SPORE:
-            if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                return DEAD1
-            if np.random.random() < self.prob_spore_to_hyphae:
-                return YOUNG
-            return SPORE
-
-        if state == YOUNG:
-            if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                return DEAD1
-            return MATURING
-
-        if state == MATURING:
-            if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                return DEAD1
-            if np.random.random() < self.prob_mushroom:
-                return MUSHROOMS
-            return OLDER
-
-        if state == OLDER:
-            if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                return DEAD1
-            return DECAYING
-
-        if state == MUSHROOMS:
-            if np.random.random() < toxicity_grid.get((y, x), 0.0):
-                return DEAD1
-            return DECAYING
-
-        if state == DECAYING:
-            return DEAD1
-
-        if state == DEAD1:
-            return DEAD2
-
-        if state == DEAD2:
-            return EMPTY
-
-        if state == EMPTY:
-            for (dx, dy) in MOORE_NBD:
-                if not state_grid.get((y + dy, x + dx), EMPTY) == YOUNG:
-                    continue
-                if np.random.random() <\
-                        self.prob_spread / np.linalg.norm((dx, dy)):
-                    return YOUNG
-            return EMPTY
+        for name in self.rules.parameters:
+            setattr(self, name, parameters[name])
+        if self.rules.has_toxins:
+            self.set_toxin_coarsening(parameters.get("toxin_coarsening", 1))
+        self.compile_rules()
 
-        if state == INERT:
-            return INERT
 
-        raise ValueError
+class BasicSim(RuleSim):
+    rules = RuleTable()
 
-    def toxin_transition(self) -> dict:
-        state_grid = self.state_grid
-        toxicity_grid = self.toxicity_grid
 
-        source_grid = {}
+class BasicToxinSim(RuleSim):
+    # No spreading at all into cells above the toxin threshold
+    rules = RuleTable(
+        spread_inhibition=THRESHOLD_INHIBITION,
+        toxin_releasing=TOXIN_RELEASING_STATES
+    )
 
-        # Consider all existing toxicity
-        for (y, x), val in toxicity_grid.items():
-            state = state_grid.get((y, x), EMPTY)
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
-            else:
-                new_val = max(val - self.toxin_decay, 0)
-                if new_val > 0:
-                    source_grid[(y, x)] = new_val
 
-        # Consider all toxin releasing states
-        for (y, x), state in state_grid.items():
-            if state in TOXIN_RELEASING_STATES:
-                source_grid[(y, x)] = 1
+class ProbToxinSim(RuleSim):
+    # Every spread attempt is blocked with a probability equal to the toxicity
+    rules = RuleTable(
+        spread_inhibition=PROBABILISTIC_INHIBITION,
+        toxin_releasing=TOXIN_RELEASING_STATES
+    )
 
-        new_toxicity_grid = apply_diffusion(
-            source_grid,
-            self.toxin_convolution_size,
-            self.toxin_convolution_variance
-        )
 
-        return new_toxicity_grid
+class ProbToxinDeathSim(RuleSim):
+    # Living cells die with a probability equal to their toxicity
+    rules = RuleTable(
+        toxin_death=(SPORE, YOUNG, MATURING, OLDER, MUSHROOMS),
+        toxin_releasing=TOXIN_RELEASING_STATES
+    )
@@ -1,9 +1,13 @@
 import numpy as np
 import csv
+import itertools
+import math
+import os
 
 from config import EVALUATED_FUNGI_DATASET
 
-from scipy import stats
+# scipy is imported by the functions that use it, so importing the engines
+# stays fast for short headless runs
 
 
 def gkern(l: int, sig: float) -> np.ndarray:
@@ -25,6 +29,170 @@ def gkern_1d(l: int, sig: float) -> np.ndarray:
     return gauss / np.sum(gauss)
 
 
+def rasterize(source: dict, pad: int = 0, dtype=float) -> tuple[np.ndarray, tuple[int, int]]:
+    """
+    Convert a sparse coordinate dictionary into a dense array over its
+    bounding box
+
+    :param source: Coordinates with their values
+    :type source: dict
+    :param pad: Amount of empty cells around the bounding box
+    :type pad: int
+    :param dtype: Type of the returned array
+    :return: Returns the dense array and the (y, x) coordinate of index (0, 0)
+    :rtype: tuple[ndarray, tuple[int, int]]
+    """
+    if not source:
+        return np.zeros((2 * pad, 2 * pad), dtype=dtype), (-pad, -pad)
+
+    coords = np.array(list(source.keys()))
+    ys, xs = coords[:, 0], coords[:, 1]
+    min_y, min_x = ys.min() - pad, xs.min() - pad
+    height = ys.max() - min_y + pad + 1
+    width = xs.max() - min_x + pad + 1
+
+    dense = np.zeros((height, width), dtype=dtype)
+    dense[ys - min_y, xs - min_x] = list(source.values())
+    return dense, (int(min_y), int(min_x))
+
+
+def coordinate_array(coordinates) -> np.ndarray:
+    """
+    (k, 2) int64 array of (y, x) coordinates, e.g. the keys of a grid,
+    without building a list of tuples first
+    """
+    flat = np.fromiter(itertools.chain.from_iterable(coordinates), dtype=np.int64,
+                       count=2 * len(coordinates))
+    return flat.reshape(-1, 2)
+
+
+def save_npz(path: str, arrays: dict[str, np.ndarray]):
+    """
+    Write arrays to an uncompressed `.npz` file next to `path` and move it
+    in place, so readers never see half a file and a crash never leaves one
+    """
+    partial = f"{path}.{os.getpid()}.partial"
+    with open(partial, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(partial, path)
+
+
+def grid_to_dict(dense: np.ndarray, origin: tuple[int, int],
+                 mask: np.ndarray | None = None) -> dict:
+    """
+    Convert a dense array back into a sparse coordinate dictionary
+
+    :param dense: Dense array
+    :type dense: ndarray
+    :param origin: (y, x) coordinate of index (0, 0)
+    :type origin: tuple[int, int]
+    :param mask: Cells to include, defaults to all non-zero cells
+    :type mask: ndarray | None
+    :return: Returns a dictionary of coordinates with their values
+    :rtype: dict
+    """
+    y0, x0 = origin
+    ys, xs = np.nonzero(dense if mask is None else mask)
+    values = dense[ys, xs].tolist()
+    return dict(zip(zip((ys + y0).tolist(), (xs + x0).tolist()), values))
+
+
+# Kernels built by `diffusion_kernel` in this process, keyed (size,
+# variance, factor). Worker pools fill it up front, see `pool.WarmPool`.
+KERNELS: dict[tuple[int, float, int], np.ndarray] = {}
+
+
+def diffusion_kernel(conv_size: int, conv_var: float, factor: int = 1) -> np.ndarray:
+    """
+    1d kernel of `apply_diffusion`, padded to an odd, centred kernel for
+    `diffuse`. Even kernels reach one cell further left than right, so they
+    get a zero weight on the right.
+
+    With a `factor` the kernel is scaled down for a field that is coarsened
+    by that factor, see `coarsen`.
+
+    :param conv_size: width of convolution
+    :type conv_size: int
+    :param conv_var: variance of convolution
+    :type conv_var: float
+    :param factor: coarsening factor of the field
+    :type factor: int
+    :return: Returns the centred 1d kernel
+    :rtype: ndarray
+    """
+    key = (int(conv_size), float(conv_var), int(factor))
+    kernel_1d = KERNELS.get(key)
+    if kernel_1d is not None:
+        return kernel_1d
+
+    if factor > 1:
+        size = math.ceil(conv_size / factor)
+        kernel_1d = gkern_1d(size + 1 - size % 2, conv_var / factor)
+    else:
+        kernel_1d = gkern_1d(conv_size, conv_var)
+        if len(kernel_1d) % 2 == 0:
+            kernel_1d = np.append(kernel_1d, 0.0)
+
+    # Shared by every simulation in the process, so nobody may write to it
+    kernel_1d.flags.writeable = False
+    KERNELS[key] = kernel_1d
+    return kernel_1d
+
+
+def diffuse(source: np.ndarray, kernel_1d: np.ndarray,
+            out: np.ndarray | None = None,
+            scratch: np.ndarray | None = None) -> np.ndarray:
+    """
+    Separable diffusion of a dense field over its last two axes, with the
+    same offsets as `apply_diffusion`. Everything outside the array is
+    treated as zero, so the caller has to leave enough margin.
+
+    :param source: Dense toxicity field
+    :type source: ndarray
+    :param kernel_1d: 1d diffusion kernel
+    :type kernel_1d: ndarray
+    :param out: Array to store the result in, may be `source` itself
+    :type out: ndarray | None
+    :param scratch: Array of the same shape for the intermediate result,
+        must not be `source`
+    :type scratch: ndarray | None
+    :return: Returns the diffused field
+    :rtype: ndarray
+    """
+    from scipy.ndimage import convolve1d
+
+    if len(kernel_1d) % 2 == 0:
+        kernel_1d = np.append(kernel_1d, 0.0)
+
+    target = convolve1d(source, kernel_1d, axis=-1, mode="constant", output=scratch)
+    return convolve1d(target, kernel_1d, axis=-2, mode="constant", output=out)
+
+
+def apply_kernel(source: dict, kernel_1d: np.ndarray) -> dict:
+    """
+    Apply toxin diffusion with a given 1d kernel in both directions
+
+    :param source: Coordinates to be evaluated with toxicity level
+    :type source: dict
+    :param kernel_1d: 1d diffusion kernel, see `diffusion_kernel`
+    :type kernel_1d: ndarray
+    :return: Returns a new set of coordinates with toxicity level
+    :rtype: dict[Any, Any]
+    """
+    if not source:
+        return {}
+
+    pad = len(kernel_1d) // 2
+    field, origin = rasterize(source, pad)
+
+    # Every cell reached by a non-zero kernel weight gets an entry, even if
+    # its value ends up zero.
+    present, _ = rasterize(dict.fromkeys(source, 1.0), pad)
+    reach = diffuse(present, (kernel_1d != 0).astype(float)) > 0
+
+    return grid_to_dict(diffuse(field, kernel_1d), origin, reach)
+
+
 def apply_diffusion(source: dict, conv_size: int, conv_var: float) -> dict:
     """
     Apply toxin diffusion convolution directions
@@ -38,38 +206,119 @@ def apply_diffusion(source: dict, conv_size: int, conv_var: float) -> dict:
     :return: Returns a new set of coordinates with toxicity level
     :rtype: dict[Any, Any]
     """
-    kernel_1d = gkern_1d(conv_size, conv_var)
-    k = len(kernel_1d)
-    c = k // 2
+    return apply_kernel(source, diffusion_kernel(conv_size, conv_var))
 
-    target = {}
-    for (y, x), val in source.items():
-        for d in range(k):
-            kv = kernel_1d[d]
-            if kv == 0:
-                continue
 
-            t1 = y
-            t2 = x + (d - c)
+def coarsen(grid: dict, factor: int) -> dict:
+    """
+    Average a field over blocks of `factor` x `factor` cells. Block (Y, X)
+    covers the cells with y // factor == Y and x // factor == X.
+
+    :param grid: Coordinates with their values
+    :type grid: dict
+    :param factor: Block size
+    :type factor: int
+    :return: Returns the block coordinates with their mean value
+    :rtype: dict
+    """
+    area = factor * factor
+    coarse = {}
+    for (y, x), val in grid.items():
+        block = (y // factor, x // factor)
+        coarse[block] = coarse.get(block, 0.0) + val / area
+    return coarse
 
-            target[(t1, t2)] = (
-                target.get((t1, t2), 0.0) + val * kv
-            )
 
-    next_target = {}
-    for (y, x), val in target.items():
-        for d in range(k):
-            kv = kernel_1d[d]
-            if kv == 0:
-                continue
+def interpolate(coarse: dict, factor: int, y: int, x: int) -> float:
+    """
+    Bilinear interpolation of a coarsened field at a single cell, with the
+    block values located at the block centres
+
+    :param coarse: Block coordinates with their values, see `coarsen`
+    :type coarse: dict
+    :param factor: Block size
+    :type factor: int
+    :return: Returns the value at cell (y, x)
+    :rtype: float
+    """
+    cy = (y + 0.5) / factor - 0.5
+    cx = (x + 0.5) / factor - 0.5
+    y0, x0 = math.floor(cy), math.floor(cx)
+    wy, wx = cy - y0, cx - x0
 
-            t1 = y + (d - c)
-            t2 = x
-            next_target[(t1, t2)] = (
-                next_target.get((t1, t2), 0.0) + val * kv
-            )
+    return (
+        (1 - wy) * ((1 - wx) * coarse.get((y0, x0), 0.0)
+                    + wx * coarse.get((y0, x0 + 1), 0.0))
+        + wy * ((1 - wx) * coarse.get((y0 + 1, x0), 0.0)
+                + wx * coarse.get((y0 + 1, x0 + 1), 0.0))
+    )
+
+
+def _linear_weights(length: int, factor: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lower block index and weight of the upper block for every cell of a
+    padded coarse axis of `length` blocks
+    """
+    centre = (np.arange(length * factor) + 0.5) / factor - 0.5
+    lower = np.clip(np.floor(centre).astype(int), 0, length - 2)
+    return lower, np.clip(centre - lower, 0, 1)
+
+
+def refine(coarse: dict, factor: int) -> dict:
+    """
+    Bilinear interpolation of a coarsened field back to every cell, the
+    dense counterpart of `interpolate`
+
+    :param coarse: Block coordinates with their values, see `coarsen`
+    :type coarse: dict
+    :param factor: Block size
+    :type factor: int
+    :return: Returns the non-zero cells with their interpolated value
+    :rtype: dict
+    """
+    if not coarse:
+        return {}
+
+    field, (y0, x0) = rasterize(coarse, 1)
+    rows, wy = _linear_weights(field.shape[0], factor)
+    cols, wx = _linear_weights(field.shape[1], factor)
+
+    field = (1 - wy)[:, None] * field[rows] + wy[:, None] * field[rows + 1]
+    field = (1 - wx) * field[:, cols] + wx * field[:, cols + 1]
+    return grid_to_dict(field, (y0 * factor, x0 * factor))
+
+
+def coarse_diffusion_error(source: dict, conv_size: int, conv_var: float,
+                           factor: int) -> tuple[float, float]:
+    """
+    Error of one diffusion step on a field coarsened by `factor`, against
+    the same step at full resolution
+
+    :param source: Coordinates to be evaluated with toxicity level
+    :type source: dict
+    :param conv_size: width of convolution
+    :type conv_size: int
+    :param conv_var: variance of convolution
+    :type conv_var: float
+    :param factor: Block size
+    :type factor: int
+    :return: Returns the maximum absolute error and the error relative to the
+        full resolution field, both over all cells
+    :rtype: tuple[float, float]
+    """
+    exact = apply_diffusion(source, conv_size, conv_var)
+    approx = refine(
+        apply_kernel(coarsen(source, factor),
+                     diffusion_kernel(conv_size, conv_var, factor)),
+        factor
+    )
+    if not exact and not approx:
+        return 0.0, 0.0
 
-    return next_target
+    cells = exact.keys() | approx.keys()
+    errors = np.array([approx.get(c, 0.0) - exact.get(c, 0.0) for c in cells])
+    norm = np.sqrt(sum(v * v for v in exact.values()))
+    return float(np.abs(errors).max()), float(np.sqrt(np.sum(errors ** 2)) / norm)
 
 
 def read_fairy_data(filename="data/fairy_ring_data.csv") -> np.ndarray:
@@ -134,6 +383,34 @@ def linear_regression(points: np.ndarray | None = None) -> tuple:
     return intercept, slope
 
 
+def stacked_linear_regression(xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `linear_regression` of many series at once, solved in closed form for
+    all of them together. Row i of `xs` and `ys` holds the points of series
+    i, NaN entries are left out so series may have different lengths.
+
+    :param xs: x-values of every series
+    :type xs: ndarray
+    :param ys: y-values of every series
+    :type ys: ndarray
+    :return: intercepts and slopes, NaN for series whose x-values do not vary
+    :rtype: tuple[ndarray, ndarray]
+    """
+    mask = ~(np.isnan(xs) | np.isnan(ys))
+    n = mask.sum(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = np.where(mask, xs, 0.0).sum(axis=-1) / n
+        y_mean = np.where(mask, ys, 0.0).sum(axis=-1) / n
+        dx = np.where(mask, xs - x_mean[..., None], 0.0)
+        dy = np.where(mask, ys - y_mean[..., None], 0.0)
+
+        Sxx = np.sum(dx * dx, axis=-1)
+        slopes = np.where(Sxx > 0, np.sum(dx * dy, axis=-1) / Sxx, np.nan)
+    intercepts = y_mean - slopes * x_mean
+    return intercepts, slopes
+
+
 def regression_ci(points, confidence=0.95) -> tuple:
     '''
     Calculates the confidence interval of a linear regression
@@ -142,6 +419,8 @@ def regression_ci(points, confidence=0.95) -> tuple:
     :param points: set of points
     :param confidence: confidence
     '''
+    from scipy import stats
+
     x = points[:, 0]
     y = points[:, 1]
 
@@ -173,22 +452,125 @@ def regression_ci(points, confidence=0.95) -> tuple:
     return intercept_ci, slope_ci
 
 
-def bootstrap_slope_ci(points, n_boot=5000, confidence=0.95):
-    slopes = []
+def bootstrap_regression(points: np.ndarray, n_boot: int = 5000,
+                         seed: int | np.random.SeedSequence | None = None,
+                         chunk_size: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Intercepts and slopes of `n_boot` bootstrap resamples of `points`. The
+    resample indices are drawn as (chunk_size, n) arrays and every chunk is
+    fitted at once by `stacked_linear_regression`, so memory stays bounded
+    for any `n_boot`.
+
+    :param points: (n, 2) array of x and y values
+    :type points: ndarray
+    :param n_boot: amount of resamples
+    :type n_boot: int
+    :param seed: seed of the resampling, the global numpy random state is
+        used if not given
+    :type seed: int | np.random.SeedSequence | None
+    :param chunk_size: resamples per chunk, defaults to about a million
+        indices per chunk
+    :type chunk_size: int | None
+    :return: intercepts and slopes, NaN for resamples whose x-values do not
+        vary
+    :rtype: tuple[ndarray, ndarray]
+    """
+    points = np.asarray(points, dtype=float)
     n = len(points)
+    rng = None if seed is None else np.random.default_rng(seed)
+    chunk_size = chunk_size or max(1, 2**20 // n)
+
+    intercepts = np.empty(n_boot)
+    slopes = np.empty(n_boot)
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        if rng is None:
+            indices = np.random.randint(0, n, (size, n))
+        else:
+            indices = rng.integers(0, n, (size, n))
+        sample = points[indices]
+        intercepts[start:start + size], slopes[start:start + size] = \
+            stacked_linear_regression(sample[..., 0], sample[..., 1])
+    return intercepts, slopes
+
+
+def _bca_levels(estimate: float, boot: np.ndarray, jackknife: np.ndarray,
+                alpha: float) -> tuple[float, float]:
+    """
+    Bias-corrected and accelerated quantile levels of a two-sided interval
+    """
+    from scipy import stats
+
+    bias = stats.norm.ppf(np.mean(boot < estimate))
+    deviation = np.mean(jackknife) - jackknife
+    spread = np.sum(deviation**2)
+    acceleration = np.sum(deviation**3) / (6 * spread**1.5) if spread > 0 else 0.0
 
-    for _ in range(n_boot):
-        sample = points[np.random.randint(0, n, n)]
-        _, slope = linear_regression(sample)
-        if slope is not None:
-            slopes.append(slope)
+    levels = []
+    for z in stats.norm.ppf([alpha, 1 - alpha]):
+        levels.append(stats.norm.cdf(bias + (bias + z) / (1 - acceleration * (bias + z))))
+    return levels[0], levels[1]
 
-    slopes = np.array(slopes)
+
+def bootstrap_ci(points: np.ndarray, n_boot: int = 5000, confidence: float = 0.95,
+                 method: str = "percentile",
+                 seed: int | np.random.SeedSequence | None = None,
+                 chunk_size: int | None = None) -> tuple:
+    """
+    Bootstrap confidence intervals of the intercept and slope of a linear
+    regression, see `bootstrap_regression`
+
+    :param points: (n, 2) array of x and y values
+    :type points: ndarray
+    :param n_boot: amount of resamples
+    :type n_boot: int
+    :param confidence: confidence of the intervals
+    :type confidence: float
+    :param method: "percentile", or "bca" for bias-corrected and accelerated
+        intervals
+    :type method: str
+    :param seed: seed of the resampling, the global numpy random state is
+        used if not given
+    :type seed: int | np.random.SeedSequence | None
+    :param chunk_size: resamples per chunk
+    :type chunk_size: int | None
+    :return: intercept interval and slope interval, like `regression_ci`
+    :rtype: tuple
+    """
+    if method not in ("percentile", "bca"):
+        raise ValueError(f"Unknown bootstrap interval method {method}")
+
+    points = np.asarray(points, dtype=float)
     alpha = (1 - confidence) / 2
-    return (
-        np.quantile(slopes, alpha),
-        np.quantile(slopes, 1 - alpha)
-    )
+    boot = bootstrap_regression(points, n_boot, seed, chunk_size)
+
+    if method == "bca":
+        estimates = stacked_linear_regression(points[:, 0], points[:, 1])
+
+        # Leave-one-out fits, row i leaves out point i
+        n = len(points)
+        left_out = np.eye(n, dtype=bool)
+        jackknife = stacked_linear_regression(
+            np.where(left_out, np.nan, points[:, 0]),
+            np.where(left_out, np.nan, points[:, 1])
+        )
+
+    intervals = []
+    for i, values in enumerate(boot):
+        values = values[~np.isnan(values)]
+        levels = (alpha, 1 - alpha)
+        if method == "bca":
+            levels = _bca_levels(estimates[i], values, jackknife[i], alpha)
+        intervals.append(tuple(np.quantile(values, levels)))
+    return intervals[0], intervals[1]
+
+
+def bootstrap_slope_ci(points, n_boot=5000, confidence=0.95):
+    """
+    Percentile bootstrap interval of the slope of a linear regression
+    """
+    _, slope_ci = bootstrap_ci(points, n_boot, confidence)
+    return slope_ci
 
 
 class Point():
@@ -216,41 +598,187 @@ def on_the_left_or_line(p1: Point, p2: Point, p3: Point) -> bool:
     return val > 0
 
 
-def convex_hull(points: list[Point]) -> tuple[float, list[Point]]:
-    points.sort(key=lambda p: (p.x, p.y))
-    upper_hull: list[Point] = []
-    for i in range(len(points)):
-        upper_hull.append(points[i])
-        while len(upper_hull) > 2:
-            if on_the_left_or_line(upper_hull[-3], upper_hull[-2], upper_hull[-1]):
-                upper_hull.pop(-2)
-                continue
-            break
-    lower_hull: list[Point] = []
-    for i in range(len(points) - 1, -1, -1):
-        lower_hull.append(points[i])
-        while len(lower_hull) > 2:
-            if on_the_left_or_line(lower_hull[-3], lower_hull[-2], lower_hull[-1]):
-                lower_hull.pop(-2)
+# Manhattan distance to the nearest hull vertex within which a point counts
+# towards the ring
+RING_DISTANCE = 12
+
+
+def hull_candidates(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Indices of the points that can lie on the convex hull, sorted by (x, y):
+    the lowest and highest point of every column and all points of the two
+    outer columns. Any other point lies strictly between two points of its
+    column and has points on both sides, so it is inside the hull.
+
+    :param xs: x coordinates
+    :type xs: ndarray
+    :param ys: y coordinates
+    :type ys: ndarray
+    :return: Returns the candidate indices
+    :rtype: ndarray
+    """
+    order = np.lexsort((ys, xs))
+    sorted_xs = xs[order]
+    new_column = sorted_xs[1:] != sorted_xs[:-1]
+
+    keep = (sorted_xs == sorted_xs[0]) | (sorted_xs == sorted_xs[-1])
+    keep[1:] |= new_column
+    keep[:-1] |= new_column
+    return order[keep]
+
+
+def _half_hull(points: list[tuple], order) -> list[int]:
+    """
+    One half of the monotone chain, keeping collinear points like
+    `on_the_left_or_line`
+    """
+    hull: list[int] = []
+    for i in order:
+        hull.append(i)
+        while len(hull) > 2:
+            x1, y1 = points[hull[-3]]
+            x2, y2 = points[hull[-2]]
+            x3, y3 = points[hull[-1]]
+            if (x2 - x1) * (y3 - y2) - (y2 - y1) * (x3 - x2) > 0:
+                hull.pop(-2)
                 continue
             break
-    if lower_hull:
-        lower_hull.pop(0)
-    if lower_hull:
-        lower_hull.pop(-1)
-
-    hull = upper_hull + lower_hull
-
-    ring_count = 0
-    for point in points:
-        min_dist = 13
-        for other_point in hull:
-            if point.dist(other_point) < min_dist:
-                min_dist = point.dist(other_point)
-        if min_dist <= 12:
-            ring_count += 1
-
-    return ring_count/len(points), hull
+    return hull
+
+
+def monotone_chain(xs: np.ndarray, ys: np.ndarray) -> list[int]:
+    """
+    Hull vertices of points sorted by (x, y), in the order of `convex_hull`
+
+    :param xs: x coordinates, sorted together with `ys`
+    :type xs: ndarray
+    :param ys: y coordinates
+    :type ys: ndarray
+    :return: Returns the indices of the hull vertices
+    :rtype: list[int]
+    """
+    points = list(zip(xs.tolist(), ys.tolist()))
+    upper_hull = _half_hull(points, range(len(points)))
+    lower_hull = _half_hull(points, range(len(points) - 1, -1, -1))
+    return upper_hull + lower_hull[1:-1]
+
+
+def hull_distances(xs: np.ndarray, ys: np.ndarray, hull_xs: np.ndarray,
+                   hull_ys: np.ndarray) -> np.ndarray:
+    """
+    Manhattan distance of every point to its nearest hull vertex
+
+    :param xs: x coordinates
+    :type xs: ndarray
+    :param ys: y coordinates
+    :type ys: ndarray
+    :param hull_xs: x coordinates of the hull vertices
+    :type hull_xs: ndarray
+    :param hull_ys: y coordinates of the hull vertices
+    :type hull_ys: ndarray
+    :return: Returns the distances
+    :rtype: ndarray
+    """
+    # Points are done in chunks to bound the size of the distance matrix
+    chunk = max(1, 2**20 // len(hull_xs))
+    distances = np.empty(len(xs), dtype=np.int64)
+    for start in range(0, len(xs), chunk):
+        stop = start + chunk
+        distances[start:stop] = (
+            np.abs(xs[start:stop, None] - hull_xs)
+            + np.abs(ys[start:stop, None] - hull_ys)
+        ).min(axis=1)
+    return distances
+
+
+def _hull_points(xs: np.ndarray, ys: np.ndarray) -> list[Point]:
+    return [Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+def convex_hull_xy(xs, ys) -> tuple[float, list[Point]]:
+    """
+    `convex_hull` of points given as coordinate arrays
+
+    :param xs: x coordinates
+    :type xs: ndarray
+    :param ys: y coordinates
+    :type ys: ndarray
+    :return: Returns the fraction of points near a hull vertex and the hull
+    :rtype: tuple[float, list[Point]]
+    """
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    assert len(xs), "Need at least one point"
+
+    candidates = hull_candidates(xs, ys)
+    vertices = candidates[monotone_chain(xs[candidates], ys[candidates])]
+    hull_xs, hull_ys = xs[vertices], ys[vertices]
+
+    near = hull_distances(xs, ys, hull_xs, hull_ys) <= RING_DISTANCE
+    return np.count_nonzero(near) / len(xs), _hull_points(hull_xs, hull_ys)
+
+
+def convex_hull(points: list[Point]) -> tuple[float, list[Point]]:
+    """
+    Convex hull of the points, keeping points on its edges, and the fraction
+    of points within `RING_DISTANCE` of a hull vertex
+
+    :param points: points to evaluate
+    :type points: list[Point]
+    :return: Returns the fraction of points near a hull vertex and the hull
+    :rtype: tuple[float, list[Point]]
+    """
+    return convex_hull_xy([p.x for p in points], [p.y for p in points])
+
+
+class IncrementalHull:
+    """
+    `convex_hull_xy` of a point set that only grows. The hull of all points
+    is the hull of the previous hull vertices and the new points, and the
+    distances of the old points only have to be redone when the hull changed.
+    """
+    def __init__(self):
+        self.xs = np.empty(0, dtype=np.int64)
+        self.ys = np.empty(0, dtype=np.int64)
+        self.hull_xs = np.empty(0, dtype=np.int64)
+        self.hull_ys = np.empty(0, dtype=np.int64)
+        self._distances = np.empty(0, dtype=np.int64)
+
+    def add(self, xs, ys):
+        """
+        Add points that are not in the set yet
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        if not len(xs):
+            return
+
+        self.xs = np.concatenate((self.xs, xs))
+        self.ys = np.concatenate((self.ys, ys))
+
+        cand_xs = np.concatenate((self.hull_xs, xs))
+        cand_ys = np.concatenate((self.hull_ys, ys))
+        candidates = hull_candidates(cand_xs, cand_ys)
+        vertices = candidates[monotone_chain(cand_xs[candidates], cand_ys[candidates])]
+        hull_xs, hull_ys = cand_xs[vertices], cand_ys[vertices]
+
+        if np.array_equal(hull_xs, self.hull_xs) and np.array_equal(hull_ys, self.hull_ys):
+            new_distances = hull_distances(xs, ys, hull_xs, hull_ys)
+            self._distances = np.concatenate((self._distances, new_distances))
+        else:
+            self.hull_xs, self.hull_ys = hull_xs, hull_ys
+            self._distances = hull_distances(self.xs, self.ys, hull_xs, hull_ys)
+
+    def result(self) -> tuple[float, list[Point]] | None:
+        """
+        Same as `convex_hull_xy` of all points added so far, None if there
+        are none
+        """
+        if not len(self.xs):
+            return None
+
+        near = self._distances <= RING_DISTANCE
+        return np.count_nonzero(near) / len(self.xs), _hull_points(self.hull_xs, self.hull_ys)
 
 
 def area_polygon(points: list[Point]) -> float:
@@ -1,13 +1,64 @@
 from config import sim_parameters, SPORE
+from pool import WarmPool, kernel_keys
 from transitions import BasicSim, BasicToxinSim, ProbToxinSim, ProbToxinDeathSim
 import utils
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-def estimate_CA_vars(param: dict, iterations: int = 5, steps: int = 100) -> tuple:
+def diameter_series(param: dict, seed: np.random.SeedSequence, steps: int,
+                    sample_every: int = 1, model: type = BasicToxinSim) -> tuple:
     """
-    Function that performs iterative estimation of the diameter/time ratio of a CA model
+    Simulate one CA model and measure its inner ring hull every
+    `sample_every` steps
+
+    :param param: simulation parameters
+    :type param: dict
+    :param seed: random stream of the simulation
+    :type seed: np.random.SeedSequence
+    :param steps: Amount of steps simulated
+    :type steps: int
+    :param sample_every: Amount of steps between measurements
+    :type sample_every: int
+    :param model: transitions class to simulate
+    :type model: type
+    :return: Returns the hull diameter and hull ratio at every measurement,
+        NaN where there was no hull
+    :rtype: tuple[ndarray, ndarray]
+    """
+    sim = model(param, seed)
+    sim.set_state(param["n"]//2, param["n"]//2, SPORE)
+
+    samples = steps // sample_every
+    diameters = np.full(samples, np.nan)
+    hull_ratios = np.full(samples, np.nan)
+    for i in range(samples):
+        sim.run(sample_every)
+
+        hull = sim.inner_ring_detector()
+        if hull is None: continue
+        hull_ratio, hull_points = hull
+
+        area = utils.area_polygon(hull_points)
+        diameters[i] = 2*np.sqrt(area/np.pi)
+        hull_ratios[i] = hull_ratio
+
+    return diameters, hull_ratios
+
+
+def estimate_CA_vars(
+    param: dict,
+    iterations: int = 5,
+    steps: int = 100,
+    seed: int | None = None,
+    sample_every: int = 1,
+    max_workers: int | None = None,
+    model: type = BasicToxinSim,
+    pool: WarmPool | None = None
+) -> tuple:
+    """
+    Function that performs iterative estimation of the diameter/time ratio of a CA model.
+    The CA models run in parallel on a process pool and their regressions are
+    fitted all at once.
 
     :param param: simulation parameters
     :type param: dict
@@ -15,46 +66,51 @@ def estimate_CA_vars(param: dict, iterations: int = 5, steps: int = 100) -> tupl
     :type iterations: int
     :param steps: Amount of steps simulated per CA model
     :type steps: int
-    :return: Returns average intercept, average slope, and minimum hull ratio
-    :rtype: tuple[Any, ...]
+    :param seed: seed from which every CA model gets its own random stream
+    :type seed: int | None
+    :param sample_every: Amount of steps between hull measurements
+    :type sample_every: int
+    :param max_workers: amount of worker processes, defaults to all cores
+    :type max_workers: int | None
+    :param model: transitions class to simulate
+    :type model: type
+    :param pool: warm pool to run on, started for this call if not given
+    :type pool: WarmPool | None
+    :return: Returns the intercepts and slopes of every CA model with a
+        fit, and the hull ratios of every measurement
+    :rtype: tuple[ndarray, ndarray, ndarray]
     """
-    slopes = []
-    intercepts = []
-    hull_ratios = []
-    for t in range(iterations):
-        sim = BasicToxinSim(param)
-        sim.set_state(param["n"]//2, param["n"]//2, SPORE)
+    seeds = np.random.SeedSequence(seed).spawn(iterations)
 
-        points = [(0, 0)]
-        for _ in range(steps):
-            sim.step()
+    own_pool = pool is None
+    if own_pool:
+        pool = WarmPool(param, max_workers, kernel_keys([param]))
+    try:
+        futures = [pool.submit(diameter_series, sim_seed, steps, sample_every, model, parameters=param)
+                   for sim_seed in seeds]
+        diameters, hull_ratios = map(np.array, zip(*(future.result() for future in futures)))
+    finally:
+        if own_pool:
+            pool.shutdown()
 
-            hull = sim.inner_ring_detector()
-            if hull is None: continue
-            hull_ratio, hull_points = hull
+    # Every series starts at (0, 0), followed by the measurements
+    times = sample_every * np.arange(1, diameters.shape[1] + 1)
+    xs = np.column_stack([np.zeros(iterations), diameters])
+    ys = np.column_stack([np.zeros(iterations), np.where(np.isnan(diameters), np.nan, times)])
+    intercepts, slopes = utils.stacked_linear_regression(xs, ys)
 
-            area = utils.area_polygon(hull_points)
-            diameter = 2*np.sqrt(area/np.pi)
-
-            points.append((diameter, sim.time))
-            hull_ratios.append(hull_ratio)
-
-        points = np.array(points)
-        res = utils.linear_regression(points)
-        if res[0] is None:
-            continue
-
-        slopes.append(res[1])
-        intercepts.append(res[0])
-
-    return intercepts, slopes, hull_ratios
+    fitted = ~np.isnan(slopes)
+    return intercepts[fitted], slopes[fitted], hull_ratios[~np.isnan(hull_ratios)]
 
 
 def main():
+    import matplotlib.pyplot as plt
+
     # Validation parameters
     HULL_RATIO = 0.9
     STEPS = 50
     ITERS = 10
+    SAMPLE_EVERY = 1
     PLOT_TYPE = 1
 
     np.random.seed(42)
@@ -74,7 +130,8 @@ def main():
         raise Exception("Calibrating failed.")
 
     # Calculate CA slope for calibration
-    intercept_CA_arr, slope_CA_arr, hull_ratio_arr = estimate_CA_vars(sim_parameters, iterations=ITERS, steps=STEPS)
+    intercept_CA_arr, slope_CA_arr, hull_ratio_arr = estimate_CA_vars(
+        sim_parameters, iterations=ITERS, steps=STEPS, seed=42, sample_every=SAMPLE_EVERY)
 
     intercept_CA = np.mean(intercept_CA_arr)
     slope_CA = np.mean(slope_CA_arr)
@@ -0,0 +1,303 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+from utils import coordinate_array
+
+
+def dict_to_grid(state_dict: dict, n: int, pad: int = 5) -> np.ndarray:
+    """
+    Convert a sparse dictionary into a dense grid over its bounding box plus
+    `pad` cells, an n x n grid of zeros if it is empty
+    """
+    if not state_dict:
+        return np.zeros((n, n))
+
+    coords = np.array(list(state_dict.keys()))
+    ys, xs = coords[:, 0], coords[:, 1]
+    min_y, min_x = ys.min() - pad, xs.min() - pad
+
+    dense = np.zeros((ys.max() + pad - min_y + 1, xs.max() + pad - min_x + 1))
+    dense[ys - min_y, xs - min_x] = list(state_dict.values())
+    return dense
+
+
+class Viewport:
+    """
+    Dense state and toxicity arrays of stored frames for drawing, kept
+    between redraws. While following a simulation, `update` only writes the
+    cells that may have changed since the previous update, e.g. the union of
+    `CA.checked_coordinates` over the steps in between. When the colony
+    gets within `pad` cells of the edge the arrays grow on that side by
+    `chunk` cells or a quarter of their size, whichever is more, so a
+    growing colony only causes a reallocation once in a while rather than
+    every frame.
+
+    Toxins change nearly everywhere every step, so they are copied as a
+    whole, and only when asked for. Toxins outside the viewport are left
+    out, the viewport follows the states.
+    """
+    def __init__(self, n: int, pad: int = 5, chunk: int = 32):
+        self.n = n
+        self.pad = pad
+        self.chunk = chunk
+        self.reset()
+
+    def reset(self):
+        self.origin = (0, 0)
+        self.states = np.zeros((self.n, self.n), dtype=np.int8)
+        self.toxins = np.zeros((self.n, self.n), dtype=np.float32)
+        # Whether the arrays no longer hold the previous update, after
+        # showing an older frame
+        self._detached = True
+
+    @property
+    def extent(self) -> tuple[float, float, float, float]:
+        """
+        (left, right, bottom, top) of the arrays in grid coordinates, for
+        `imshow`
+        """
+        y0, x0 = self.origin
+        h, w = self.states.shape
+        return x0 - 0.5, x0 + w - 0.5, y0 - 0.5, y0 + h - 0.5
+
+    def _bounds(self, coords: np.ndarray) -> tuple[int, int, int, int]:
+        """
+        (min_y, max_y, min_x, max_x) the arrays have to cover for `coords`,
+        grown by `chunk` on every side where they fall short
+        """
+        y0, x0 = self.origin
+        h, w = self.states.shape
+        min_y, max_y, min_x, max_x = y0, y0 + h - 1, x0, x0 + w - 1
+        grow_y = max(self.chunk, h // 4)
+        grow_x = max(self.chunk, w // 4)
+
+        low = coords.min(axis=0) - self.pad
+        high = coords.max(axis=0) + self.pad
+        if low[0] < min_y:
+            min_y = int(low[0]) - grow_y
+        if high[0] > max_y:
+            max_y = int(high[0]) + grow_y
+        if low[1] < min_x:
+            min_x = int(low[1]) - grow_x
+        if high[1] > max_x:
+            max_x = int(high[1]) + grow_x
+        return min_y, max_y, min_x, max_x
+
+    def _grow(self, coords: np.ndarray) -> bool:
+        """
+        Reallocate the arrays if they do not cover `coords` with room to
+        spare. The new arrays are empty.
+        """
+        if not len(coords):
+            return False
+        bounds = self._bounds(coords)
+        y0, x0 = self.origin
+        h, w = self.states.shape
+        if bounds == (y0, y0 + h - 1, x0, x0 + w - 1):
+            return False
+
+        min_y, max_y, min_x, max_x = bounds
+        self.origin = (min_y, min_x)
+        shape = (max_y - min_y + 1, max_x - min_x + 1)
+        self.states = np.zeros(shape, dtype=np.int8)
+        self.toxins = np.zeros(shape, dtype=np.float32)
+        return True
+
+    def _grow_to(self, frame: "Frame") -> bool:
+        fy, fx = frame.origin
+        h, w = frame.states.shape
+        if not h or not w:
+            return False
+        return self._grow(np.array([(fy, fx), (fy + h - 1, fx + w - 1)]))
+
+    def _copy(self, array: np.ndarray, source: np.ndarray, origin: tuple[int, int]):
+        """
+        Write all of `array` from a frame array, zero outside of it. Parts of
+        the frame outside the viewport are left out.
+        """
+        array.fill(0)
+        y, x = origin[0] - self.origin[0], origin[1] - self.origin[1]
+        h, w = source.shape
+        top, left = max(y, 0), max(x, 0)
+        bottom, right = min(y + h, array.shape[0]), min(x + w, array.shape[1])
+        if top < bottom and left < right:
+            array[top:bottom, left:right] = source[top - y:bottom - y, left - x:right - x]
+
+    def show(self, frame: "Frame") -> bool:
+        """
+        Show a stored frame as a whole, e.g. an older one from the
+        timeline. The next `update` writes the arrays as a whole again.
+
+        :param frame: frame to show
+        :type frame: Frame
+        :return: whether the arrays were reallocated, which moves their
+            extent
+        :rtype: bool
+        """
+        grown = self._grow_to(frame)
+        self._copy(self.states, frame.states, frame.origin)
+        self._copy(self.toxins, frame.toxins, frame.origin)
+        self._detached = True
+        return grown
+
+    def update(self, frame: "Frame", changed=None, toxins: bool = True) -> bool:
+        """
+        Show the newest frame of a followed simulation
+
+        :param frame: frame to show
+        :type frame: Frame
+        :param changed: coordinates of every cell that may have changed
+            since the previous update, all cells are written again without
+            them or after `show`
+        :type changed: Collection | None
+        :param toxins: whether to copy the toxins, otherwise they are left
+            out of date until they are
+        :type toxins: bool
+        :return: whether the arrays were reallocated, which moves their
+            extent
+        :rtype: bool
+        """
+        if changed is None or self._detached:
+            grown = self._grow_to(frame)
+            self._copy(self.states, frame.states, frame.origin)
+        else:
+            # States of the changed cells in the frame, empty outside of it
+            coords = coordinate_array(changed)
+            local = coords - frame.origin
+            inside = ((local >= 0) & (local < frame.states.shape)).all(axis=1)
+            values = np.zeros(len(coords), dtype=self.states.dtype)
+            values[inside] = frame.states[local[inside, 0], local[inside, 1]]
+
+            grown = self._grow(coords[values != 0])
+            if grown:
+                # Everything is written again at the new origin
+                self._copy(self.states, frame.states, frame.origin)
+            else:
+                # Cells that became empty may lie outside the arrays
+                local = coords - self.origin
+                inside = ((local >= 0) & (local < self.states.shape)).all(axis=1)
+                self.states[local[inside, 0], local[inside, 1]] = values[inside]
+        self._detached = False
+
+        if toxins or grown:
+            self._copy(self.toxins, frame.toxins, frame.origin)
+        return grown
+
+
+class Frame:
+    """
+    Compact copy of the grids at one step: uint8 states and float16 (or
+    float32) toxins over their joint bounding box, index (0, 0) at `origin`
+    """
+    __slots__ = ("time", "origin", "states", "toxins")
+
+    def __init__(self, time: int, origin: tuple[int, int],
+                 states: np.ndarray, toxins: np.ndarray):
+        self.time = time
+        self.origin = origin
+        self.states = states
+        self.toxins = toxins
+
+    @classmethod
+    def from_grids(cls, time: int, state_grid: dict, toxicity_grid: dict,
+                   toxin_dtype=np.float16) -> "Frame":
+        """
+        Snapshot of a simulation's grids
+
+        :param time: step of the grids
+        :type time: int
+        :param state_grid: states of the simulation
+        :type state_grid: dict
+        :param toxicity_grid: toxicity of the simulation
+        :type toxicity_grid: dict
+        :param toxin_dtype: float16 or float32
+        :return: the frame
+        :rtype: Frame
+        """
+        state_coords = coordinate_array(state_grid.keys())
+        toxin_coords = coordinate_array(toxicity_grid.keys())
+        coords = np.concatenate([state_coords, toxin_coords])
+        if not len(coords):
+            return cls(time, (0, 0), np.zeros((0, 0), dtype=np.uint8),
+                       np.zeros((0, 0), dtype=toxin_dtype))
+
+        low = coords.min(axis=0)
+        shape = tuple(coords.max(axis=0) - low + 1)
+        states = np.zeros(shape, dtype=np.uint8)
+        toxins = np.zeros(shape, dtype=toxin_dtype)
+
+        state_coords -= low
+        toxin_coords -= low
+        states[state_coords[:, 0], state_coords[:, 1]] = np.fromiter(
+            state_grid.values(), dtype=np.uint8, count=len(state_grid))
+        toxins[toxin_coords[:, 0], toxin_coords[:, 1]] = np.fromiter(
+            toxicity_grid.values(), dtype=toxin_dtype, count=len(toxicity_grid))
+        return cls(time, (int(low[0]), int(low[1])), states, toxins)
+
+    @property
+    def nbytes(self) -> int:
+        return self.states.nbytes + self.toxins.nbytes
+
+
+class FrameBuffer:
+    """
+    Ring buffer of the most recent frames within a fixed memory budget, the
+    oldest frames are dropped to make room for new ones. Safe to fill from
+    one thread while another reads it.
+
+        frames = FrameBuffer(max_bytes=64 * 2**20)
+        frames.append(Frame.from_grids(sim.time, sim.state_grid, sim.toxicity_grid))
+        frame = frames.find(40)
+    """
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._frames: deque[Frame] = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def append(self, frame: Frame):
+        """
+        Add the frame of the next step, dropping the oldest ones while over
+        budget. The newest frame is always kept. A frame that does not
+        follow the newest one starts a new timeline.
+        """
+        with self._lock:
+            if self._frames and frame.time != self._frames[-1].time + 1:
+                self._frames.clear()
+                self.nbytes = 0
+            self._frames.append(frame)
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes and len(self._frames) > 1:
+                self.nbytes -= self._frames.popleft().nbytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def span(self) -> tuple[int, int] | None:
+        """
+        Steps of the oldest and newest frame, None if there are none
+        """
+        with self._lock:
+            if not self._frames:
+                return None
+            return self._frames[0].time, self._frames[-1].time
+
+    def find(self, time: int) -> Frame | None:
+        """
+        The frame of step `time`, None if it is not (or no longer) stored
+        """
+        with self._lock:
+            if not self._frames:
+                return None
+            # Frames are one step apart
+            index = time - self._frames[0].time
+            if 0 <= index < len(self._frames):
+                return self._frames[index]
+            return None